@@ -0,0 +1,297 @@
+"""
+Admission control with adaptive per-stage concurrency limits
+Each pipeline stage (stt, llm, tts) gets a StageLimiter: at most `limit`
+calls run at once, up to max_queue more wait (briefly) for a slot, and
+anything beyond that is refused right away with Overloaded, which the server
+turns into a 503 + Retry-After instead of letting requests pile up.
+
+The limit adapts to the backend (AIMD):
+    - latency is smoothed (EWMA) and compared with a slowly rising baseline
+      (the best smoothed latency seen recently)
+    - while latency stays within tolerance x baseline and the limit is actually
+      reached, it grows by about one per `limit` completions (additive increase)
+    - when latency exceeds that, or a call fails with an overload error
+      (rate limit, timeout), it is cut by `backoff` (multiplicative decrease),
+      at most once per smoothed latency
+
+A Bulkhead caps how many requests may be inside the expensive endpoints at
+all, and a second one caps the long-poll/SSE waiters, which hold a thread
+for up to a minute (SSE: five) without doing work. Together they always
+leave threads for cheap requests like /status and /get-audio-stream. Like
+the threads they protect, they are per worker process: with gunicorn the
+whole server admits up to WEB_CONCURRENCY x PIPELINE_REQUESTS pipeline
+requests and WEB_CONCURRENCY x WAITING_REQUESTS waiters.
+"""
+
+import math
+import time
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """A stage (or the bulkhead) is full; retry_after is a hint in whole seconds"""
+
+    def __init__(self, stage, retry_after):
+        super().__init__(f'{stage} is overloaded, retry in {retry_after}s')
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class AdaptiveLimit:
+    """AIMD concurrency limit driven by observed latency"""
+
+    def __init__(self, initial=4, min_limit=1, max_limit=32, tolerance=2.0, backoff=0.75,
+                 smoothing=0.3, baseline_drift=0.01):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.baseline_drift = baseline_drift
+        self.ewma = None
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+
+    def on_sample(self, latency, in_flight, overloaded=False):
+        """Record one finished call; in_flight is the number running when it finished (itself included)"""
+        now = time.monotonic()
+        self.ewma = latency if self.ewma is None else self.ewma + self.smoothing * (latency - self.ewma)
+        if self.baseline is None or self.ewma < self.baseline:
+            self.baseline = self.ewma
+        else:
+            # Let the baseline follow a backend that got permanently slower
+            self.baseline += self.baseline_drift * (self.ewma - self.baseline)
+
+        if overloaded or self.ewma > self.baseline * self.tolerance:
+            if now - self.last_decrease >= self.ewma:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.last_decrease = now
+                self.decreases += 1
+        elif in_flight >= int(self.limit):
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.increases += 1
+
+    @property
+    def current(self):
+        return max(self.min_limit, int(self.limit))
+
+
+class StageLimiter:
+    """Concurrency limit plus a short bounded queue for one pipeline stage"""
+
+    def __init__(self, name, limit, max_queue=8, queue_timeout=5.0, is_overload=None, enabled=True):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.is_overload = is_overload or (lambda e: False)
+        self.enabled = enabled
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._counters = {'admitted': 0, 'queued': 0, 'shed': 0, 'timeouts': 0, 'failures': 0}
+
+    def retry_after(self):
+        """Seconds until a new caller would probably get a slot"""
+        latency = self.limit.ewma or 1.0
+        return max(1, math.ceil(latency * (self._waiting + 1) / self.limit.current))
+
+    def check(self):
+        """Raise Overloaded now if a caller would be refused (nothing is reserved)"""
+        with self._cond:
+            if self.enabled and self._in_flight >= self.limit.current and self._waiting >= self.max_queue:
+                self._counters['shed'] += 1
+                raise Overloaded(self.name, self.retry_after())
+
+    def _acquire(self):
+        with self._cond:
+            if self._in_flight >= self.limit.current:
+                if self._waiting >= self.max_queue:
+                    self._counters['shed'] += 1
+                    raise Overloaded(self.name, self.retry_after())
+                self._counters['queued'] += 1
+                self._waiting += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self._in_flight >= self.limit.current:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._counters['timeouts'] += 1
+                            raise Overloaded(self.name, self.retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._in_flight += 1
+            self._counters['admitted'] += 1
+
+    def _try_acquire(self):
+        """Take a slot if one is free right now, without queueing"""
+        with self._cond:
+            if self._in_flight >= self.limit.current:
+                return False
+            self._in_flight += 1
+            self._counters['admitted'] += 1
+            return True
+
+    def _abandon(self):
+        """Give back a slot its caller never used (it was cancelled while queued)"""
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def _release(self, latency, error):
+        with self._cond:
+            overloaded = error is not None and self.is_overload(error)
+            if error is not None:
+                self._counters['failures'] += 1
+            self.limit.on_sample(latency, self._in_flight, overloaded)
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the stage's slots for a block; raises Overloaded if none comes free in time"""
+        if not self.enabled:
+            yield
+            return
+        self._acquire()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._release(time.perf_counter() - started, error)
+
+    @asynccontextmanager
+    async def aslot(self):
+        """
+        slot() for coroutines: a free slot is taken right away, and queueing for one
+        happens on a worker thread so the event loop keeps running
+        """
+        if not self.enabled:
+            yield
+            return
+        if not self._try_acquire():
+            queued = asyncio.get_running_loop().run_in_executor(None, self._acquire)
+            try:
+                await asyncio.shield(queued)
+            except asyncio.CancelledError:
+                # The thread may still get the slot after the caller is gone
+                def give_back(future):
+                    if not future.cancelled() and future.exception() is None:
+                        self._abandon()
+                queued.add_done_callback(give_back)
+                raise
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._release(time.perf_counter() - started, error)
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self._counters,
+                limit=self.limit.current,
+                in_flight=self._in_flight,
+                waiting=self._waiting,
+                latency_ms=round(self.limit.ewma * 1000, 1) if self.limit.ewma is not None else None,
+                baseline_ms=round(self.limit.baseline * 1000, 1) if self.limit.baseline is not None else None,
+                increases=self.limit.increases,
+                decreases=self.limit.decreases
+            )
+
+
+class Bulkhead:
+    """Non-blocking cap on concurrent requests of one kind"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._rejected = 0
+
+    def try_acquire(self):
+        with self._lock:
+            if self.capacity and self._in_use >= self.capacity:
+                self._rejected += 1
+                return False
+            self._in_use += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._in_use -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'capacity': self.capacity, 'in_use': self._in_use, 'rejected': self._rejected}
+
+
+class AdmissionControl:
+    """Stage limiters by name plus the bulkheads for pipeline requests and long-poll/SSE waiters"""
+
+    def __init__(self, stages, bulkhead, waiters=None):
+        self.stages = stages
+        self.bulkhead = bulkhead
+        self.waiters = waiters if waiters is not None else Bulkhead(0)
+
+    def stage(self, name):
+        return self.stages[name]
+
+    def retry_after(self):
+        return max((stage.retry_after() for stage in self.stages.values()), default=1)
+
+    def stats(self):
+        stats = {name: stage.stats() for name, stage in self.stages.items()}
+        stats['requests'] = self.bulkhead.stats()
+        stats['waiters'] = self.waiters.stats()
+        return stats
+
+
+def create_admission_control(stage_names, is_overload=None, getenv=None):
+    """
+    Build limiters configured by ADMISSION (0 disables), ADMISSION_<STAGE>_LIMIT,
+    ADMISSION_MAX_LIMIT, ADMISSION_QUEUE, ADMISSION_QUEUE_TIMEOUT, ADMISSION_TOLERANCE
+    and the bulkhead sizes (0 = unlimited):
+        WAITING_REQUESTS   long-poll/SSE waiters, defaults to GUNICORN_THREADS // 4
+        PIPELINE_REQUESTS  pipeline requests, defaults to what is left of
+                           GUNICORN_THREADS after the waiters and two spare threads
+    All limits apply to this process, i.e. to one gunicorn worker and its threads.
+    """
+    import os
+    getenv = getenv or os.getenv
+    enabled = getenv('ADMISSION', '1').lower() not in ('0', 'false', 'no')
+    stages = {}
+    for name in stage_names:
+        limit = AdaptiveLimit(
+            initial=int(getenv(f'ADMISSION_{name.upper()}_LIMIT', 4)),
+            max_limit=int(getenv('ADMISSION_MAX_LIMIT', 32)),
+            tolerance=float(getenv('ADMISSION_TOLERANCE', 2.0))
+        )
+        stages[name] = StageLimiter(
+            name, limit,
+            max_queue=int(getenv('ADMISSION_QUEUE', 8)),
+            queue_timeout=float(getenv('ADMISSION_QUEUE_TIMEOUT', 5)),
+            is_overload=is_overload,
+            enabled=enabled
+        )
+    threads = int(getenv('GUNICORN_THREADS', 8))
+    waiting = int(getenv('WAITING_REQUESTS', max(1, threads // 4))) if enabled else 0
+    capacity = int(getenv('PIPELINE_REQUESTS', max(1, threads - 2 - waiting))) if enabled else 0
+    return AdmissionControl(stages, Bulkhead(capacity), Bulkhead(waiting))
@@ -0,0 +1,509 @@
+"""
+Smart Voice Assistant Server - ASYNC (ASGI) MODE
+Same routes as server.py, served by Starlette/uvicorn so one process can
+hold hundreds of in-flight voice requests:
+    - Groq calls go through the shared key pool's async clients (groq_pool.py)
+    - gTTS runs in a bounded thread pool so it never blocks the event loop
+    - every STT/LLM/TTS call holds a slot of its stage, with the same adaptive
+      limits as server.py (admission.py)
+    - /wait and /ws wait for audio on the event loop, so idle devices cost no threads
+Sessions and the TTS cache are shared with server.py. Session store calls
+(SQLite queries, fcntl locks with SESSION_BACKEND=sqlite) run on the thread
+pool, so a slow lock never stalls the loop and its waiters.
+
+Run with:  uvicorn asgi_server:app --host 0.0.0.0 --port 10000
+"""
+
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocketDisconnect
+
+from server import (
+    sessions, device_events, web_ui, admission, tts_cache, transcoder, groq_pool, chat_messages, remember, synthesize_mp3,
+    transcode, audio_state, engine_registry, STT_MODEL, LLM_MODEL, MAX_ANSWER_TOKENS, MAX_UPLOAD_SIZE, TTS_LANG,
+    STREAM_POLL_INTERVAL, STREAM_TIMEOUT, LONG_POLL_TIMEOUT, LONG_POLL_MAX, SSE_KEEPALIVE,
+    SSE_TIMEOUT
+)
+from session_store import clean_device_id
+from tts_cache import make_key
+import audio_formats
+from audio_formats import FormatUnavailable
+from groq_pool import PoolBusy
+from admission import Overloaded
+from sentences import SentenceSplitter
+
+logger = logging.getLogger(__name__)
+
+# Bounded pool for blocking gTTS calls
+TTS_WORKERS = int(os.getenv('ASYNC_TTS_WORKERS', 16))
+tts_executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix='async-tts')
+
+# Async view of the Groq key pool (same keys, limits and breakers as server.py)
+aclient = groq_pool.async_client if groq_pool is not None else None
+
+# Keep references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+
+
+async def synthesize(text):
+    """Run cached gTTS synthesis on the bounded executor (it takes its tts stage slot there)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(tts_executor, synthesize_mp3, text)
+
+
+def get_device_id(request, form=None):
+    """Read the device/session ID from the query string, form or X-Device-ID header"""
+    return clean_device_id(
+        request.query_params.get('device_id')
+        or (form.get('device_id') if form is not None else None)
+        or request.headers.get('X-Device-ID')
+    )
+
+
+def request_flag(request, name, form=None):
+    """True if a boolean option is set in the query string or form"""
+    value = request.query_params.get(name) or (form.get(name) if form is not None else None) or ''
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def negotiate_format(request):
+    """Playback format from ?format= or the Accept header (see audio_formats.py)"""
+    return audio_formats.negotiate(request.query_params.get('format'), request.headers.get('accept'))
+
+
+def format_error(e):
+    status_code = 406 if isinstance(e, FormatUnavailable) else 400
+    return JSONResponse({
+        'error': f'Unsupported audio format: {e.args[0]}',
+        'formats': audio_formats.available_formats()
+    }, status_code=status_code)
+
+
+async def convert(fmt, key, audio_bytes):
+    """Transcode on the TTS executor (the ADPCM encoder is CPU-bound)"""
+    if fmt.encode is None:
+        return audio_bytes
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(tts_executor, transcode, fmt, key, lambda: audio_bytes)
+
+
+def error(message, status_code):
+    return JSONResponse({'status': 'error', 'error': message}, status_code=status_code)
+
+
+def pipeline_error(prefix, e):
+    """500 for a failed Groq call, 503 + Retry-After when every key is rate limited or the stage is full"""
+    if isinstance(e, (PoolBusy, Overloaded)):
+        response = error('السيرفر مشغول، حاول مرة أخرى', 503)
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    return error(f'{prefix}: {str(e)}', 500)
+
+
+def ui_response(request, name):
+    """Precompressed UI file (see server.ui_response)"""
+    result = web_ui.respond(name, request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+    if result is None:
+        return error('Not found', 404)
+    status, body, headers = result
+    return Response(body, status_code=status, headers=headers)
+
+
+async def index(request):
+    """Serve the main HTML page"""
+    return ui_response(request, 'index.html')
+
+
+async def ui_asset(request):
+    """Versioned CSS/JS of the page (WEB_UI_SPLIT_ASSETS=1)"""
+    return ui_response(request, request.path_params['name'])
+
+
+async def stream_response(device_id, user_text):
+    """Async streaming mode worker (see server.stream_response)"""
+    pending = []
+    response_parts = []
+    first_chunk = True
+
+    async def flush_ready(wait=False):
+        nonlocal first_chunk
+        while pending and (wait or pending[0].done()):
+            await run_in_threadpool(sessions.append_audio_chunk, device_id, await pending.pop(0))
+            if first_chunk:
+                first_chunk = False
+                await run_in_threadpool(sessions.update, device_id, status='sending_to_esp32')
+
+    try:
+        messages = await run_in_threadpool(chat_messages, user_text, device_id)
+        splitter = SentenceSplitter()
+        # The LLM slot is held until the answer is complete
+        async with admission.stage('llm').aslot():
+            stream = await aclient.chat.completions.create(
+                model=LLM_MODEL,
+                messages=messages,
+                max_tokens=MAX_ANSWER_TOKENS,
+                temperature=0.7,
+                stream=True
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ''
+                response_parts.append(delta)
+                for sentence in splitter.feed(delta):
+                    pending.append(asyncio.ensure_future(synthesize(sentence)))
+                await flush_ready()
+        for sentence in splitter.flush():
+            pending.append(asyncio.ensure_future(synthesize(sentence)))
+        await flush_ready(wait=True)
+
+        response_text = ''.join(response_parts)
+        chunks = await run_in_threadpool(sessions.get_audio_chunks, device_id)
+        await run_in_threadpool(
+            sessions.update,
+            device_id,
+            response_text=response_text,
+            audio_data=b''.join(chunks),
+            has_audio=True,
+            status='sending_to_esp32',
+            stream_state='done'
+        )
+        await run_in_threadpool(remember, device_id, user_text, response_text)
+    except Exception as e:
+        logger.error(f"Streaming error: {str(e)}")
+        for future in pending:
+            future.cancel()
+        await run_in_threadpool(sessions.update, device_id, status='ready', stream_state='error')
+
+
+async def upload_audio(request):
+    """Async version of server.upload_audio"""
+    device_id = get_device_id(request)
+    try:
+        if aclient is None:
+            logger.error("Groq client not initialized")
+            return error('Groq API key not configured', 500)
+
+        content_length = int(request.headers.get('content-length') or 0)
+        if content_length > MAX_UPLOAD_SIZE:
+            return JSONResponse({'error': 'الملف كبير جداً. الحد الأقصى 10MB'}, status_code=413)
+
+        # Shed before reading the body when the first stage is full (as server.py does)
+        try:
+            admission.stage('stt').check()
+        except Overloaded as e:
+            return pipeline_error('', e)
+
+        form = await request.form()
+        device_id = get_device_id(request, form)
+        audio_file = form.get('audio')
+
+        if audio_file is None or isinstance(audio_file, str):
+            logger.warning("No audio file in request")
+            return error('لم يتم إرسال ملف صوتي', 400)
+
+        if not audio_file.filename:
+            logger.warning("Empty audio filename")
+            return error('اسم الملف فارغ', 400)
+
+        logger.info(f"Received audio file: {audio_file.filename} (device {device_id})")
+        await run_in_threadpool(sessions.update, device_id, status='processing')
+
+        # Step 1: Whisper
+        try:
+            # UploadFile is already spooled to disk; stream it to Groq instead of reading it in
+            async with admission.stage('stt').aslot():
+                transcript = await aclient.audio.transcriptions.create(
+                    model=STT_MODEL,
+                    file=(audio_file.filename, audio_file.file, audio_file.content_type),
+                    language="ar"
+                )
+            user_text = transcript.text
+            await run_in_threadpool(sessions.update, device_id, text=user_text)
+        except Exception as e:
+            logger.error(f"Whisper error: {str(e)}")
+            await run_in_threadpool(sessions.update, device_id, status='ready')
+            return pipeline_error('خطأ في تحويل الصوت', e)
+
+        if request_flag(request, 'stream', form):
+            await run_in_threadpool(sessions.reset_audio_chunks, device_id)
+            await run_in_threadpool(
+                sessions.update,
+                device_id,
+                audio_data=None,
+                has_audio=False,
+                response_text='',
+                stream_state='streaming'
+            )
+            task = asyncio.ensure_future(stream_response(device_id, user_text))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+            return JSONResponse({
+                'status': 'ok',
+                'text': user_text,
+                'response': None,
+                'streaming': True,
+                'device_id': device_id,
+                'audio_url': f'/get-audio-stream?device_id={device_id}&stream=1'
+            })
+
+        # Step 2: Llama
+        try:
+            messages = await run_in_threadpool(chat_messages, user_text, device_id)
+            async with admission.stage('llm').aslot():
+                chat_response = await aclient.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=messages,
+                    max_tokens=MAX_ANSWER_TOKENS,
+                    temperature=0.7
+                )
+            response_text = chat_response.choices[0].message.content
+            await run_in_threadpool(sessions.update, device_id, response_text=response_text)
+        except Exception as e:
+            logger.error(f"AI error: {str(e)}")
+            await run_in_threadpool(sessions.update, device_id, status='ready')
+            return pipeline_error('خطأ في الذكاء الاصطناعي', e)
+
+        # Step 3: gTTS (off the event loop)
+        try:
+            audio_bytes = await synthesize(response_text)
+            await run_in_threadpool(
+                sessions.update,
+                device_id,
+                audio_data=audio_bytes,
+                has_audio=True,
+                status='sending_to_esp32',
+                stream_state='idle'
+            )
+        except Exception as e:
+            logger.error(f"TTS error: {str(e)}")
+            await run_in_threadpool(sessions.update, device_id, status='ready')
+            return pipeline_error('خطأ في TTS', e)
+        # Only an answer the device can play becomes part of the conversation
+        await run_in_threadpool(remember, device_id, user_text, response_text)
+
+        return JSONResponse({
+            'status': 'ok',
+            'text': user_text,
+            'response': response_text,
+            'device_id': device_id,
+            'audio_url': f'/get-audio-stream?device_id={device_id}'
+        })
+
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        await run_in_threadpool(sessions.update, device_id, status='ready')
+        return error(f'خطأ غير متوقع: {str(e)}', 500)
+
+
+async def text_to_speech(request):
+    """Convert text to speech using gTTS (FREE)"""
+    try:
+        # A missing or non-JSON body is a client error like an empty text (as in server.py)
+        try:
+            data = await request.json()
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            data = {}
+        text = data.get('text', '')
+
+        if not text or not isinstance(text, str):
+            return JSONResponse({'error': 'لم يتم إرسال نص'}, status_code=400)
+
+        try:
+            fmt = negotiate_format(request)
+        except (KeyError, FormatUnavailable) as e:
+            return format_error(e)
+
+        mp3_bytes = await synthesize(text)
+        # The default engine spoke it, so its name is the cache voice (as in server.py)
+        voice = engine_registry.get('tts').name
+        audio_bytes = await convert(fmt, make_key(text, TTS_LANG, voice), mp3_bytes)
+        return Response(
+            audio_bytes,
+            media_type=fmt.mimetype,
+            headers={
+                'Content-Disposition': f'attachment; filename=speech.{fmt.extension}',
+                'Vary': 'Accept'
+            }
+        )
+    except Overloaded as e:
+        logger.warning(f"TTS request shed: {str(e)}")
+        return pipeline_error('', e)
+    except Exception as e:
+        logger.error(f"TTS error: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def iter_audio_stream(device_id):
+    """Async version of server.iter_audio_stream"""
+    seq = 0
+    deadline = time.monotonic() + STREAM_TIMEOUT
+    while time.monotonic() < deadline:
+        chunks = await run_in_threadpool(sessions.get_audio_chunks, device_id, seq)
+        seq += len(chunks)
+        for chunk in chunks:
+            yield chunk
+        if chunks:
+            continue
+        session = await run_in_threadpool(sessions.get, device_id, include_audio=False)
+        if session['stream_state'] != 'streaming':
+            for chunk in await run_in_threadpool(sessions.get_audio_chunks, device_id, seq):
+                yield chunk
+            break
+        await asyncio.sleep(STREAM_POLL_INTERVAL)
+    await run_in_threadpool(sessions.update, device_id, status='ready')
+
+
+def take_audio(device_id):
+    """(audio, etag) of the device's answer, marking it delivered; None if there is none"""
+    with sessions.lock(device_id):
+        session = sessions.get(device_id)
+        if not session['has_audio'] or session['audio_data'] is None:
+            return None
+        sessions.update(device_id, status='ready')
+        return session['audio_data'], session['audio_etag']
+
+
+async def get_audio_stream(request):
+    """Return audio for ESP32"""
+    try:
+        device_id = get_device_id(request)
+        try:
+            fmt = negotiate_format(request)
+        except (KeyError, FormatUnavailable) as e:
+            return format_error(e)
+
+        if request_flag(request, 'stream') and fmt.encode is None:
+            session = await run_in_threadpool(sessions.get, device_id, include_audio=False)
+            if session['stream_state'] == 'streaming':
+                return StreamingResponse(iter_audio_stream(device_id), media_type='audio/mpeg')
+
+        audio = await run_in_threadpool(take_audio, device_id)
+        if audio is None:
+            return JSONResponse({'error': 'No audio available'}, status_code=404)
+        audio_bytes, etag = audio
+
+        audio_bytes = await convert(fmt, etag, audio_bytes)
+        return Response(audio_bytes, media_type=fmt.mimetype, headers={'Vary': 'Accept'})
+    except Exception as e:
+        logger.error(f"Error sending audio: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+async def get_status(request):
+    """Return system status"""
+    device_id = get_device_id(request)
+    session = await run_in_threadpool(sessions.get, device_id, include_audio=False)
+    return JSONResponse({
+        'server': 'online',
+        'device_id': device_id,
+        'esp32_status': session['status'],
+        'has_audio': session['has_audio']
+    })
+
+
+def known_audio_seq(params):
+    """Number of the answer the device already played (?seq=), None if not given"""
+    try:
+        return int(params['seq'])
+    except (KeyError, ValueError):
+        return None
+
+
+async def wait_for_audio(request):
+    """Async version of server.wait_for_audio (long-poll)"""
+    device_id = get_device_id(request)
+    known_seq = known_audio_seq(request.query_params)
+    try:
+        timeout = min(float(request.query_params.get('timeout', LONG_POLL_TIMEOUT)), LONG_POLL_MAX)
+    except ValueError:
+        return error('timeout must be a number', 400)
+
+    deadline = time.monotonic() + timeout
+    while True:
+        version = device_events.version(device_id)
+        session = await run_in_threadpool(sessions.get, device_id, include_audio=False)
+        state = audio_state(device_id, session, known_seq)
+        if state['ready']:
+            return JSONResponse(state)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return Response(status_code=204)
+        await device_events.wait_async(device_id, version, remaining)
+
+
+async def device_socket(websocket):
+    """
+    WebSocket channel for a device: one JSON message per session change
+    ({'event': 'audio_ready' | 'status', ...audio_state}) and a keep-alive
+    message when nothing changed for SSE_KEEPALIVE seconds.
+    """
+    await websocket.accept()
+    device_id = clean_device_id(
+        websocket.query_params.get('device_id') or websocket.headers.get('X-Device-ID')
+    )
+    known_seq = known_audio_seq(websocket.query_params)
+    last = None
+    deadline = time.monotonic() + SSE_TIMEOUT
+    try:
+        while time.monotonic() < deadline:
+            version = device_events.version(device_id)
+            session = await run_in_threadpool(sessions.get, device_id, include_audio=False)
+            state = audio_state(device_id, session, known_seq)
+            if state != last:
+                last = state
+                await websocket.send_json(dict(state, event='audio_ready' if state['ready'] else 'status'))
+            else:
+                await websocket.send_json({'event': 'keep-alive'})
+            await device_events.wait_async(device_id, version, SSE_KEEPALIVE)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
+async def clear_audio(request):
+    """Clear audio buffer"""
+    device_id = get_device_id(request)
+    await run_in_threadpool(sessions.clear, device_id)
+    return JSONResponse({'status': 'cleared'})
+
+
+async def cache_stats(request):
+    """Return cache hit/miss counters"""
+    return JSONResponse({'tts': tts_cache.stats(), 'formats': transcoder.cache.stats()})
+
+
+routes = [
+    Route('/', index),
+    Route('/assets/{name}', ui_asset),
+    Route('/upload', upload_audio, methods=['POST']),
+    Route('/tts', text_to_speech, methods=['POST']),
+    Route('/get-audio-stream', get_audio_stream, methods=['GET']),
+    Route('/status', get_status, methods=['GET']),
+    Route('/wait', wait_for_audio, methods=['GET']),
+    WebSocketRoute('/ws', device_socket),
+    Route('/clear', clear_audio, methods=['POST']),
+    Route('/cache/stats', cache_stats, methods=['GET']),
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    port = int(os.environ.get('PORT', 10000))
+    logger.info(f"Starting async server on port {port}")
+    uvicorn.run(app, host='0.0.0.0', port=port)
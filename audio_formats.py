@@ -0,0 +1,268 @@
+"""
+Playback formats for constrained clients
+gTTS produces 24 kHz mp3, which an ESP32 has to decode in software. Clients
+can ask for something cheaper with ?format=<name> or an Accept header:
+
+    mp3      audio/mpeg                 gTTS output as-is (default)
+    mp3-low  audio/mpeg;bitrate=32000   16 kHz mono 32 kbps mp3 (needs ffmpeg)
+    pcm16    audio/pcm;rate=16000       headerless 16-bit little-endian mono
+    pcm8     audio/pcm;rate=8000
+    adpcm    audio/x-ima-adpcm          4-bit IMA-ADPCM in a WAV container, 16 kHz
+    adpcm8   audio/x-ima-adpcm;rate=8000
+
+The mp3 is decoded with the decoders registered in audio_preprocess (the
+ffmpeg one, or any in-process decoder registered with register_decoder())
+and resampled with NumPy, so every format but mp3 needs NumPy and, unless
+another mp3 decoder is registered, the ffmpeg binary on the PATH. Without
+them only mp3 is offered; missing_requirement() says what is lacking. Each
+(source audio, format) pair is converted once and kept in a TTSCache, so
+repeated downloads and Range resumes are cheap.
+"""
+
+import struct
+import shutil
+import logging
+import subprocess
+from collections import namedtuple
+
+import audio_preprocess
+from audio_preprocess import np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FORMAT = 'mp3'
+LOW_MP3_BITRATE = 32000
+
+# IMA-ADPCM block size in bytes (mono: 4 header bytes + 2 samples per byte)
+ADPCM_BLOCK_ALIGN = 256
+ADPCM_SAMPLES_PER_BLOCK = (ADPCM_BLOCK_ALIGN - 4) * 2 + 1
+
+Format = namedtuple('Format', 'name mimetype extension rate encode')
+
+
+class FormatUnavailable(Exception):
+    """The requested format can't be produced on this server"""
+
+
+def _to_int16(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+
+
+def encode_pcm(samples, rate):
+    """Headerless 16-bit little-endian mono PCM"""
+    return _to_int16(samples).tobytes()
+
+
+_ADPCM_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767
+)
+_ADPCM_INDEX = (-1, -1, -1, -1, 2, 4, 6, 8) * 2
+
+
+def _adpcm_codes(pcm, predictor, index):
+    """Encode int samples to 4-bit IMA codes; returns (codes, predictor, index)"""
+    # Every code depends on the previous predictor, so this part can't be vectorized
+    steps = _ADPCM_STEPS
+    index_table = _ADPCM_INDEX
+    codes = []
+    append = codes.append
+    for sample in pcm:
+        step = steps[index]
+        diff = sample - predictor
+        code = 0
+        if diff < 0:
+            code = 8
+            diff = -diff
+        delta = step >> 3
+        if diff >= step:
+            code |= 4
+            diff -= step
+            delta += step
+        step >>= 1
+        if diff >= step:
+            code |= 2
+            diff -= step
+            delta += step
+        step >>= 1
+        if diff >= step:
+            code |= 1
+            delta += step
+        predictor = predictor - delta if code & 8 else predictor + delta
+        if predictor > 32767:
+            predictor = 32767
+        elif predictor < -32768:
+            predictor = -32768
+        index += index_table[code]
+        if index < 0:
+            index = 0
+        elif index > 88:
+            index = 88
+        append(code)
+    return codes, predictor, index
+
+
+def encode_ima_adpcm(samples, rate):
+    """Mono IMA-ADPCM WAV (format 0x11), the layout most embedded WAV decoders accept"""
+    pcm = _to_int16(samples)
+    n_samples = len(pcm)
+    n_blocks = max(1, -(-n_samples // ADPCM_SAMPLES_PER_BLOCK))
+    padded = np.zeros(n_blocks * ADPCM_SAMPLES_PER_BLOCK, dtype='<i2')
+    padded[:n_samples] = pcm
+    blocks = padded.reshape(n_blocks, ADPCM_SAMPLES_PER_BLOCK)
+
+    data = bytearray()
+    index = 0
+    for block in blocks:
+        # Block header: first sample verbatim, current step index, reserved byte
+        first = int(block[0])
+        codes, _, index_out = _adpcm_codes(block[1:].tolist(), first, index)
+        data += struct.pack('<hBB', first, index, 0)
+        packed = np.asarray(codes, dtype=np.uint8).reshape(-1, 2)
+        data += (packed[:, 0] | (packed[:, 1] << 4)).astype(np.uint8).tobytes()
+        index = index_out
+
+    byte_rate = rate * ADPCM_BLOCK_ALIGN // ADPCM_SAMPLES_PER_BLOCK
+    fmt = struct.pack('<HHIIHHHH', 0x11, 1, rate, byte_rate, ADPCM_BLOCK_ALIGN, 4, 2, ADPCM_SAMPLES_PER_BLOCK)
+    chunks = (
+        b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+        + b'fact' + struct.pack('<II', 4, n_samples)
+        + b'data' + struct.pack('<I', len(data)) + bytes(data)
+    )
+    return b'RIFF' + struct.pack('<I', 4 + len(chunks)) + b'WAVE' + chunks
+
+
+def encode_low_mp3(samples, rate):
+    """Re-encode as small mono mp3 with ffmpeg"""
+    proc = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error',
+         '-f', 's16le', '-ar', str(rate), '-ac', '1', '-i', 'pipe:0',
+         '-b:a', str(LOW_MP3_BITRATE), '-f', 'mp3', 'pipe:1'],
+        input=encode_pcm(samples, rate), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        timeout=30, check=True
+    )
+    return proc.stdout
+
+
+FORMATS = {
+    'mp3': Format('mp3', 'audio/mpeg', 'mp3', None, None),
+    'mp3-low': Format('mp3-low', 'audio/mpeg', 'mp3', 16000, encode_low_mp3),
+    'pcm16': Format('pcm16', 'audio/pcm;rate=16000;channels=1', 'pcm', 16000, encode_pcm),
+    'pcm8': Format('pcm8', 'audio/pcm;rate=8000;channels=1', 'pcm', 8000, encode_pcm),
+    'adpcm': Format('adpcm', 'audio/x-ima-adpcm', 'wav', 16000, encode_ima_adpcm),
+    'adpcm8': Format('adpcm8', 'audio/x-ima-adpcm;rate=8000', 'wav', 8000, encode_ima_adpcm),
+}
+
+
+def _mp3_decoder():
+    return audio_preprocess.find_decoder('speech.mp3', 'audio/mpeg')
+
+
+def missing_requirement(name):
+    """What this server lacks to produce a known format ('numpy', 'ffmpeg'), or None"""
+    fmt = FORMATS[name]
+    if fmt.encode is None:
+        return None
+    if np is None:
+        return 'numpy'
+    if _mp3_decoder() is None or fmt.encode is encode_low_mp3 and shutil.which('ffmpeg') is None:
+        return 'ffmpeg'
+    return None
+
+
+def available(name):
+    """True if this server can produce the named format"""
+    return name in FORMATS and missing_requirement(name) is None
+
+
+def available_formats():
+    return [name for name in FORMATS if available(name)]
+
+
+def _media_format(media_type, params):
+    """Map one Accept media range to a format name (or None)"""
+    rate = params.get('rate')
+    if media_type in ('*/*', 'audio/*', 'audio/mpeg', 'audio/mp3'):
+        bitrate = params.get('bitrate', '')
+        if bitrate.isdigit() and int(bitrate) <= LOW_MP3_BITRATE:
+            return 'mp3-low'
+        return 'mp3'
+    if media_type == 'audio/pcm':
+        return 'pcm8' if rate == '8000' else 'pcm16'
+    if media_type in ('audio/x-ima-adpcm', 'audio/ima-adpcm', 'audio/adpcm'):
+        return 'adpcm8' if rate == '8000' else 'adpcm'
+    return None
+
+
+def parse_accept(header):
+    """Available format names from an Accept header, best first"""
+    candidates = []
+    for position, item in enumerate((header or '').split(',')):
+        media_type, *raw_params = [part.strip() for part in item.split(';')]
+        params = dict(
+            (key.strip().lower(), value.strip().strip('"'))
+            for key, _, value in (p.partition('=') for p in raw_params)
+        )
+        try:
+            q = float(params.get('q', 1))
+        except ValueError:
+            q = 1.0
+        name = _media_format(media_type.lower(), params)
+        if name is not None and q > 0 and available(name):
+            candidates.append((-q, position, name))
+    return [name for _, _, name in sorted(candidates)]
+
+
+def negotiate(query_format=None, accept=None):
+    """
+    Pick the output format: ?format= wins, then the Accept header, then mp3
+    Raises KeyError for unknown names and FormatUnavailable when the format
+    exists but can't be produced here.
+    """
+    if query_format:
+        name = query_format.strip().lower()
+        if name not in FORMATS:
+            raise KeyError(name)
+        if not available(name):
+            raise FormatUnavailable(name)
+        return FORMATS[name]
+    preferred = parse_accept(accept)
+    return FORMATS[preferred[0] if preferred else DEFAULT_FORMAT]
+
+
+def variant_etag(etag, fmt):
+    return etag if fmt.encode is None else f'{etag}-{fmt.name}'
+
+
+class Transcoder:
+    """Convert mp3 into other formats once per (source, format), cached in a TTSCache"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def convert(self, fmt, key, load):
+        """
+        Return fmt's bytes for the source identified by key; load() returns
+        the source mp3 and is only called on a cache miss
+        """
+        if fmt.encode is None:
+            return load()
+        cache_key = f'{key}-{fmt.name}'
+        data = self.cache.get(cache_key)
+        if data is not None:
+            return data
+
+        decoder = _mp3_decoder()
+        if np is None or decoder is None:
+            raise FormatUnavailable(fmt.name)
+        samples, rate = decoder(load(), 'audio/mpeg')
+        mono = audio_preprocess.resample(audio_preprocess.downmix(samples), rate, fmt.rate)
+        data = fmt.encode(mono, fmt.rate)
+        self.cache.put(cache_key, data)
+        logger.info(f"Transcoded audio to {fmt.name} ({len(data)} bytes)")
+        return data
@@ -0,0 +1,221 @@
+"""
+Server-side audio preprocessing before Whisper
+decode -> downmix to mono -> resample to 16 kHz -> trim silence (energy VAD)
+-> re-encode as 16-bit mono WAV
+
+WAV and raw PCM are decoded in pure Python/NumPy. Compressed formats
+(webm/opus, ogg, mp4...) need a decoder registered with register_decoder();
+an ffmpeg-based one is registered automatically when ffmpeg is on PATH.
+If no decoder matches, the original bytes are passed through untouched.
+"""
+
+import io
+import re
+import wave
+import shutil
+import logging
+import subprocess
+
+try:
+    import numpy as np
+except ImportError:  # preprocessing is optional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+TARGET_RATE = 16000
+
+# Energy VAD settings
+FRAME_MS = 20
+SILENCE_DB = -40.0      # frames quieter than this (dBFS) count as silence
+PEAK_RELATIVE_DB = -35.0  # ... or this far below the loudest frame
+PAD_MS = 200            # keep this much audio around detected speech
+
+# Pluggable decoders: list of (predicate(filename, mimetype), decode(bytes, mimetype))
+# decode returns (float32 samples shaped (n, channels), sample_rate)
+_decoders = []
+
+
+def available():
+    """True if NumPy is installed and preprocessing can run"""
+    return np is not None
+
+
+def register_decoder(predicate, decode, first=False):
+    """Add a decoder; predicate(filename, mimetype) says whether it handles the input"""
+    entry = (predicate, decode)
+    if first:
+        _decoders.insert(0, entry)
+    else:
+        _decoders.append(entry)
+
+
+def find_decoder(filename, mimetype):
+    """Return the first registered decoder that handles the input, or None"""
+    return next((decode for predicate, decode in _decoders if predicate(filename, mimetype)), None)
+
+
+def _pcm_to_float(raw, sample_width, channels):
+    """Convert little-endian integer PCM to float32 in [-1, 1], shape (n, channels)"""
+    if sample_width == 1:
+        data = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        data = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+    elif sample_width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        data = ints.astype(np.float32) / 8388608.0
+    elif sample_width == 4:
+        data = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f'unsupported sample width: {sample_width}')
+    usable = len(data) - len(data) % channels
+    return data[:usable].reshape(-1, channels)
+
+
+def decode_wav(audio_bytes, mimetype=None):
+    """Decode a PCM WAV file"""
+    with wave.open(io.BytesIO(audio_bytes), 'rb') as wav:
+        channels = wav.getnchannels()
+        rate = wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+        return _pcm_to_float(raw, wav.getsampwidth(), channels), rate
+
+
+def decode_raw_pcm(audio_bytes, mimetype=None):
+    """Decode headerless 16-bit PCM described by its mimetype (audio/L16;rate=...;channels=...)"""
+    params = dict(re.findall(r'(\w+)=(\d+)', mimetype or ''))
+    rate = int(params.get('rate', TARGET_RATE))
+    channels = int(params.get('channels', 1))
+    # audio/L16 is big-endian by definition, audio/pcm is taken as little-endian
+    if (mimetype or '').lower().startswith('audio/l16'):
+        audio_bytes = np.frombuffer(audio_bytes[:len(audio_bytes) // 2 * 2], dtype='>i2').astype('<i2').tobytes()
+    return _pcm_to_float(audio_bytes, 2, channels), rate
+
+
+def decode_ffmpeg(audio_bytes, mimetype=None):
+    """Decode any format ffmpeg understands to 16 kHz mono PCM"""
+    proc = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+         '-f', 's16le', '-ac', '1', '-ar', str(TARGET_RATE), 'pipe:1'],
+        input=audio_bytes, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        timeout=30, check=True
+    )
+    return _pcm_to_float(proc.stdout, 2, 1), TARGET_RATE
+
+
+def _is_wav(filename, mimetype):
+    mimetype = (mimetype or '').lower()
+    return mimetype in ('audio/wav', 'audio/x-wav', 'audio/wave') or (filename or '').lower().endswith('.wav')
+
+
+def _is_raw_pcm(filename, mimetype):
+    mimetype = (mimetype or '').lower()
+    return mimetype.startswith('audio/l16') or mimetype.startswith('audio/pcm') or (filename or '').lower().endswith('.pcm')
+
+
+register_decoder(_is_wav, decode_wav)
+register_decoder(_is_raw_pcm, decode_raw_pcm)
+if shutil.which('ffmpeg'):
+    register_decoder(lambda filename, mimetype: True, decode_ffmpeg)
+
+
+def downmix(samples):
+    """Average all channels into one"""
+    return samples.mean(axis=1) if samples.ndim == 2 else samples
+
+
+def resample(samples, rate, target_rate=TARGET_RATE):
+    """Resample mono audio (windowed-sinc low-pass when downsampling, then linear interpolation)"""
+    if rate == target_rate or len(samples) == 0:
+        return samples.astype(np.float32)
+    if target_rate < rate:
+        cutoff = 0.5 * target_rate / rate
+        taps = np.arange(-32, 33)
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+        samples = np.convolve(samples, kernel / kernel.sum(), mode='same')
+    duration = len(samples) / rate
+    out_len = int(round(duration * target_rate))
+    positions = np.arange(out_len) * (rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def trim_silence(samples, rate):
+    """Cut leading and trailing silence using frame RMS energy"""
+    frame = max(1, int(rate * FRAME_MS / 1000))
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return samples
+    frames = samples[:n_frames * frame].reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(frames ** 2, axis=1) + 1e-12)
+    db = 20 * np.log10(rms)
+    threshold = max(SILENCE_DB, db.max() + PEAK_RELATIVE_DB)
+    voiced = np.nonzero(db > threshold)[0]
+    if len(voiced) == 0:
+        return samples[:0]
+    pad = int(rate * PAD_MS / 1000)
+    start = max(0, voiced[0] * frame - pad)
+    end = min(len(samples), (voiced[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+
+def encode_wav(samples, rate):
+    """Encode mono float samples as 16-bit PCM WAV"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return out.getvalue()
+
+
+def preprocess(filename, audio_bytes, mimetype):
+    """
+    Shrink a recording for Whisper
+    Returns (filename, audio_bytes, mimetype, metrics). If the input can't be
+    decoded the original audio is returned with metrics['applied'] False.
+    """
+    metrics = {'applied': False, 'input_bytes': len(audio_bytes)}
+    if np is None:
+        metrics['reason'] = 'numpy not installed'
+        return filename, audio_bytes, mimetype, metrics
+
+    decoder = find_decoder(filename, mimetype)
+    if decoder is None:
+        metrics['reason'] = f'no decoder for {mimetype}'
+        return filename, audio_bytes, mimetype, metrics
+
+    try:
+        samples, rate = decoder(audio_bytes, mimetype)
+    except Exception as e:
+        logger.warning(f"Audio decode failed, sending original: {str(e)}")
+        metrics['reason'] = f'decode failed: {str(e)}'
+        return filename, audio_bytes, mimetype, metrics
+
+    input_duration = len(samples) / rate if rate else 0.0
+    mono = resample(downmix(samples), rate)
+    trimmed = trim_silence(mono, TARGET_RATE)
+    if len(trimmed) == 0:
+        # Nothing but silence: keep a little audio so Whisper still gets a valid file
+        trimmed = mono[:TARGET_RATE // 10]
+    encoded = encode_wav(trimmed, TARGET_RATE)
+    output_duration = len(trimmed) / TARGET_RATE
+
+    if len(encoded) >= len(audio_bytes):
+        metrics['reason'] = 'output not smaller than input'
+        return filename, audio_bytes, mimetype, metrics
+
+    metrics.update({
+        'applied': True,
+        'decoder': decoder.__name__,
+        'output_bytes': len(encoded),
+        'bytes_saved': len(audio_bytes) - len(encoded),
+        'input_duration': round(input_duration, 3),
+        'output_duration': round(output_duration, 3),
+        'duration_saved': round(input_duration - output_duration, 3)
+    })
+    stem = (filename or 'recording').rsplit('.', 1)[0]
+    return f'{stem}.wav', encoded, 'audio/wav', metrics
@@ -0,0 +1,276 @@
+"""
+Pipelined batch processing of recorded utterances
+Items flow through a fixed list of stages (STT -> LLM -> TTS for the server).
+Every stage has its own thread pool, so its pool size is that stage's
+concurrency limit and the stages overlap: item N+1 is transcribed while
+item N is with the LLM. Finished items are yielded as they complete.
+
+Input is any mix of audio files and tar/zip archives of them; iter_audio()
+turns both into (name, bytes, mimetype) without extracting to disk.
+
+Command line client for the server's /batch endpoint (NDJSON on stdout):
+    python batch.py --url http://localhost:10000 recordings.zip
+    python batch.py --url http://localhost:10000 --stt-workers 8 clips/*.wav > results.ndjson
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import queue
+import tarfile
+import zipfile
+import logging
+import argparse
+import mimetypes
+import threading
+import http.client
+import urllib.parse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.webm', '.ogg', '.oga', '.opus', '.m4a', '.mp4', '.mpeg', '.mpga', '.flac')
+ARCHIVE_TYPES = {
+    'application/zip': 'zip',
+    'application/x-zip-compressed': 'zip',
+    'application/x-tar': 'tar',
+    'application/gzip': 'tar',
+    'application/x-gzip': 'tar',
+    'application/x-gtar': 'tar',
+}
+
+
+class ItemTooLarge(Exception):
+    """An archive member or file is bigger than the per-item limit"""
+
+
+def is_audio_name(name):
+    base = os.path.basename(name)
+    return not base.startswith(('.', '_')) and base.lower().endswith(AUDIO_EXTENSIONS)
+
+
+def audio_mimetype(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def archive_kind(filename, mimetype=None):
+    """'zip', 'tar' or None for a file name / mimetype"""
+    name = (filename or '').lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')):
+        return 'tar'
+    return ARCHIVE_TYPES.get((mimetype or '').split(';')[0].strip().lower())
+
+
+def iter_archive(fileobj, kind, max_item_size):
+    """
+    Yield (name, bytes or ItemTooLarge, mimetype) for every audio member of a zip/tar
+    Members are read one at a time, in archive order.
+    """
+    if kind == 'zip':
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not is_audio_name(info.filename):
+                    continue
+                if info.file_size > max_item_size:
+                    yield info.filename, ItemTooLarge(f'{info.file_size} bytes'), audio_mimetype(info.filename)
+                    continue
+                yield info.filename, archive.read(info), audio_mimetype(info.filename)
+    else:
+        # Stream mode: works on non-seekable bodies and never holds more than one member
+        with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+            for member in archive:
+                if not member.isfile() or not is_audio_name(member.name):
+                    continue
+                if member.size > max_item_size:
+                    yield member.name, ItemTooLarge(f'{member.size} bytes'), audio_mimetype(member.name)
+                    continue
+                yield member.name, archive.extractfile(member).read(), audio_mimetype(member.name)
+
+
+def iter_audio(files, max_item_size):
+    """(name, bytes or ItemTooLarge, mimetype) for uploads given as (filename, fileobj, mimetype)"""
+    for filename, fileobj, mimetype in files:
+        kind = archive_kind(filename, mimetype)
+        if kind is not None:
+            yield from iter_archive(fileobj, kind, max_item_size)
+            continue
+        data = fileobj.read(max_item_size + 1)
+        if len(data) > max_item_size:
+            yield filename, ItemTooLarge(f'more than {max_item_size} bytes'), mimetype
+        else:
+            yield filename, data, mimetype or audio_mimetype(filename)
+
+
+class BatchRunner:
+    """Runs items through stages, each with its own bounded thread pool"""
+
+    def __init__(self, stages, max_in_flight=None):
+        """
+        stages: [(name, fn, workers)]; fn(item) works on the item dict in place
+        and raises to fail it. At most max_in_flight items are read ahead.
+        """
+        self.stages = stages
+        self.max_in_flight = max_in_flight or 2 * sum(workers for _, _, workers in stages)
+        self._busy = {name: 0.0 for name, _, _ in stages}
+        self._lock = threading.Lock()
+
+    def run(self, items):
+        """Yield (item, error) as items finish; error is the exception that stopped it, or None"""
+        executors = [
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'batch-{name}')
+            for name, _, workers in self.stages
+        ]
+        done = queue.Queue()
+        slots = threading.Semaphore(self.max_in_flight)
+        stopped = threading.Event()
+        fed = {'count': 0, 'finished': False, 'error': None}
+
+        def finish(item, error):
+            slots.release()
+            done.put((item, error))
+
+        def run_stage(index, item, queued_at):
+            name, fn, _ = self.stages[index]
+            item['timings'][f'{name}_wait'] = round((time.perf_counter() - queued_at) * 1000, 1)
+            started = time.perf_counter()
+            try:
+                if not stopped.is_set():
+                    fn(item)
+            except Exception as e:
+                finish(item, e)
+                return
+            finally:
+                with self._lock:
+                    self._busy[name] += time.perf_counter() - started
+            if stopped.is_set() or index + 1 == len(self.stages):
+                finish(item, None)
+            else:
+                executors[index + 1].submit(run_stage, index + 1, item, time.perf_counter())
+
+        def feed():
+            try:
+                for item in items:
+                    while not slots.acquire(timeout=0.5):
+                        if stopped.is_set():
+                            return
+                    if stopped.is_set():
+                        slots.release()
+                        return
+                    item.setdefault('timings', {})
+                    item['started'] = time.perf_counter()
+                    fed['count'] += 1
+                    executors[0].submit(run_stage, 0, item, time.perf_counter())
+            except Exception as e:
+                fed['error'] = e
+            finally:
+                fed['finished'] = True
+                done.put(None)
+
+        feeder = threading.Thread(target=feed, daemon=True, name='batch-feed')
+        feeder.start()
+        finished = 0
+        try:
+            while True:
+                result = done.get()
+                if result is not None:
+                    finished += 1
+                    item, error = result
+                    item['timings']['total'] = round((time.perf_counter() - item.pop('started')) * 1000, 1)
+                    yield item, error
+                if fed['finished'] and finished == fed['count']:
+                    if fed['error'] is not None:
+                        raise fed['error']  # e.g. a corrupt archive, after the items read before it
+                    return
+        finally:
+            # Also reached when the consumer goes away: stop reading and drop queued work
+            stopped.set()
+            for executor in executors:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        """Seconds each stage spent working, summed over its threads"""
+        with self._lock:
+            return {name: round(seconds, 3) for name, seconds in self._busy.items()}
+
+
+# Command line client
+
+def _tar_files(paths, spool):
+    with tarfile.open(fileobj=spool, mode='w') as archive:
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    for name in sorted(names):
+                        full = os.path.join(root, name)
+                        if is_audio_name(full):
+                            archive.add(full, arcname=os.path.relpath(full, path))
+            else:
+                archive.add(path, arcname=os.path.basename(path))
+    spool.seek(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='audio files, directories, or one zip/tar archive')
+    parser.add_argument('--url', default='http://localhost:10000', help='server base URL')
+    parser.add_argument('--device-id', help='device ID prefix for the items')
+    parser.add_argument('--stt-workers', type=int)
+    parser.add_argument('--llm-workers', type=int)
+    parser.add_argument('--tts-workers', type=int)
+    parser.add_argument('--include-audio', action='store_true', help='embed each answer as base64 mp3')
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    query = {
+        key: value for key, value in {
+            'device_id': args.device_id,
+            'stt_workers': args.stt_workers,
+            'llm_workers': args.llm_workers,
+            'tts_workers': args.tts_workers,
+            'include_audio': '1' if args.include_audio else None
+        }.items() if value is not None
+    }
+    # One archive is sent as-is; anything else is packed into a tar on the fly
+    with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as spool:
+        kind = archive_kind(args.paths[0]) if len(args.paths) == 1 else None
+        if kind is not None:
+            body = open(args.paths[0], 'rb')
+            content_type = 'application/zip' if kind == 'zip' else 'application/x-tar'
+        else:
+            _tar_files(args.paths, spool)
+            body, content_type = spool, 'application/x-tar'
+        size = body.seek(0, io.SEEK_END)
+        body.seek(0)
+
+        target = urllib.parse.urlsplit(args.url)
+        connection = http.client.HTTPSConnection if target.scheme == 'https' else http.client.HTTPConnection
+        conn = connection(target.netloc, timeout=args.timeout)
+        path = f"{target.path.rstrip('/')}/batch?{urllib.parse.urlencode(query)}"
+        conn.request('POST', path, body=body, headers={'Content-Type': content_type, 'Content-Length': str(size)})
+        response = conn.getresponse()
+        if response.status != 200:
+            sys.exit(f'batch failed: HTTP {response.status} {response.read().decode("utf-8", "replace")}')
+        errors = 0
+        for line in response:
+            sys.stdout.write(line.decode('utf-8'))
+            sys.stdout.flush()
+            record = json.loads(line)
+            if record.get('status') == 'error':
+                errors += 1
+            if 'summary' in record:
+                summary = record['summary']
+                print(f"{summary['items']} items, {summary['errors']} errors, "
+                      f"{summary['wall_ms']} ms, {summary['items_per_second']} items/s", file=sys.stderr)
+        conn.close()
+        if body is not spool:
+            body.close()
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
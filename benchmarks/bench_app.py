@@ -0,0 +1,36 @@
+"""
+Benchmark entry points: the real server wired to the local stand-ins
+    app       - Flask app (server.py)
+    asgi_app  - Starlette app (asgi_server.py)
+Groq calls go to GROQ_BASE_URL (the mock from mock_groq.py) and gTTS is
+replaced by FakeGTTS.
+
+    gunicorn --pythonpath benchmarks bench_app:app
+    uvicorn --app-dir benchmarks bench_app:asgi_app
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault('GROQ_API_KEY', 'mock-key')
+os.environ.setdefault('GROQ_BASE_URL', 'http://127.0.0.1:18080/openai/v1')
+os.environ.setdefault('GROQ_KEY_RPS', '0')
+os.environ.setdefault('PHRASE_BANK_BUILD', '0')
+
+import server  # noqa: E402
+from fake_gtts import FakeGTTS  # noqa: E402
+
+server.gTTS = FakeGTTS
+app = server.app
+
+
+def __getattr__(name):
+    # Only import the ASGI stack when it is asked for
+    if name == 'asgi_app':
+        import asgi_server
+        return asgi_server.app
+    raise AttributeError(name)
@@ -0,0 +1,257 @@
+"""
+Device protocol benchmark: JSON polling vs the binary frame
+A simulated ESP32 waits for each answer and downloads it over one keep-alive
+connection while the answer is produced by an /upload from another client.
+Every byte the device sends and receives is counted (HTTP headers included).
+Flows:
+    json-poll  - GET /status every --poll-interval until an answer is ready,
+                 then GET /get-audio-stream
+    json-wait  - GET /wait (long-poll, JSON), then GET /get-audio-stream
+    frame      - GET /device/frame?wait=.. with the audio inlined
+
+    python benchmarks/device_frame_bench.py --answers 10 --poll-interval 0.5
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import threading
+import http.client
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+sys.path.insert(0, ROOT)
+
+import mock_groq  # noqa: E402
+import load_test  # noqa: E402
+from run_matrix import server_command, wait_ready  # noqa: E402
+from device_frame import STATE_READY, decode_frame  # noqa: E402
+
+FLOWS = ('json-poll', 'json-wait', 'frame')
+# What a minimal device HTTP client sends with every request
+DEVICE_HEADERS = 'User-Agent: ESP32HTTPClient\r\nConnection: keep-alive\r\n'
+
+
+class DeviceConnection:
+    """Tiny keep-alive HTTP/1.1 client that counts the bytes on the wire"""
+
+    def __init__(self, host, port, timeout=90):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = b''
+        self.sent = self.received = self.requests = self.connections = 0
+        self.seq = 0  # last answer played, sent back like a real device does
+
+    def _connect(self):
+        self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = b''
+        self.connections += 1
+
+    def _read(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError('connection closed')
+        self.received += len(data)
+        self.buffer += data
+
+    def _read_until(self, marker):
+        while marker not in self.buffer:
+            self._read()
+        head, self.buffer = self.buffer.split(marker, 1)
+        return head
+
+    def _read_exactly(self, size):
+        while len(self.buffer) < size:
+            self._read()
+        body, self.buffer = self.buffer[:size], self.buffer[size:]
+        return body
+
+    def get(self, path):
+        """(status, headers, body) for a GET, reconnecting if the server closed the connection"""
+        if self.sock is None:
+            self._connect()
+        request = f'GET {path} HTTP/1.1\r\nHost: {self.address[0]}\r\n{DEVICE_HEADERS}\r\n'.encode()
+        self.sock.sendall(request)
+        self.sent += len(request)
+        self.requests += 1
+        lines = self._read_until(b'\r\n\r\n').decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding') == 'chunked':
+            body = b''
+            while True:
+                size = int(self._read_until(b'\r\n').split(b';')[0], 16)
+                body += self._read_exactly(size)
+                self._read_until(b'\r\n')
+                if size == 0:
+                    break
+        else:
+            body = self._read_exactly(int(headers.get('content-length', 0)))
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, headers, body
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def counters(self):
+        return {'requests': self.requests, 'sent': self.sent, 'received': self.received}
+
+
+def json_poll(conn, device_id, args):
+    while True:
+        _, _, body = conn.get(f'/status?device_id={device_id}')
+        status = json.loads(body)
+        if status['has_audio'] and status['esp32_status'] == 'sending_to_esp32':
+            break
+        time.sleep(args.poll_interval)
+    _, _, audio = conn.get(f'/get-audio-stream?device_id={device_id}')
+    return audio
+
+
+def json_wait(conn, device_id, args):
+    while True:
+        status, _, body = conn.get(f'/wait?device_id={device_id}&seq={conn.seq}&timeout={args.wait}')
+        if status == 200:
+            break
+    state = json.loads(body)
+    conn.seq = state['seq']
+    _, _, audio = conn.get(state['audio_url'])
+    return audio
+
+
+def frame(conn, device_id, args):
+    while True:
+        _, _, body = conn.get(f'/device/frame?device_id={device_id}&seq={conn.seq}&wait={args.wait}&max={args.max}')
+        reply = decode_frame(body)
+        if reply['state'] == STATE_READY:
+            break
+    conn.seq = reply['seq']
+    if reply['inline']:
+        return reply['audio']
+    _, _, audio = conn.get(f'/get-audio-stream?device_id={device_id}')
+    return audio
+
+
+def upload(port, device_id, body, content_type, delay):
+    """The phone/web side: ask a question after delay seconds (not counted)"""
+    time.sleep(delay)
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('POST', f'/upload?device_id={device_id}', body=body, headers={'Content-Type': content_type})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def run_flow(name, args, body, content_type):
+    device_id = f'bench-{name}'
+    conn = DeviceConnection('127.0.0.1', args.port)
+    flow = {'json-poll': json_poll, 'json-wait': json_wait, 'frame': frame}[name]
+    answers, latencies, audio_bytes = 0, [], 0
+    try:
+        for _ in range(args.answers):
+            uploader = threading.Thread(target=upload, args=(args.port, device_id, body, content_type, args.think))
+            uploader.start()
+            started = time.perf_counter()
+            audio = flow(conn, device_id, args)
+            latencies.append(time.perf_counter() - started)
+            uploader.join()
+            answers += 1
+            audio_bytes += len(audio)
+    finally:
+        conn.close()
+    counters = conn.counters()
+    overhead = counters['sent'] + counters['received'] - audio_bytes
+    return {
+        'flow': name,
+        'answers': answers,
+        'requests_per_answer': round(counters['requests'] / answers, 2),
+        'bytes_sent_per_answer': round(counters['sent'] / answers),
+        'bytes_received_per_answer': round(counters['received'] / answers),
+        'overhead_bytes_per_answer': round(overhead / answers),
+        'audio_bytes_per_answer': round(audio_bytes / answers),
+        'connections': conn.connections,
+        'p50_ms': round(statistics.median(latencies) * 1000, 1)
+    }
+
+
+def print_table(reports):
+    header = f"{'flow':<11}{'req/answer':>11}{'sent B':>9}{'recv B':>10}{'overhead B':>12}{'audio B':>9}{'conns':>7}{'p50 ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for r in reports:
+        print(f"{r['flow']:<11}{r['requests_per_answer']:>11}{r['bytes_sent_per_answer']:>9}"
+              f"{r['bytes_received_per_answer']:>10}{r['overhead_bytes_per_answer']:>12}"
+              f"{r['audio_bytes_per_answer']:>9}{r['connections']:>7}{r['p50_ms']:>9}")
+    print('(per answer; overhead = everything on the wire except the audio itself)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--flows', default=','.join(FLOWS))
+    parser.add_argument('--config', default='flask', help='server configuration (see run_matrix.py)')
+    parser.add_argument('--port', type=int, default=18100)
+    parser.add_argument('--mock-port', type=int, default=18080)
+    parser.add_argument('--answers', type=int, default=10, help='answers per flow')
+    parser.add_argument('--think', type=float, default=1.0, help='seconds before each question is asked')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='json-poll: seconds between /status polls')
+    parser.add_argument('--wait', type=float, default=25, help='long-poll timeout (s)')
+    parser.add_argument('--max', type=int, default=256 * 1024, help='frame: largest audio to inline')
+    parser.add_argument('--output', help='write the reports to this JSON file')
+    mock_groq.add_arguments(parser)
+    args = parser.parse_args()
+
+    mock_groq.start_in_thread(
+        port=args.mock_port,
+        stt=mock_groq.Latency.from_args(args.stt_latency, args.stt_jitter, args.dist, args.seed),
+        llm=mock_groq.Latency.from_args(args.llm_latency, args.llm_jitter, args.dist, args.seed + 1),
+        seed=args.seed
+    )
+    env = dict(
+        os.environ,
+        GROQ_API_KEY='mock-key',
+        GROQ_BASE_URL=f'http://127.0.0.1:{args.mock_port}/openai/v1',
+        FAKE_TTS_LATENCY='0.05',
+        RESPONSE_CACHE='0'
+    )
+    body, content_type = load_test.multipart('audio', 'question.wav', load_test.make_wav(1.0), 'audio/wav')
+
+    proc = subprocess.Popen(server_command(args.config, args.port), cwd=ROOT, env=env)
+    try:
+        if not wait_ready(args.port):
+            sys.exit('server did not start')
+        reports = []
+        for name in args.flows.split(','):
+            print(f'Running {name}...', file=sys.stderr)
+            reports.append(run_flow(name.strip(), args, body, content_type))
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+    print_table(reports)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark one pipeline stage in isolation through the engine registry
+Calls a single STT, LLM or TTS engine N times (optionally concurrently) and
+prints the engine's own latency/throughput stats, e.g. to compare Groq
+Whisper with faster-whisper, or gTTS with espeak, without the rest of the
+pipeline in the way.
+
+    python benchmarks/engine_bench.py --kind tts --engine espeak -n 20
+    python benchmarks/engine_bench.py --kind stt --engine faster-whisper --audio sample.wav
+"""
+
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import load_test  # noqa: E402
+from tts_engine import PooledGTTS  # noqa: E402
+from groq_pool import create_groq_pool  # noqa: E402
+from engines import (  # noqa: E402
+    EngineRegistry, GroqSTT, GroqLLM, GTTSEngine, FasterWhisperSTT, LlamaCppLLM, EspeakTTS,
+    FakeSTT, FakeLLM, FakeTTS
+)
+
+QUESTION = 'ما هي عاصمة المملكة العربية السعودية؟'
+
+
+def build_registry():
+    pool = create_groq_pool()
+    client = pool.client if pool is not None else None
+    return EngineRegistry([
+        GroqSTT(client), FasterWhisperSTT(), FakeSTT(),
+        GroqLLM(client), LlamaCppLLM(), FakeLLM(),
+        GTTSEngine(lambda text, lang: PooledGTTS(text=text, lang=lang)), EspeakTTS(), FakeTTS()
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--kind', choices=['stt', 'llm', 'tts'], required=True)
+    parser.add_argument('--engine', help='engine name (default: the registry default)')
+    parser.add_argument('-n', type=int, default=10, help='number of calls')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--audio', help='audio file for STT (default: a generated 2 s tone)')
+    parser.add_argument('--text', help='text for TTS / question for the LLM')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed calls first (model loading)')
+    args = parser.parse_args()
+
+    engine = build_registry().get(args.kind, args.engine)
+    if args.kind == 'stt':
+        if args.audio:
+            with open(args.audio, 'rb') as f:
+                audio = f.read()
+        else:
+            audio = load_test.make_wav(seconds=2.0)
+        filename = os.path.basename(args.audio or 'tone.wav')
+        call = lambda: engine.transcribe(filename, audio, 'audio/wav')  # noqa: E731
+    elif args.kind == 'llm':
+        messages = [{'role': 'user', 'content': args.text or QUESTION}]
+        call = lambda: engine.complete(messages)  # noqa: E731
+    else:
+        text = args.text or load_test.TTS_PHRASES[2]
+        call = lambda: engine.synthesize(text)  # noqa: E731
+
+    for _ in range(args.warmup):
+        call()
+    engine.reset_stats()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for future in [pool.submit(call) for _ in range(args.n)]:
+            future.result()
+
+    stats = engine.stats()
+    stats['name'] = engine.name
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+gTTS stand-in for benchmarks
+Mimics gTTS(text=..., lang=...).write_to_fp(fp): the text is split into
+100-character parts like gTTS does, each part "costs" one simulated HTTP
+round-trip, and the output is a run of silent MPEG audio frames whose length
+grows with the text.
+"""
+
+import os
+import random
+import threading
+import time
+
+# gTTS sends at most 100 characters per request
+PART_CHARS = 100
+
+# One silent MPEG-1 Layer III frame: 32 kbps, 24 kHz mono-ish header + zero padding
+FRAME_HEADER = bytes([0xFF, 0xF3, 0x44, 0xC4])
+FRAME = FRAME_HEADER + bytes(140)
+FRAMES_PER_CHAR = 2
+
+_rng = random.Random(int(os.getenv('FAKE_TTS_SEED', 0)))
+_rng_lock = threading.Lock()
+
+
+def _part_latency():
+    mean = float(os.getenv('FAKE_TTS_LATENCY', 0.3))
+    jitter = float(os.getenv('FAKE_TTS_JITTER', 0.05))
+    with _rng_lock:
+        return max(0.0, _rng.gauss(mean, jitter)) if jitter else mean
+
+
+class FakeGTTS:
+    """Drop-in replacement for gtts.gTTS with configurable per-request latency"""
+
+    calls = 0
+
+    def __init__(self, text, lang='ar', **kwargs):
+        self.text = text
+        self.lang = lang
+
+    def write_to_fp(self, fp):
+        FakeGTTS.calls += 1
+        parts = [self.text[i:i + PART_CHARS] for i in range(0, len(self.text), PART_CHARS)] or ['']
+        for part in parts:
+            time.sleep(_part_latency())
+            fp.write(FRAME * max(1, len(part) * FRAMES_PER_CHAR))
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            self.write_to_fp(f)
@@ -0,0 +1,242 @@
+"""
+Open-loop load generator for the voice server
+Drives /upload, /tts and /get-audio-stream at a fixed request rate and
+reports throughput, latency percentiles, error rate and (when the server's
+PID is known) resident memory per worker process.
+
+    python benchmarks/load_test.py --url http://127.0.0.1:10000 --rate 20 --duration 30 \
+        --mix upload=1,tts=2,audio=2 --server-pid 12345
+"""
+
+import io
+import os
+import json
+import math
+import time
+import wave
+import uuid
+import random
+import struct
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+TTS_PHRASES = [
+    'مرحبا بك',
+    'كيف يمكنني مساعدتك اليوم؟',
+    'الطقس اليوم مشمس ومعتدل في معظم المناطق.',
+    'شكرا لاستخدامك المساعد الصوتي.',
+]
+
+
+def make_wav(seconds=2.0, rate=16000):
+    """A short sine-tone WAV to upload"""
+    frames = int(seconds * rate)
+    samples = (int(8000 * math.sin(2 * math.pi * 440 * i / rate)) for i in range(frames))
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b''.join(struct.pack('<h', s) for s in samples))
+    return out.getvalue()
+
+
+def multipart(field, filename, content, content_type):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        f'Content-Type: {content_type}\r\n\r\n'
+    ).encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def process_rss(pid):
+    """Resident memory (bytes) of one process, 0 if unavailable"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def child_pids(pid):
+    """Direct children of a process (gunicorn workers of a master)"""
+    children = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                children.extend(int(p) for p in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def worker_rss(pid):
+    """RSS per process for a server: its workers if it has any, else itself"""
+    pids = child_pids(pid) or [pid]
+    return {p: process_rss(p) for p in pids}
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class LoadTest:
+    """Fixed-rate request scheduler with per-endpoint latency collection"""
+
+    def __init__(self, url, rate, duration, mix, concurrency=256, devices=50, seed=0, timeout=60):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.rate = rate
+        self.duration = duration
+        self.mix = mix
+        self.devices = devices
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.results = {name: {'latencies': [], 'errors': 0, 'bytes': 0} for name in mix}
+        self.wav = make_wav()
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _request(self, method, path, body=None, headers=None):
+        for attempt in range(2):
+            conn = self._conn()
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+                return response.status, data
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                self.local.conn = None
+                if attempt:
+                    raise
+
+    def _call(self, name, device):
+        if name == 'upload':
+            body, content_type = multipart('audio', 'bench.wav', self.wav, 'audio/wav')
+            return self._request('POST', f'/upload?device_id={device}', body, {'Content-Type': content_type})
+        if name == 'tts':
+            text = TTS_PHRASES[int(device.rsplit('-', 1)[-1]) % len(TTS_PHRASES)]
+            body = json.dumps({'text': text}).encode('utf-8')
+            return self._request('POST', '/tts', body, {'Content-Type': 'application/json'})
+        if name == 'audio':
+            return self._request('GET', f'/get-audio-stream?device_id={device}')
+        if name == 'status':
+            return self._request('GET', f'/status?device_id={device}')
+        raise ValueError(f'unknown endpoint: {name}')
+
+    def _run_one(self, name, device):
+        started = time.perf_counter()
+        try:
+            status, data = self._call(name, device)
+            # 404 on audio just means that device has nothing queued yet
+            ok = status < 400 or (name == 'audio' and status == 404)
+        except Exception:
+            ok, data = False, b''
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            result = self.results[name]
+            result['latencies'].append(elapsed)
+            result['bytes'] += len(data)
+            if not ok:
+                result['errors'] += 1
+
+    def run(self):
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        interval = 1.0 / self.rate
+        started = time.perf_counter()
+        futures = []
+        n = 0
+        while True:
+            due = started + n * interval
+            if due - started >= self.duration:
+                break
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            name = self.rng.choices(names, weights)[0]
+            device = f'bench-{self.rng.randrange(self.devices)}'
+            futures.append(self.pool.submit(self._run_one, name, device))
+            n += 1
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - started
+        self.pool.shutdown()
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        report = {'elapsed': round(elapsed, 2), 'endpoints': {}}
+        total = errors = 0
+        for name, result in self.results.items():
+            latencies = result['latencies']
+            total += len(latencies)
+            errors += result['errors']
+            report['endpoints'][name] = {
+                'requests': len(latencies),
+                'throughput': round(len(latencies) / elapsed, 2),
+                'p50_ms': round(percentile(latencies, 0.5) * 1000, 1),
+                'p90_ms': round(percentile(latencies, 0.9) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+                'error_rate': round(result['errors'] / len(latencies), 4) if latencies else 0.0,
+                'bytes': result['bytes']
+            }
+        report['requests'] = total
+        report['throughput'] = round(total / elapsed, 2)
+        report['error_rate'] = round(errors / total, 4) if total else 0.0
+        return report
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def add_arguments(parser):
+    parser.add_argument('--rate', type=float, default=10, help='requests per second')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load')
+    parser.add_argument('--mix', default='upload=1,tts=2,audio=2', help='endpoint weights')
+    parser.add_argument('--devices', type=int, default=50, help='distinct device IDs')
+    parser.add_argument('--concurrency', type=int, default=256, help='max in-flight requests')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:10000')
+    parser.add_argument('--server-pid', type=int, help='report RSS of this process and its workers')
+    parser.add_argument('--seed', type=int, default=0)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    test = LoadTest(args.url, args.rate, args.duration, parse_mix(args.mix),
+                    concurrency=args.concurrency, devices=args.devices, seed=args.seed)
+    report = test.run()
+    if args.server_pid:
+        report['worker_rss'] = worker_rss(args.server_pid)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""
+Local stand-in for the Groq OpenAI-compatible API
+Serves POST /openai/v1/audio/transcriptions and /openai/v1/chat/completions
+(including stream=true) with configurable latency and jitter, so the server
+can be benchmarked without network access or API quota.
+
+Responses carry Groq-style x-ratelimit-* headers per API key. With
+--key-limit N each key gets N requests per --key-window seconds and is
+answered with 429 + Retry-After beyond that, to exercise the client pool.
+
+Run with:  python benchmarks/mock_groq.py --port 18080 --stt-latency 0.4 --llm-latency 0.8
+Point the server at it with GROQ_BASE_URL=http://127.0.0.1:18080/openai/v1
+"""
+
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_TRANSCRIPT = 'مرحبا، ما هو الطقس اليوم؟'
+DEFAULT_ANSWER = (
+    'الطقس اليوم مشمس ومعتدل في معظم المناطق. '
+    'درجات الحرارة تتراوح بين عشرين وخمس وعشرين درجة. '
+    'لا يتوقع هطول أمطار خلال الساعات القادمة.'
+)
+
+
+class Latency:
+    """Latency distribution: fixed, uniform, normal or lognormal around a mean (seconds)"""
+
+    def __init__(self, mean=0.0, jitter=0.0, dist='normal', rng=None):
+        self.mean = mean
+        self.jitter = jitter
+        self.dist = dist
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if self.dist == 'fixed' or self.jitter <= 0:
+                value = self.mean
+            elif self.dist == 'uniform':
+                value = self.rng.uniform(self.mean - self.jitter, self.mean + self.jitter)
+            elif self.dist == 'lognormal':
+                # jitter is the sigma of the underlying normal
+                value = self.mean * self.rng.lognormvariate(0, self.jitter)
+            else:
+                value = self.rng.gauss(self.mean, self.jitter)
+        return max(0.0, value)
+
+    def sleep(self):
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    @classmethod
+    def from_args(cls, mean, jitter, dist, seed):
+        return cls(mean, jitter, dist, random.Random(seed))
+
+
+class MockGroqHandler(BaseHTTPRequestHandler):
+    """Handles the two Groq endpoints the server uses"""
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockGroq/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _rate_limit_headers(self):
+        """Count this request against its API key; returns (headers, over_limit)"""
+        config = self.server.config
+        key = (self.headers.get('Authorization') or '').rpartition(' ')[2]
+        limit = config['key_limit'] or 1000
+        now = time.monotonic()
+        with config['lock']:
+            window_start, used = config['keys'].get(key, (now, 0))
+            if now - window_start >= config['key_window']:
+                window_start, used = now, 0
+            used += 1
+            config['keys'][key] = (window_start, used)
+        reset = max(0.0, window_start + config['key_window'] - now)
+        headers = {
+            'x-ratelimit-limit-requests': str(limit),
+            'x-ratelimit-remaining-requests': str(max(0, limit - used)),
+            'x-ratelimit-reset-requests': f'{reset:.2f}s',
+            'x-ratelimit-limit-tokens': '100000',
+            'x-ratelimit-remaining-tokens': '100000',
+            'x-ratelimit-reset-tokens': '0s'
+        }
+        return headers, bool(config['key_limit']) and used > limit
+
+    def _send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or self.rate_headers).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self._read_body()
+        config = self.server.config
+        config['requests'] += 1
+        self.rate_headers, over_limit = self._rate_limit_headers()
+
+        if over_limit or (config['error_rate'] and config['rng'].random() < config['error_rate']):
+            retry_after = self.rate_headers['x-ratelimit-reset-requests'] if over_limit else '1'
+            self._send_json(
+                {'error': {'message': 'rate limited', 'type': 'rate_limit'}}, 429,
+                dict(self.rate_headers, **{'retry-after': str(math.ceil(float(retry_after.rstrip('s'))))})
+            )
+            return
+
+        if self.path.endswith('/audio/transcriptions'):
+            config['stt'].sleep()
+            self._send_json({'text': config['transcript']})
+            return
+
+        if self.path.endswith('/chat/completions'):
+            request = json.loads(body or b'{}')
+            if request.get('stream'):
+                self._stream_chat(config)
+            else:
+                config['llm'].sleep()
+                self._send_json(self._completion(config['answer']))
+            return
+
+        self._send_json({'error': {'message': 'not found'}}, 404)
+
+    def _completion(self, text):
+        return {
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': 'mock',
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': text},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 20, 'completion_tokens': len(text.split()), 'total_tokens': 20 + len(text.split())}
+        }
+
+    def _stream_chat(self, config):
+        """Send the answer word by word as server-sent events"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        for name, value in self.rate_headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        words = config['answer'].split(' ')
+        # Time to first token, then the rest of the latency spread over the words
+        total = config['llm'].sample()
+        time.sleep(total * 0.3)
+        per_word = total * 0.7 / max(1, len(words))
+        for i, word in enumerate(words):
+            chunk = {
+                'id': 'chatcmpl-mock',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': 'mock',
+                'choices': [{'index': 0, 'delta': {'content': word + (' ' if i < len(words) - 1 else '')}, 'finish_reason': None}]
+            }
+            self._write_chunk(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+            time.sleep(per_word)
+        self._write_chunk(b'data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+def make_server(port=18080, host='127.0.0.1', stt=None, llm=None,
+                transcript=DEFAULT_TRANSCRIPT, answer=DEFAULT_ANSWER, error_rate=0.0, seed=0,
+                key_limit=0, key_window=60.0):
+    """Build (but don't start) a mock Groq server"""
+    server = ThreadingHTTPServer((host, port), MockGroqHandler)
+    server.daemon_threads = True
+    server.config = {
+        'stt': stt or Latency(),
+        'llm': llm or Latency(),
+        'transcript': transcript,
+        'answer': answer,
+        'error_rate': error_rate,
+        'rng': random.Random(seed),
+        'requests': 0,
+        'key_limit': key_limit,
+        'key_window': key_window,
+        'keys': {},
+        'lock': threading.Lock()
+    }
+    return server
+
+
+def start_in_thread(**kwargs):
+    """Start a mock Groq server on a background thread and return it"""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument('--stt-latency', type=float, default=0.4, help='mean Whisper latency (s)')
+    parser.add_argument('--stt-jitter', type=float, default=0.1)
+    parser.add_argument('--llm-latency', type=float, default=0.8, help='mean chat latency (s)')
+    parser.add_argument('--llm-jitter', type=float, default=0.2)
+    parser.add_argument('--dist', choices=['fixed', 'uniform', 'normal', 'lognormal'], default='normal')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls answered with 429')
+    parser.add_argument('--key-limit', type=int, default=0, help='requests per key per window (0 = unlimited)')
+    parser.add_argument('--key-window', type=float, default=60.0, help='rate-limit window per key (s)')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--host', default='127.0.0.1')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(
+        port=args.port,
+        host=args.host,
+        stt=Latency.from_args(args.stt_latency, args.stt_jitter, args.dist, args.seed),
+        llm=Latency.from_args(args.llm_latency, args.llm_jitter, args.dist, args.seed + 1),
+        error_rate=args.error_rate,
+        seed=args.seed,
+        key_limit=args.key_limit,
+        key_window=args.key_window
+    )
+    print(f'Mock Groq listening on http://{args.host}:{args.port}/openai/v1')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
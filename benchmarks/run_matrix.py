@@ -0,0 +1,142 @@
+"""
+Repeatable comparison of server modes against the local stand-ins
+Starts the mock Groq server once, then for each configuration launches the
+server (Flask dev server, gunicorn with N sync workers, uvicorn ASGI...),
+runs the same seeded load test, records RSS per worker, and prints a table.
+
+    python benchmarks/run_matrix.py --configs flask,gunicorn-1,gunicorn-4,asgi \
+        --rate 20 --duration 30 --output results.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import mock_groq  # noqa: E402
+import load_test  # noqa: E402
+
+
+def server_command(config, port):
+    """Command line for a named configuration"""
+    if config == 'flask':
+        return [sys.executable, '-c',
+                f'import sys; sys.path.insert(0, {HERE!r}); import bench_app; '
+                f'bench_app.app.run(host="127.0.0.1", port={port}, threaded=True)']
+    if config.startswith('gunicorn-'):
+        # gunicorn-<workers> or gunicorn-<workers>x<threads>
+        spec = config.split('-', 1)[1]
+        workers, _, threads = spec.partition('x')
+        return [sys.executable, '-m', 'gunicorn', '--pythonpath', HERE,
+                '-w', workers, '--threads', threads or '1',
+                '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'bench_app:app']
+    if config == 'asgi':
+        return [sys.executable, '-m', 'uvicorn', '--app-dir', HERE,
+                '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning',
+                'bench_app:asgi_app']
+    raise ValueError(f'unknown configuration: {config}')
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/status', timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def run_config(config, args, env):
+    port = args.port
+    proc = subprocess.Popen(server_command(config, port), cwd=ROOT, env=env)
+    try:
+        if not wait_ready(port):
+            return {'config': config, 'error': 'server did not start'}
+        test = load_test.LoadTest(
+            f'http://127.0.0.1:{port}', args.rate, args.duration, load_test.parse_mix(args.mix),
+            concurrency=args.concurrency, devices=args.devices, seed=args.seed
+        )
+        report = test.run()
+        rss = load_test.worker_rss(proc.pid)
+        report['config'] = config
+        report['workers'] = len(rss)
+        report['rss_per_worker_mb'] = round(sum(rss.values()) / len(rss) / 2 ** 20, 1) if rss else 0.0
+        return report
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def print_table(reports):
+    header = f"{'config':<14}{'req/s':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'errors':>8}{'RSS/worker':>12}"
+    print(header)
+    print('-' * len(header))
+    for report in reports:
+        if 'error' in report:
+            print(f"{report['config']:<14}  {report['error']}")
+            continue
+        upload = report['endpoints'].get('upload') or next(iter(report['endpoints'].values()))
+        print(f"{report['config']:<14}{report['throughput']:>8}{upload['p50_ms']:>9}{upload['p90_ms']:>9}"
+              f"{upload['p99_ms']:>9}{report['error_rate']:>8}{report['rss_per_worker_mb']:>10} MB")
+    print('(latency columns are for /upload)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--configs', default='flask,gunicorn-1,gunicorn-4,asgi')
+    parser.add_argument('--port', type=int, default=18100)
+    parser.add_argument('--mock-port', type=int, default=18080)
+    parser.add_argument('--tts-latency', type=float, default=0.3, help='gTTS stand-in latency per 100 chars (s)')
+    parser.add_argument('--tts-jitter', type=float, default=0.05)
+    parser.add_argument('--with-caches', action='store_true', help='keep TTS/response caches enabled')
+    parser.add_argument('--output', help='write all reports to this JSON file')
+    mock_groq.add_arguments(parser)
+    load_test.add_arguments(parser)
+    args = parser.parse_args()
+
+    mock_groq.start_in_thread(
+        port=args.mock_port,
+        stt=mock_groq.Latency.from_args(args.stt_latency, args.stt_jitter, args.dist, args.seed),
+        llm=mock_groq.Latency.from_args(args.llm_latency, args.llm_jitter, args.dist, args.seed + 1),
+        error_rate=args.error_rate,
+        seed=args.seed,
+        key_limit=args.key_limit,
+        key_window=args.key_window
+    )
+
+    env = dict(
+        os.environ,
+        GROQ_API_KEY='mock-key',
+        GROQ_BASE_URL=f'http://127.0.0.1:{args.mock_port}/openai/v1',
+        FAKE_TTS_LATENCY=str(args.tts_latency),
+        FAKE_TTS_JITTER=str(args.tts_jitter),
+        FAKE_TTS_SEED=str(args.seed)
+    )
+    if not args.with_caches:
+        env.update(RESPONSE_CACHE='0', TTS_CACHE_MEMORY_MB='0', TTS_CACHE_DIR='')
+
+    reports = []
+    for config in args.configs.split(','):
+        print(f'Running {config}...', file=sys.stderr)
+        reports.append(run_config(config.strip(), args, env))
+
+    print_table(reports)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Startup benchmark: import time and time-to-first-response per worker
+    import      - `import server` in a fresh interpreter (openai/gtts deferred),
+                  and what loading them on first use costs afterwards
+    per-worker  - gunicorn -c gunicorn.conf.py with SERVER_PRELOAD=0: every
+                  worker imports the app itself
+    preload     - SERVER_PRELOAD=1: the master imports the app and the heavy
+                  packages once, workers are forked from it
+For each gunicorn mode /status is polled from the moment gunicorn is
+launched until every worker (told apart by the 'worker' pid in the reply)
+has answered, then the first /upload is timed against the mock Groq API.
+
+    python benchmarks/startup_bench.py --workers 4 --repeats 5
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import http.client
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import mock_groq  # noqa: E402
+import load_test  # noqa: E402
+
+MODES = {
+    'per-worker': {'SERVER_PRELOAD': '0'},
+    'preload': {'SERVER_PRELOAD': '1'},
+}
+
+IMPORT_SNIPPET = '''
+import sys, time, json
+started = time.perf_counter()
+import server
+imported = time.perf_counter()
+server.preload()
+print(json.dumps({
+    'import_s': imported - started,
+    'first_use_s': time.perf_counter() - imported,
+    'modules': len(sys.modules)
+}))
+'''
+
+
+def measure_imports(env, repeats):
+    runs = []
+    for _ in range(repeats):
+        out = subprocess.run(
+            [sys.executable, '-c', IMPORT_SNIPPET], cwd=ROOT, env=env,
+            capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        'import_ms': round(statistics.median(r['import_s'] for r in runs) * 1000, 1),
+        'first_use_ms': round(statistics.median(r['first_use_s'] for r in runs) * 1000, 1),
+        'modules': runs[-1]['modules']
+    }
+
+
+def get_status(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+    try:
+        conn.request('GET', '/status')
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+
+def first_upload(port):
+    body, content_type = load_test.multipart('audio', 'tone.wav', load_test.make_wav(1.0), 'audio/wav')
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        started = time.perf_counter()
+        conn.request('POST', '/upload?device_id=startup', body=body, headers={'Content-Type': content_type})
+        response = conn.getresponse()
+        response.read()
+        return response.status, round((time.perf_counter() - started) * 1000, 1)
+    finally:
+        conn.close()
+
+
+def run_mode(mode, args, env):
+    command = [
+        sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--pythonpath', HERE,
+        '-w', str(args.workers), '-b', f'127.0.0.1:{args.port}', '--log-level', 'warning',
+        'bench_app:app'
+    ]
+    launched = time.perf_counter()
+    proc = subprocess.Popen(
+        command, cwd=ROOT, env=dict(env, **MODES[mode]),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        ready = {}
+        deadline = time.monotonic() + args.timeout
+        while len(ready) < args.workers and time.monotonic() < deadline:
+            try:
+                worker = get_status(args.port)['worker']
+            except (OSError, ValueError, KeyError):
+                time.sleep(0.01)
+                continue
+            ready.setdefault(worker, round((time.perf_counter() - launched) * 1000, 1))
+        if not ready:
+            return {'mode': mode, 'error': 'server did not start'}
+        status, upload_ms = first_upload(args.port)
+        times = sorted(ready.values())
+        rss = load_test.worker_rss(proc.pid)
+        return {
+            'mode': mode,
+            'workers_seen': len(ready),
+            'first_response_ms': times[0],
+            'all_workers_ms': times[-1],
+            'per_worker_ms': times,
+            'first_upload_ms': upload_ms if status == 200 else None,
+            'rss_total_mb': round(sum(rss.values()) / 2 ** 20, 1)
+        }
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', default='per-worker,preload')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=3, help='runs per measurement (medians are reported)')
+    parser.add_argument('--port', type=int, default=18100)
+    parser.add_argument('--mock-port', type=int, default=18080)
+    parser.add_argument('--timeout', type=float, default=60, help='seconds to wait for all workers')
+    parser.add_argument('--output', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    mock_groq.start_in_thread(port=args.mock_port)
+    env = dict(
+        os.environ,
+        GROQ_API_KEY='mock-key',
+        GROQ_BASE_URL=f'http://127.0.0.1:{args.mock_port}/openai/v1',
+        GROQ_KEY_RPS='0',
+        PHRASE_BANK_BUILD='0',
+        FAKE_TTS_LATENCY='0.05',
+        RESPONSE_CACHE='0'
+    )
+
+    report = {'import': measure_imports(env, args.repeats), 'modes': []}
+    print(f"import server: {report['import']['import_ms']} ms, "
+          f"openai+gtts on first use: {report['import']['first_use_ms']} ms")
+    header = f"{'mode':<12}{'first ms':>10}{'all ms':>10}{'1st upload':>12}{'RSS MB':>9}"
+    print(header)
+    print('-' * len(header))
+    for mode in args.modes.split(','):
+        runs = [run_mode(mode, args, env) for _ in range(args.repeats)]
+        ok = [r for r in runs if 'error' not in r]
+        if not ok:
+            print(f"{mode:<12}  {runs[0]['error']}")
+            report['modes'].append(runs[0])
+            continue
+        summary = {
+            'mode': mode,
+            'first_response_ms': statistics.median(r['first_response_ms'] for r in ok),
+            'all_workers_ms': statistics.median(r['all_workers_ms'] for r in ok),
+            'first_upload_ms': statistics.median(r['first_upload_ms'] or 0 for r in ok),
+            'rss_total_mb': statistics.median(r['rss_total_mb'] for r in ok),
+            'runs': runs
+        }
+        report['modes'].append(summary)
+        print(f"{mode:<12}{summary['first_response_ms']:>10}{summary['all_workers_ms']:>10}"
+              f"{summary['first_upload_ms']:>12}{summary['rss_total_mb']:>9}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Upload memory benchmark: buffered vs spooled/streamed ingestion
+For each mode the Flask server is started fresh against the mock Groq API,
+hit with a burst of concurrent large /upload requests, and its resident
+memory is sampled throughout. Modes:
+    buffered  - UPLOAD_IN_MEMORY=1, the whole file is read into bytes
+    streamed  - default, the upload is spooled to a temp file and streamed to Whisper
+
+    python benchmarks/upload_memory.py --size-mb 8 --concurrency 16 --rounds 3
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import mock_groq  # noqa: E402
+import load_test  # noqa: E402
+from run_matrix import server_command, wait_ready  # noqa: E402
+
+MODES = {
+    'buffered': {'UPLOAD_IN_MEMORY': '1'},
+    'streamed': {'UPLOAD_IN_MEMORY': '0'},
+}
+
+
+def upload(port, body, content_type, device):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        started = time.perf_counter()
+        conn.request('POST', f'/upload?device_id={device}', body=body, headers={'Content-Type': content_type})
+        response = conn.getresponse()
+        payload = json.loads(response.read() or b'{}')
+        return response.status, time.perf_counter() - started, payload.get('memory')
+    finally:
+        conn.close()
+
+
+def sample_rss(pid, stop, samples, interval=0.02):
+    while not stop.is_set():
+        samples.append(sum(load_test.worker_rss(pid).values()))
+        stop.wait(interval)
+
+
+def run_mode(mode, args, env, body, content_type):
+    port = args.port
+    proc = subprocess.Popen(
+        server_command(args.config, port), cwd=ROOT, env=dict(env, **MODES[mode]),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        if not wait_ready(port):
+            return {'mode': mode, 'error': 'server did not start'}
+        idle = sum(load_test.worker_rss(proc.pid).values())
+        samples, stop = [], threading.Event()
+        sampler = threading.Thread(target=sample_rss, args=(proc.pid, stop, samples), daemon=True)
+        sampler.start()
+        results = []
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            for round_no in range(args.rounds):
+                futures = [
+                    pool.submit(upload, port, body, content_type, f'mem-{round_no}-{i}')
+                    for i in range(args.concurrency)
+                ]
+                results.extend(f.result() for f in futures)
+        stop.set()
+        sampler.join()
+        latencies = [latency for status, latency, _ in results if status == 200]
+        reported = [memory for status, _, memory in results if status == 200 and memory]
+        return {
+            'mode': mode,
+            'requests': len(results),
+            'errors': sum(1 for status, _, _ in results if status != 200),
+            'idle_rss_mb': round(idle / 2 ** 20, 1),
+            'peak_rss_mb': round(max(samples, default=idle) / 2 ** 20, 1),
+            'growth_mb': round((max(samples, default=idle) - idle) / 2 ** 20, 1),
+            'in_memory_per_upload_mb': round(
+                max((m['in_memory_bytes'] for m in reported), default=0) / 2 ** 20, 2
+            ),
+            'p50_ms': round(load_test.percentile(latencies, 0.5) * 1000, 1),
+            'p99_ms': round(load_test.percentile(latencies, 0.99) * 1000, 1)
+        }
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def print_table(reports):
+    header = f"{'mode':<10}{'requests':>9}{'errors':>8}{'idle MB':>9}{'peak MB':>9}{'growth':>9}{'in-mem/upl':>12}{'p50 ms':>9}{'p99 ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for r in reports:
+        if 'error' in r:
+            print(f"{r['mode']:<10}  {r['error']}")
+            continue
+        print(f"{r['mode']:<10}{r['requests']:>9}{r['errors']:>8}{r['idle_rss_mb']:>9}{r['peak_rss_mb']:>9}"
+              f"{r['growth_mb']:>9}{r['in_memory_per_upload_mb']:>12}{r['p50_ms']:>9}{r['p99_ms']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', default='buffered,streamed')
+    parser.add_argument('--config', default='flask', help='server configuration (see run_matrix.py)')
+    parser.add_argument('--port', type=int, default=18100)
+    parser.add_argument('--mock-port', type=int, default=18080)
+    parser.add_argument('--size-mb', type=float, default=8.0, help='upload size')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--output', help='write the reports to this JSON file')
+    mock_groq.add_arguments(parser)
+    args = parser.parse_args()
+
+    mock_groq.start_in_thread(
+        port=args.mock_port,
+        stt=mock_groq.Latency.from_args(args.stt_latency, args.stt_jitter, args.dist, args.seed),
+        llm=mock_groq.Latency.from_args(args.llm_latency, args.llm_jitter, args.dist, args.seed + 1),
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    env = dict(
+        os.environ,
+        GROQ_API_KEY='mock-key',
+        GROQ_BASE_URL=f'http://127.0.0.1:{args.mock_port}/openai/v1',
+        FAKE_TTS_LATENCY='0.05',
+        RESPONSE_CACHE='0',
+        AUDIO_PREPROCESS='0'
+    )
+
+    # A short tone padded out to the requested size (the mock doesn't decode it)
+    wav = load_test.make_wav(seconds=1.0)
+    wav += b'\0' * max(0, int(args.size_mb * 2 ** 20) - len(wav))
+    body, content_type = load_test.multipart('audio', 'big.wav', wav, 'audio/wav')
+
+    reports = []
+    for mode in args.modes.split(','):
+        print(f'Running {mode}...', file=sys.stderr)
+        reports.append(run_mode(mode.strip(), args, env, body, content_type))
+
+    print_table(reports)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+Per-device conversation memory
+Each device session keeps its recent exchanges in a bounded ring buffer
+(session['history'], a list of [role, text]) plus a short running summary
+of older turns (session['summary']). build_messages() assembles
+    system prompt + summary + as many recent turns as fit + new utterance
+under a token budget, newest turns first. Turns that fall out of the ring
+buffer are compacted into the summary; a conversation idle for longer than
+the TTL starts over.
+
+Token counts are estimates (characters / CHARS_PER_TOKEN); llama3's
+tokenizer isn't available here and the budget leaves a safety margin.
+"""
+
+import math
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# llama3-8b-8192 context window
+CONTEXT_WINDOW = 8192
+# Arabic runs at roughly 2-3 characters per llama3 token; stay on the safe side
+CHARS_PER_TOKEN = 2.5
+# Per-message overhead of the chat template
+MESSAGE_OVERHEAD = 4
+
+SUMMARY_PREFIX = 'ملخص المحادثة السابقة:\n'
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text or '') / CHARS_PER_TOKEN) + MESSAGE_OVERHEAD
+
+
+def _first_sentence(text, limit):
+    text = ' '.join((text or '').split())
+    ends = [index for index in (text.find(mark) for mark in ('.', '؟', '?', '!')) if 0 < index < limit]
+    if ends:
+        return text[:min(ends) + 1]
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+
+def extractive_summary(summary, turns, max_chars):
+    """Fold evicted [role, text] turns into the summary as short Q/A lines, keeping the newest"""
+    lines = [line for line in (summary or '').split('\n') if line]
+    for role, text in turns:
+        if role == 'user':
+            lines.append(f'- س: {_first_sentence(text, 80)}')
+        elif lines and lines[-1].startswith('- س:') and ' ج: ' not in lines[-1]:
+            lines[-1] += f' ج: {_first_sentence(text, 120)}'
+        else:
+            lines.append(f'- ج: {_first_sentence(text, 120)}')
+    while lines and sum(len(line) + 1 for line in lines) > max_chars:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+class ConversationMemory:
+    """Ring-buffered, token-budgeted chat history stored in the session store"""
+
+    def __init__(self, sessions, max_turns=8, token_budget=2048, max_tokens=150,
+                 ttl=600, summary_chars=600, summarize=None):
+        """
+        max_turns     - exchanges (user + assistant) kept in the ring buffer
+        token_budget  - prompt tokens allowed, capped so the answer still fits the context window
+        summarize     - optional summarize(summary, turns) -> str used instead of the
+                        extractive summary (e.g. an LLM call); runs off the request path
+        """
+        self.sessions = sessions
+        self.max_messages = max_turns * 2
+        self.token_budget = min(token_budget, CONTEXT_WINDOW - max_tokens - 64)
+        self.ttl = ttl
+        self.summary_chars = summary_chars
+        self.summarize = summarize
+        self._lock = threading.Lock()
+        self._counters = {
+            'prompts': 0,
+            'prompt_tokens': 0,
+            'last_prompt_tokens': 0,
+            'turns_sent': 0,
+            'turns_trimmed': 0,
+            'compactions': 0,
+            'expired': 0
+        }
+
+    def _load(self, session):
+        """(summary, history) of a session, or empty if the conversation expired"""
+        history = session.get('history') or []
+        if history and time.time() - (session.get('history_at') or 0) > self.ttl:
+            with self._lock:
+                self._counters['expired'] += 1
+            return '', []
+        return session.get('summary') or '', history
+
+    def active(self, device_id):
+        """True if the device has a live conversation (answers depend on context)"""
+        summary, history = self._load(self.sessions.get(device_id, include_audio=False))
+        return bool(summary or history)
+
+    def build_messages(self, system_prompt, device_id, user_text):
+        """Return (messages, info) fitting the token budget; info has prompt_tokens and trimming counts"""
+        summary, history = self._load(self.sessions.get(device_id, include_audio=False))
+
+        head = [{'role': 'system', 'content': system_prompt}]
+        tail = [{'role': 'user', 'content': user_text}]
+        used = estimate_tokens(system_prompt) + estimate_tokens(user_text)
+        if summary:
+            summary_tokens = estimate_tokens(SUMMARY_PREFIX + summary)
+            if used + summary_tokens > self.token_budget:
+                # Keep the most recent part of the summary that fits
+                room = max(0, self.token_budget - used - estimate_tokens(SUMMARY_PREFIX))
+                summary = summary[-int(room * CHARS_PER_TOKEN):] if room else ''
+                summary_tokens = estimate_tokens(SUMMARY_PREFIX + summary) if summary else 0
+            if summary:
+                head.append({'role': 'system', 'content': SUMMARY_PREFIX + summary})
+                used += summary_tokens
+
+        # Newest turns first, whole user/assistant pairs only
+        recent = []
+        for i in range(len(history) - 2, -1, -2):
+            pair = history[i:i + 2]
+            cost = sum(estimate_tokens(text) for _, text in pair)
+            if used + cost > self.token_budget:
+                break
+            recent[:0] = [{'role': role, 'content': text} for role, text in pair]
+            used += cost
+
+        info = {
+            'prompt_tokens': used,
+            'turns_sent': len(recent) // 2,
+            'turns_trimmed': (len(history) - len(recent)) // 2
+        }
+        with self._lock:
+            self._counters['prompts'] += 1
+            self._counters['prompt_tokens'] += used
+            self._counters['last_prompt_tokens'] = used
+            self._counters['turns_sent'] += info['turns_sent']
+            self._counters['turns_trimmed'] += info['turns_trimmed']
+        return head + recent + tail, info
+
+    def record(self, device_id, user_text, response_text):
+        """Append one exchange; turns pushed out of the ring buffer go into the summary"""
+        evicted = []
+        with self.sessions.lock(device_id):
+            summary, history = self._load(self.sessions.get(device_id, include_audio=False))
+            history = history + [['user', user_text], ['assistant', response_text]]
+            if len(history) > self.max_messages:
+                evicted = history[:-self.max_messages]
+                history = history[-self.max_messages:]
+                if self.summarize is None:
+                    summary = extractive_summary(summary, evicted, self.summary_chars)
+            self.sessions.update(device_id, history=history, summary=summary, history_at=time.time())
+        if evicted:
+            with self._lock:
+                self._counters['compactions'] += 1
+            if self.summarize is not None:
+                threading.Thread(
+                    target=self._compact, args=(device_id, summary, evicted), daemon=True
+                ).start()
+
+    def _compact(self, device_id, summary, evicted):
+        """Background summary update through the custom summarizer"""
+        try:
+            new_summary = self.summarize(summary, evicted)
+        except Exception as e:
+            logger.warning(f"Conversation summary failed, using extractive summary: {str(e)}")
+            new_summary = extractive_summary(summary, evicted, self.summary_chars)
+        with self.sessions.lock(device_id):
+            session = self.sessions.get(device_id, include_audio=False)
+            if not session.get('history'):
+                return  # cleared or restarted while we were summarizing
+            current = session.get('summary') or ''
+            if current != summary:
+                # Another compaction finished first; add our turns to its result
+                new_summary = extractive_summary(current, evicted, self.summary_chars)
+            self.sessions.update(device_id, summary=new_summary[-self.summary_chars:])
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['avg_prompt_tokens'] = round(stats['prompt_tokens'] / stats['prompts'], 1) if stats['prompts'] else 0.0
+        return stats
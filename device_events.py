@@ -0,0 +1,246 @@
+"""
+Per-device change notifications for long-poll / SSE / WebSocket clients
+Instead of polling /status, a device waits on its own change counter and is
+woken the moment its session changes (status, audio, stream state):
+
+    version = events.version(device_id)   # before looking at the session
+    ... session not ready yet ...
+    events.wait(device_id, version, timeout)
+
+In process every device has its own Condition (asyncio waiters are woken
+with call_soon_threadsafe). Across gunicorn workers a change is broadcast as
+a UNIX datagram to every worker socket in <dir>/worker-<pid>.sock, so a
+device waiting in one worker hears about audio produced in another (the
+session itself must then come from a shared store, e.g. SESSION_BACKEND=sqlite).
+Sockets of dead workers are removed when a send to them is refused.
+
+Counters come from one sequence shared by all devices, so a device that is
+forgotten and seen again never goes back to a number a client already holds.
+Only the max_devices most recently changed devices are remembered (never one
+that has a waiter); forgetting one just makes version() report 0 for it.
+"""
+
+import os
+import time
+import socket
+import asyncio
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Session fields whose change wakes waiters
+WATCHED_FIELDS = ('status', 'has_audio', 'audio_data', 'stream_state')
+MAX_DATAGRAM = 256
+MAX_DEVICES = 10000
+
+
+class DeviceEvents:
+    """Per-device change counters with blocking and async waits"""
+
+    def __init__(self, socket_dir=None, max_devices=MAX_DEVICES):
+        self.socket_dir = socket_dir
+        self.max_devices = max_devices
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._versions = OrderedDict()
+        self._conditions = {}
+        self._async_waiters = {}
+        self._pid = None
+        self._sock = None
+        self._counters = {
+            'notifications': 0,
+            'broadcasts_sent': 0,
+            'broadcasts_received': 0,
+            'broadcasts_dropped': 0,
+            'wakeups': 0,
+            'timeouts': 0,
+            'forgotten': 0
+        }
+        if socket_dir:
+            os.makedirs(socket_dir, exist_ok=True)
+
+    # Local state
+
+    def version(self, device_id):
+        """Current change counter of a device; read it before checking the session"""
+        self._ensure_listener()
+        with self._lock:
+            return self._versions.get(device_id, 0)
+
+    def _bump(self, device_id):
+        with self._lock:
+            self._sequence += 1
+            self._versions[device_id] = self._sequence
+            self._versions.move_to_end(device_id)
+            self._forget_idle()
+            condition = self._conditions.get(device_id)
+            if condition is not None:
+                condition.notify_all()
+            waiters = self._async_waiters.pop(device_id, [])
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    def _forget_idle(self):
+        # Oldest first, skipping devices someone is still waiting on
+        for device_id in list(self._versions):
+            if len(self._versions) <= self.max_devices:
+                return
+            if device_id not in self._conditions and device_id not in self._async_waiters:
+                del self._versions[device_id]
+                self._counters['forgotten'] += 1
+
+    def notify(self, device_id):
+        """Wake everything waiting on device_id, in this worker and the others"""
+        with self._lock:
+            self._counters['notifications'] += 1
+        self._bump(device_id)
+        self._broadcast(device_id)
+
+    def on_session_change(self, device_id, fields):
+        """Session store listener: notify when a watched field changed (fields is None on clear)"""
+        if fields is None or any(name in fields for name in WATCHED_FIELDS):
+            self.notify(device_id)
+
+    def wait(self, device_id, version, timeout):
+        """Block until the device's counter passes version or timeout expires; returns the counter"""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            condition = self._conditions.get(device_id)
+            if condition is None:
+                condition = self._conditions[device_id] = threading.Condition(self._lock)
+                condition.waiters = 0
+            condition.waiters += 1
+            try:
+                while self._versions.get(device_id, 0) <= version:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['timeouts'] += 1
+                        break
+                    condition.wait(remaining)
+                else:
+                    self._counters['wakeups'] += 1
+                return self._versions.get(device_id, 0)
+            finally:
+                condition.waiters -= 1
+                if not condition.waiters:
+                    del self._conditions[device_id]
+
+    async def wait_async(self, device_id, version, timeout):
+        """asyncio version of wait()"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self._versions.get(device_id, 0) > version:
+                self._counters['wakeups'] += 1
+                return self._versions[device_id]
+            self._async_waiters.setdefault(device_id, []).append((loop, future))
+        try:
+            await asyncio.wait_for(future, timeout)
+            with self._lock:
+                self._counters['wakeups'] += 1
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._counters['timeouts'] += 1
+                waiters = self._async_waiters.get(device_id, [])
+                if (loop, future) in waiters:
+                    waiters.remove((loop, future))
+                if not waiters:
+                    self._async_waiters.pop(device_id, None)
+        with self._lock:
+            return self._versions.get(device_id, 0)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['waiting'] = sum(c.waiters for c in self._conditions.values()) + sum(
+                len(w) for w in self._async_waiters.values()
+            )
+            stats['devices'] = len(self._versions)
+        return stats
+
+    # Cross-worker fan-out
+
+    def _socket_path(self, pid):
+        return os.path.join(self.socket_dir, f'worker-{pid}.sock')
+
+    def _ensure_listener(self):
+        # Bound lazily (and again after a fork) so each worker has its own socket
+        if not self.socket_dir or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            path = self._socket_path(os.getpid())
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            try:
+                if os.path.exists(path):
+                    os.unlink(path)
+                sock.bind(path)
+            except OSError as e:
+                logger.warning(f"Device events socket unavailable, in-process only: {str(e)}")
+                sock.close()
+                self.socket_dir = None
+                return
+            self._sock = sock
+            self._pid = os.getpid()
+        threading.Thread(target=self._listen, args=(sock,), daemon=True, name='device-events').start()
+
+    def _listen(self, sock):
+        while True:
+            try:
+                data = sock.recv(MAX_DATAGRAM)
+            except OSError:
+                return
+            with self._lock:
+                self._counters['broadcasts_received'] += 1
+            self._bump(data.decode('utf-8', 'replace'))
+
+    def _broadcast(self, device_id):
+        if not self.socket_dir:
+            return
+        self._ensure_listener()
+        own = self._socket_path(os.getpid())
+        payload = device_id.encode('utf-8')[:MAX_DATAGRAM]
+        sent = dropped = 0
+        try:
+            entries = [entry.path for entry in os.scandir(self.socket_dir) if entry.name.endswith('.sock')]
+        except OSError:
+            return
+        for path in entries:
+            if path == own:
+                continue
+            try:
+                # Never block the request that changed the session on a slow worker
+                self._sock.sendto(payload, socket.MSG_DONTWAIT, path)
+                sent += 1
+            except BlockingIOError:
+                # That worker's receive buffer is full: its waiters wake at their timeout
+                dropped += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker is gone; clean up its socket
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError as e:
+                logger.warning(f"Device event to {os.path.basename(path)} failed: {str(e)}")
+        with self._lock:
+            self._counters['broadcasts_sent'] += sent
+            self._counters['broadcasts_dropped'] += dropped
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def create_device_events():
+    """Build the registry configured by DEVICE_EVENTS_DIR (empty = in-process only)"""
+    socket_dir = os.getenv(
+        'DEVICE_EVENTS_DIR',
+        os.path.join(tempfile.gettempdir(), 'smart_device_events')
+    )
+    return DeviceEvents(socket_dir=socket_dir or None)
@@ -0,0 +1,111 @@
+"""
+Compact binary status frame for devices
+One keep-alive GET /device/frame replaces polling /status (JSON) and then
+fetching /get-audio-stream: the reply is a fixed 16-byte little-endian
+header, the audio itself when it is ready and small enough, and a CRC-32.
+
+    offset  size
+    0       2     magic b'SV'
+    2       1     version (1)
+    3       1     state: 0 idle, 1 processing, 2 audio ready, 3 streaming
+    4       1     flags: bit 0 audio inlined, bit 1 the device has audio stored
+    5       1     audio format (index in FORMAT_IDS)
+    6       2     reserved (0)
+    8       4     seq: number of the current answer (the session's audio_seq, 0 = none
+                  yet); the device sends the last one it played back as ?seq=
+    12      4     audio length in bytes, in the requested format
+    16      n     audio (only with the inlined flag; n = audio length)
+    16+n    4     CRC-32 of everything before it (zlib.crc32, esp_rom_crc32_le on the ESP32)
+
+With state 3 the audio is still being generated and is read progressively
+from /get-audio-stream?stream=1; with state 2 and no inlined audio (larger
+than the device's ?max=) it is fetched from /get-audio-stream as before.
+"""
+
+import zlib
+import struct
+
+MAGIC = b'SV'
+VERSION = 1
+HEADER = struct.Struct('<2sBBBBHII')
+TRAILER = struct.Struct('<I')
+
+STATE_IDLE = 0
+STATE_PROCESSING = 1
+STATE_READY = 2
+STATE_STREAMING = 3
+
+FLAG_INLINE = 0x01
+FLAG_HAS_AUDIO = 0x02
+
+# Wire ids of the playback formats (see audio_formats.py); append only
+FORMAT_IDS = ('mp3', 'mp3-low', 'pcm16', 'pcm8', 'adpcm', 'adpcm8')
+
+MIME_TYPE = 'application/x-device-frame'
+
+
+class FrameError(ValueError):
+    """Truncated or corrupt frame"""
+
+
+def frame_state(state):
+    """Frame state for an audio_state() dict"""
+    if state['ready']:
+        return STATE_STREAMING if state['streaming'] else STATE_READY
+    if state['status'] == 'processing':
+        return STATE_PROCESSING
+    return STATE_IDLE
+
+
+def frame_parts(state, seq=0, audio_length=0, audio=None, has_audio=False, fmt='mp3'):
+    """
+    The frame as [header, audio, crc] (the audio is passed through uncopied)
+    audio is inlined when given; audio_length then defaults to its size.
+    """
+    flags = FLAG_HAS_AUDIO if has_audio else 0
+    if audio is not None:
+        flags |= FLAG_INLINE
+        audio_length = len(audio)
+    header = HEADER.pack(MAGIC, VERSION, state, flags, FORMAT_IDS.index(fmt), 0, seq, audio_length)
+    crc = zlib.crc32(header)
+    parts = [header]
+    if audio is not None:
+        crc = zlib.crc32(audio, crc)
+        parts.append(audio)
+    parts.append(TRAILER.pack(crc))
+    return parts
+
+
+def encode_frame(*args, **kwargs):
+    """The frame as one bytes object (see frame_parts)"""
+    return b''.join(frame_parts(*args, **kwargs))
+
+
+def frame_size(audio_length=0, inline=False):
+    """Bytes on the wire for a frame"""
+    return HEADER.size + (audio_length if inline else 0) + TRAILER.size
+
+
+def decode_frame(data):
+    """Parse and verify a frame; returns a dict with the header fields and 'audio' (bytes or None)"""
+    if len(data) < HEADER.size + TRAILER.size:
+        raise FrameError(f'frame too short ({len(data)} bytes)')
+    magic, version, state, flags, fmt, _, seq, audio_length = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise FrameError(f'not a version {VERSION} frame')
+    inline = bool(flags & FLAG_INLINE)
+    end = HEADER.size + (audio_length if inline else 0)
+    if len(data) != end + TRAILER.size:
+        raise FrameError(f'expected {end + TRAILER.size} bytes, got {len(data)}')
+    (crc,) = TRAILER.unpack_from(data, end)
+    if zlib.crc32(memoryview(data)[:end]) != crc:
+        raise FrameError('CRC mismatch')
+    return {
+        'state': state,
+        'inline': inline,
+        'has_audio': bool(flags & FLAG_HAS_AUDIO),
+        'format': FORMAT_IDS[fmt] if fmt < len(FORMAT_IDS) else None,
+        'seq': seq,
+        'audio_length': audio_length,
+        'audio': bytes(data[HEADER.size:end]) if inline else None
+    }
@@ -0,0 +1,481 @@
+"""
+Pluggable STT / LLM / TTS engines
+Every pipeline stage goes through an engine looked up in an EngineRegistry,
+so the backend can be chosen by configuration (STT_ENGINE, LLM_ENGINE,
+TTS_ENGINE) or per request (?stt=, ?llm=, ?tts=).
+
+    stt  groq            Groq Whisper (default)
+         faster-whisper  local CTranslate2 Whisper (pip install faster-whisper)
+         fake            fixed transcript
+    llm  groq            Groq Llama 3 (default)
+         llama-cpp       local GGUF model (pip install llama-cpp-python, LOCAL_LLM_MODEL=path)
+         fake            deterministic answer built from the question
+    tts  gtts            Google TTS (default)
+         espeak          espeak-ng/espeak + ffmpeg, fully offline
+         fake            silent mp3 frames, length proportional to the text
+
+Local engines import their libraries and load models on first use, so an
+engine that is never selected costs nothing. Each engine keeps its own
+latency histogram and throughput counters (see stats()).
+
+Interfaces:
+    STT  transcribe(filename, audio, mimetype, language) -> text   (audio: bytes or file)
+    LLM  complete(messages, max_tokens, temperature) -> text
+         stream(messages, max_tokens, temperature) -> iterator of text deltas
+    TTS  synthesize(text, lang) -> mp3 bytes
+"""
+
+import io
+import os
+import time
+import shutil
+import logging
+import importlib.util
+import threading
+import subprocess
+from collections import namedtuple
+from contextlib import contextmanager
+
+from metrics import StageStats
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('stt', 'llm', 'tts')
+
+Selection = namedtuple('Selection', 'stt llm tts')
+
+
+class EngineUnavailable(LookupError):
+    """Unknown engine name, or an engine whose backend isn't installed/configured"""
+
+    def __init__(self, kind, name, available):
+        super().__init__(f'{kind} engine {name!r} is not available (available: {", ".join(available)})')
+        self.kind = kind
+        self.name = name
+        self.available = available
+
+
+def _installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def audio_length(audio):
+    """Size of audio given as bytes or a seekable file"""
+    if isinstance(audio, (bytes, bytearray)):
+        return len(audio)
+    position = audio.tell()
+    size = audio.seek(0, os.SEEK_END)
+    audio.seek(position)
+    return size
+
+
+class Engine:
+    """Base class: lazy loading plus latency/throughput accounting"""
+
+    kind = None
+    name = None
+    # What the throughput counters count
+    input_unit = 'bytes'
+    output_unit = 'chars'
+
+    def __init__(self):
+        self._stats = StageStats()
+        self._stats_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._load_seconds = 0.0
+        self._input_units = 0
+        self._output_units = 0
+
+    def available(self):
+        """True if the backend is installed and configured"""
+        return True
+
+    def load(self):
+        """Load models/clients once, on first use"""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                started = time.perf_counter()
+                self._load()
+                self._load_seconds = time.perf_counter() - started
+                self._loaded = True
+                logger.info(f"Loaded {self.kind} engine {self.name} in {self._load_seconds:.2f}s")
+
+    def _load(self):
+        pass
+
+    @contextmanager
+    def _measure(self, input_units):
+        """Time one call; the caller adds output units to the yielded list"""
+        self.load()
+        output = [0]
+        started = time.perf_counter()
+        error = True
+        try:
+            yield output
+            error = False
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                self._stats.observe(elapsed, error, input_units)
+                self._input_units += input_units
+                self._output_units += output[0]
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats = StageStats()
+            self._input_units = self._output_units = 0
+
+    def stats(self):
+        with self._stats_lock:
+            stats = self._stats
+            quantiles = stats.quantiles()
+            busy = stats.total
+            return {
+                'kind': self.kind,
+                'loaded': self._loaded,
+                'load_ms': round(self._load_seconds * 1000, 1),
+                'calls': stats.count,
+                'errors': stats.errors,
+                'avg_ms': round(busy / stats.count * 1000, 1) if stats.count else 0.0,
+                'p50_ms': round(quantiles[0.5] * 1000, 1),
+                'p90_ms': round(quantiles[0.9] * 1000, 1),
+                f'input_{self.input_unit}': self._input_units,
+                f'output_{self.output_unit}': self._output_units,
+                f'{self.input_unit}_per_second': round(self._input_units / busy, 1) if busy else 0.0,
+                f'{self.output_unit}_per_second': round(self._output_units / busy, 1) if busy else 0.0
+            }
+
+
+class STTEngine(Engine):
+    kind = 'stt'
+    input_unit = 'bytes'
+    output_unit = 'chars'
+
+    def transcribe(self, filename, audio, mimetype, language='ar'):
+        with self._measure(audio_length(audio)) as output:
+            text = self._transcribe(filename, audio, mimetype, language)
+            output[0] = len(text)
+        return text
+
+    def _transcribe(self, filename, audio, mimetype, language):
+        raise NotImplementedError
+
+
+class LLMEngine(Engine):
+    kind = 'llm'
+    input_unit = 'chars'
+    output_unit = 'chars'
+    model = None
+
+    def complete(self, messages, max_tokens=150, temperature=0.7):
+        with self._measure(sum(len(m['content']) for m in messages)) as output:
+            text = self._complete(messages, max_tokens, temperature)
+            output[0] = len(text)
+        return text
+
+    def stream(self, messages, max_tokens=150, temperature=0.7):
+        with self._measure(sum(len(m['content']) for m in messages)) as output:
+            for delta in self._stream(messages, max_tokens, temperature):
+                output[0] += len(delta)
+                yield delta
+
+    def _complete(self, messages, max_tokens, temperature):
+        raise NotImplementedError
+
+    def _stream(self, messages, max_tokens, temperature):
+        # Engines without native streaming deliver the whole answer at once
+        yield self._complete(messages, max_tokens, temperature)
+
+
+class TTSEngine(Engine):
+    kind = 'tts'
+    input_unit = 'chars'
+    output_unit = 'bytes'
+
+    def synthesize(self, text, lang='ar'):
+        with self._measure(len(text)) as output:
+            data = self._synthesize(text, lang)
+            output[0] = len(data)
+        return data
+
+    def _synthesize(self, text, lang):
+        raise NotImplementedError
+
+
+# Groq / Google engines
+
+
+class GroqSTT(STTEngine):
+    """Whisper on Groq through the multi-key client pool"""
+
+    name = 'groq'
+
+    def __init__(self, client, model='whisper-large-v3'):
+        super().__init__()
+        self.client = client
+        self.model = model
+
+    def available(self):
+        return self.client is not None
+
+    def _transcribe(self, filename, audio, mimetype, language):
+        transcript = self.client.audio.transcriptions.create(
+            model=self.model,
+            file=(filename, audio, mimetype),
+            language=language
+        )
+        return transcript.text
+
+
+class GroqLLM(LLMEngine):
+    """Llama 3 chat completions on Groq"""
+
+    name = 'groq'
+
+    def __init__(self, client, model='llama3-8b-8192'):
+        super().__init__()
+        self.client = client
+        self.model = model
+
+    def available(self):
+        return self.client is not None
+
+    def _complete(self, messages, max_tokens, temperature):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature
+        )
+        return response.choices[0].message.content
+
+    def _stream(self, messages, max_tokens, temperature):
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            stream=True
+        )
+        for chunk in stream:
+            if chunk.choices:
+                yield chunk.choices[0].delta.content or ''
+
+
+class GTTSEngine(TTSEngine):
+    """Google TTS; factory(text, lang) returns a gTTS-like object"""
+
+    name = 'gtts'
+
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+
+    def _synthesize(self, text, lang):
+        mp3_fp = io.BytesIO()
+        self.factory(text, lang).write_to_fp(mp3_fp)
+        return mp3_fp.getvalue()
+
+
+# CPU-local engines
+
+
+class FasterWhisperSTT(STTEngine):
+    """Local Whisper via faster-whisper (int8 on CPU); LOCAL_STT_MODEL picks the size"""
+
+    name = 'faster-whisper'
+
+    def __init__(self, model_size=None, threads=None):
+        super().__init__()
+        self.model_size = model_size or os.getenv('LOCAL_STT_MODEL', 'tiny')
+        self.threads = threads or int(os.getenv('LOCAL_STT_THREADS', 0))
+        self.model = None
+
+    def available(self):
+        return _installed('faster_whisper')
+
+    def _load(self):
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(self.model_size, device='cpu', compute_type='int8', cpu_threads=self.threads)
+
+    def _transcribe(self, filename, audio, mimetype, language):
+        if isinstance(audio, (bytes, bytearray)):
+            audio = io.BytesIO(audio)
+        segments, _ = self.model.transcribe(audio, language=language, beam_size=1, vad_filter=True)
+        return ''.join(segment.text for segment in segments).strip()
+
+
+class LlamaCppLLM(LLMEngine):
+    """Local GGUF chat model via llama-cpp-python (LOCAL_LLM_MODEL=/path/model.gguf)"""
+
+    name = 'llama-cpp'
+
+    def __init__(self, model_path=None, context=None, threads=None):
+        super().__init__()
+        self.model = model_path or os.getenv('LOCAL_LLM_MODEL', '')
+        self.context = context or int(os.getenv('LOCAL_LLM_CONTEXT', 4096))
+        self.threads = threads or int(os.getenv('LOCAL_LLM_THREADS', 0)) or None
+        self._llm = None
+        # llama.cpp contexts aren't thread-safe
+        self._call_lock = threading.Lock()
+
+    def available(self):
+        return bool(self.model) and os.path.exists(self.model) and _installed('llama_cpp')
+
+    def _load(self):
+        from llama_cpp import Llama
+        self._llm = Llama(model_path=self.model, n_ctx=self.context, n_threads=self.threads, verbose=False)
+
+    def _complete(self, messages, max_tokens, temperature):
+        with self._call_lock:
+            response = self._llm.create_chat_completion(
+                messages=messages, max_tokens=max_tokens, temperature=temperature
+            )
+        return response['choices'][0]['message']['content']
+
+    def _stream(self, messages, max_tokens, temperature):
+        with self._call_lock:
+            for chunk in self._llm.create_chat_completion(
+                    messages=messages, max_tokens=max_tokens, temperature=temperature, stream=True):
+                yield chunk['choices'][0]['delta'].get('content') or ''
+
+
+class EspeakTTS(TTSEngine):
+    """Offline formant synthesis with espeak-ng (or espeak), encoded to mp3 by ffmpeg"""
+
+    name = 'espeak'
+    BITRATE = 32000
+
+    def __init__(self, voice=None):
+        super().__init__()
+        self.voice = voice
+        self.binary = None
+
+    def available(self):
+        return bool(shutil.which('espeak-ng') or shutil.which('espeak')) and shutil.which('ffmpeg') is not None
+
+    def _load(self):
+        self.binary = shutil.which('espeak-ng') or shutil.which('espeak')
+
+    def _synthesize(self, text, lang):
+        wav = subprocess.run(
+            [self.binary, '-v', self.voice or lang, '--stdout', text],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30, check=True
+        ).stdout
+        return subprocess.run(
+            ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+             '-ac', '1', '-b:a', str(self.BITRATE), '-f', 'mp3', 'pipe:1'],
+            input=wav, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30, check=True
+        ).stdout
+
+
+# Deterministic fakes for tests and stage benchmarks
+
+
+class FakeSTT(STTEngine):
+    """Always returns the same transcript after an optional fixed delay"""
+
+    name = 'fake'
+
+    def __init__(self, text='مرحبا، ما هو الطقس اليوم؟', latency=0.0):
+        super().__init__()
+        self.text = text
+        self.latency = latency
+
+    def _transcribe(self, filename, audio, mimetype, language):
+        time.sleep(self.latency)
+        return self.text
+
+
+class FakeLLM(LLMEngine):
+    """Answers with a fixed sentence that quotes the question, word by word when streaming"""
+
+    name = 'fake'
+    model = 'fake'
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+
+    def _answer(self, messages):
+        question = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+        return f'سألت: {question}. هذه إجابة تجريبية.'
+
+    def _complete(self, messages, max_tokens, temperature):
+        time.sleep(self.latency)
+        return self._answer(messages)
+
+    def _stream(self, messages, max_tokens, temperature):
+        time.sleep(self.latency)
+        for word in self._answer(messages).split(' '):
+            yield word + ' '
+
+
+class FakeTTS(TTSEngine):
+    """Silent MPEG frames, two per character, so output size tracks the text"""
+
+    name = 'fake'
+    FRAME = bytes([0xFF, 0xF3, 0x44, 0xC4]) + bytes(140)
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+
+    def _synthesize(self, text, lang):
+        time.sleep(self.latency)
+        return self.FRAME * max(1, len(text) * 2)
+
+
+class EngineRegistry:
+    """Engines by kind and name plus the configured default for each kind"""
+
+    def __init__(self, engines=()):
+        """The first engine registered for a kind is its default"""
+        self._engines = {kind: {} for kind in KINDS}
+        self._defaults = {}
+        for engine in engines:
+            self.register(engine)
+
+    def register(self, engine, default=False):
+        self._engines[engine.kind][engine.name] = engine
+        if default or engine.kind not in self._defaults:
+            self._defaults[engine.kind] = engine.name
+        return engine
+
+    def set_default(self, kind, name):
+        """Make name the default engine for kind (raises EngineUnavailable)"""
+        self._defaults[kind] = self.get(kind, name).name
+
+    def names(self, kind):
+        return list(self._engines[kind])
+
+    def available(self, kind):
+        return [name for name, engine in self._engines[kind].items() if engine.available()]
+
+    def get(self, kind, name=None):
+        """Engine of this kind by name (default when name is empty)"""
+        name = (name or self._defaults.get(kind) or '').strip().lower()
+        engine = self._engines[kind].get(name)
+        if engine is None or not engine.available():
+            raise EngineUnavailable(kind, name, self.available(kind))
+        return engine
+
+    def select(self, stt=None, llm=None, tts=None):
+        """Selection of one engine per kind; empty names mean the defaults"""
+        return Selection(self.get('stt', stt), self.get('llm', llm), self.get('tts', tts))
+
+    def is_default(self, selection):
+        return all(engine.name == self._defaults.get(engine.kind) for engine in selection)
+
+    def stats(self):
+        return {
+            kind: {
+                'default': self._defaults.get(kind),
+                'available': self.available(kind),
+                'engines': {name: dict(engine.stats(), available=engine.available()) for name, engine in engines.items()}
+            }
+            for kind, engines in self._engines.items()
+        }
@@ -0,0 +1,462 @@
+"""
+Multi-key Groq client pool
+Spreads Whisper/Llama calls over several API keys (and optionally several
+base URLs) so one key's free-tier rate limit doesn't fail user requests:
+    - each key's remaining requests/tokens are tracked from the
+      x-ratelimit-* response headers
+    - calls go to the key with the most headroom
+    - a token bucket per key can cap the local request rate (GROQ_KEY_RPS,
+      off by default: Groq's own limits are followed from the headers)
+    - 429s put the key on cooldown (Retry-After) and the call fails over;
+      5xx/connection errors are retried with jittered exponential backoff
+    - a circuit breaker per key stops sending to a key that keeps failing
+
+pool.client / pool.async_client look like OpenAI / AsyncOpenAI for the two
+endpoints the server uses (chat.completions and audio.transcriptions).
+
+Configured by GROQ_API_KEYS (comma-separated, falls back to GROQ_API_KEY)
+and GROQ_BASE_URLS (one URL for all keys, or one per key).
+
+The openai package (about half a second to import) and the per-key clients
+are only loaded on the first call, or ahead of it by warm().
+"""
+
+import os
+import re
+import math
+import time
+import random
+import asyncio
+import logging
+import threading
+from types import SimpleNamespace
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://api.groq.com/openai/v1"
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value):
+    """Parse Groq reset durations ("2m59.56s", "7.66s", "120ms") or plain seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _UNITS[unit] for number, unit in parts)
+
+
+def _header_int(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def import_openai():
+    """The openai package, imported on first use"""
+    import openai
+    return openai
+
+
+class PoolBusy(Exception):
+    """No key can take the call before the admission timeout"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'all Groq API keys are busy, retry in {retry_after}s')
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Classic token bucket; rate <= 0 disables it"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= 1
+
+
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures -> half-open after `cooldown`"""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def wait_time(self, now):
+        """Seconds until a call may go through"""
+        if self.state == self.OPEN:
+            remaining = self.opened_at + self.cooldown - now
+            if remaining > 0:
+                return remaining
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+        if self.state == self.HALF_OPEN and self.trial_in_flight:
+            return self.cooldown
+        return 0.0
+
+    def on_dispatch(self):
+        if self.state == self.HALF_OPEN:
+            self.trial_in_flight = True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self, now, trip=False):
+        self.failures += 1
+        self.trial_in_flight = False
+        if trip or self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            self.state = self.OPEN
+            self.opened_at = now
+
+
+class KeyState:
+    """One API key: its clients, rate-limit view, bucket and breaker"""
+
+    def __init__(self, index, api_key, base_url, rate, burst, breaker, timeout):
+        self.name = f'key-{index}'
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self._client = None
+        self._async_client = None
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = breaker
+        self.limit_requests = None
+        self.limit_tokens = None
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.requests_reset_at = 0.0
+        self.tokens_reset_at = 0.0
+        self.cooldown_until = 0.0
+        self.in_flight = 0
+        self.counters = {'calls': 0, 'successes': 0, 'rate_limited': 0, 'errors': 0}
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Retries are done by the pool, across keys
+            self._client = import_openai().OpenAI(
+                api_key=self.api_key, base_url=self.base_url, max_retries=0, timeout=self.timeout
+            )
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = import_openai().AsyncOpenAI(
+                api_key=self.api_key, base_url=self.base_url, max_retries=0, timeout=self.timeout
+            )
+        return self._async_client
+
+    def update_limits(self, headers, now):
+        """Refresh the rate-limit view from x-ratelimit-* headers"""
+        limit_requests = _header_int(headers, 'x-ratelimit-limit-requests')
+        limit_tokens = _header_int(headers, 'x-ratelimit-limit-tokens')
+        remaining_requests = _header_int(headers, 'x-ratelimit-remaining-requests')
+        remaining_tokens = _header_int(headers, 'x-ratelimit-remaining-tokens')
+        if limit_requests is not None:
+            self.limit_requests = limit_requests
+        if limit_tokens is not None:
+            self.limit_tokens = limit_tokens
+        if remaining_requests is not None:
+            self.remaining_requests = remaining_requests
+            reset = parse_duration(headers.get('x-ratelimit-reset-requests'))
+            self.requests_reset_at = now + reset if reset else 0.0
+        if remaining_tokens is not None:
+            self.remaining_tokens = remaining_tokens
+            reset = parse_duration(headers.get('x-ratelimit-reset-tokens'))
+            self.tokens_reset_at = now + reset if reset else 0.0
+
+    def wait_time(self, now, tokens):
+        """Seconds until this key may take a call needing `tokens`"""
+        waits = [self.cooldown_until - now, self.breaker.wait_time(now), self.bucket.wait_time(now)]
+        if self.remaining_requests is not None and self.remaining_requests <= 0 and self.requests_reset_at > now:
+            waits.append(self.requests_reset_at - now)
+        if (tokens and self.remaining_tokens is not None and self.remaining_tokens < tokens
+                and self.tokens_reset_at > now):
+            waits.append(self.tokens_reset_at - now)
+        return max(0.0, *waits)
+
+    def headroom(self):
+        """Fraction of the key's window still available (1.0 when unknown)"""
+        fractions = [1.0]
+        if self.remaining_requests is not None and self.limit_requests:
+            fractions.append(self.remaining_requests / self.limit_requests)
+        if self.remaining_tokens is not None and self.limit_tokens:
+            fractions.append(self.remaining_tokens / self.limit_tokens)
+        return min(fractions)
+
+    def stats(self):
+        return dict(
+            self.counters,
+            base_url=self.base_url,
+            breaker=self.breaker.state,
+            in_flight=self.in_flight,
+            remaining_requests=self.remaining_requests,
+            remaining_tokens=self.remaining_tokens,
+            headroom=round(self.headroom(), 4)
+        )
+
+
+def estimate_tokens(path, kwargs):
+    """Rough token cost of a call, for admission against remaining-tokens"""
+    if path[0] != 'chat':
+        return 0
+    chars = sum(len(str(m.get('content') or '')) for m in kwargs.get('messages', ()))
+    return chars // 3 + int(kwargs.get('max_tokens') or 0)
+
+
+def _rewind(kwargs):
+    """A retried upload has to send its file from the start again"""
+    file = kwargs.get('file')
+    content = file[1] if isinstance(file, tuple) else file
+    if hasattr(content, 'seek'):
+        content.seek(0)
+
+
+class _Resource:
+    def __init__(self, pool, path):
+        self._pool = pool
+        self._path = path
+
+    def create(self, **kwargs):
+        return self._pool.call(self._path, **kwargs)
+
+
+class _AsyncResource(_Resource):
+    async def create(self, **kwargs):
+        return await self._pool.acall(self._path, **kwargs)
+
+
+class GroqPool:
+    """Schedules Groq calls over several keys with failover and backoff"""
+
+    def __init__(self, api_keys, base_urls=None, rate=0.0, burst=5, max_attempts=4,
+                 backoff_base=0.25, backoff_cap=4.0, queue_timeout=10.0,
+                 breaker_threshold=5, breaker_cooldown=30.0, timeout=60.0):
+        base_urls = base_urls or [DEFAULT_BASE_URL]
+        if len(base_urls) not in (1, len(api_keys)):
+            raise ValueError('GROQ_BASE_URLS must have one URL or one per key')
+        self.keys = [
+            KeyState(
+                i, key, base_urls[i] if len(base_urls) > 1 else base_urls[0],
+                rate, burst, CircuitBreaker(breaker_threshold, breaker_cooldown), timeout
+            )
+            for i, key in enumerate(api_keys)
+        ]
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+        self.client = SimpleNamespace(
+            chat=SimpleNamespace(completions=_Resource(self, ('chat', 'completions'))),
+            audio=SimpleNamespace(transcriptions=_Resource(self, ('audio', 'transcriptions')))
+        )
+        self.async_client = SimpleNamespace(
+            chat=SimpleNamespace(completions=_AsyncResource(self, ('chat', 'completions'))),
+            audio=SimpleNamespace(transcriptions=_AsyncResource(self, ('audio', 'transcriptions')))
+        )
+
+    # Scheduling
+
+    def _select(self, tokens):
+        """Reserve the key with the most headroom; returns (key, 0) or (None, seconds to wait)"""
+        with self._lock:
+            now = time.monotonic()
+            ready = []
+            wait = None
+            for key in self.keys:
+                key_wait = key.wait_time(now, tokens)
+                if key_wait <= 0:
+                    ready.append(key)
+                else:
+                    wait = key_wait if wait is None else min(wait, key_wait)
+            if not ready:
+                return None, wait
+            key = max(ready, key=lambda k: (k.headroom(), -k.in_flight))
+            key.bucket.take(now)
+            key.breaker.on_dispatch()
+            key.in_flight += 1
+            key.counters['calls'] += 1
+            # Reserve locally until the response headers tell us the real numbers
+            if key.remaining_requests is not None:
+                key.remaining_requests -= 1
+            if tokens and key.remaining_tokens is not None:
+                key.remaining_tokens -= tokens
+            return key, 0.0
+
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff"""
+        return self._rng.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def _on_success(self, key, headers):
+        with self._lock:
+            key.in_flight -= 1
+            key.counters['successes'] += 1
+            key.breaker.record_success()
+            key.update_limits(headers, time.monotonic())
+
+    def _on_error(self, key, error, attempt):
+        """Record a failed call; return the delay before retrying or re-raise"""
+        openai = import_openai()
+        with self._lock:
+            now = time.monotonic()
+            key.in_flight -= 1
+            response = getattr(error, 'response', None)
+            if response is not None:
+                key.update_limits(response.headers, now)
+            if isinstance(error, openai.RateLimitError):
+                key.counters['rate_limited'] += 1
+                retry_after = parse_duration(response.headers.get('retry-after')) if response is not None else None
+                key.cooldown_until = now + (retry_after or 1.0)
+                delay = 0.0  # another key may be free right away; _select waits otherwise
+            elif isinstance(error, openai.APIConnectionError) or (
+                    isinstance(error, openai.APIStatusError) and error.status_code >= 500):
+                key.counters['errors'] += 1
+                key.breaker.record_failure(now)
+                delay = self._backoff(attempt)
+            elif isinstance(error, openai.APIStatusError) and error.status_code in (401, 403):
+                # Bad or revoked key: take it out of rotation until the breaker cools down
+                key.counters['errors'] += 1
+                key.breaker.record_failure(now, trip=True)
+                delay = 0.0
+            else:
+                key.breaker.record_success()
+                raise error
+        if attempt + 1 >= self.max_attempts:
+            raise error
+        logger.warning(f"Groq call failed on {key.name} ({type(error).__name__}), retrying")
+        return delay
+
+    def call(self, path, **kwargs):
+        tokens = estimate_tokens(path, kwargs)
+        deadline = time.monotonic() + self.queue_timeout
+        attempt = 0
+        while True:
+            key, wait = self._select(tokens)
+            if key is None:
+                if time.monotonic() + wait > deadline:
+                    raise PoolBusy(max(1, math.ceil(wait)))
+                time.sleep(wait)
+                continue
+            resource = key.client
+            for name in path:
+                resource = getattr(resource, name)
+            _rewind(kwargs)
+            try:
+                raw = resource.with_raw_response.create(**kwargs)
+            except Exception as e:
+                delay = self._on_error(key, e, attempt)
+                attempt += 1
+                if delay:
+                    time.sleep(delay)
+                continue
+            self._on_success(key, raw.headers)
+            return raw.parse()
+
+    async def acall(self, path, **kwargs):
+        tokens = estimate_tokens(path, kwargs)
+        deadline = time.monotonic() + self.queue_timeout
+        attempt = 0
+        while True:
+            key, wait = self._select(tokens)
+            if key is None:
+                if time.monotonic() + wait > deadline:
+                    raise PoolBusy(max(1, math.ceil(wait)))
+                await asyncio.sleep(wait)
+                continue
+            resource = key.async_client
+            for name in path:
+                resource = getattr(resource, name)
+            _rewind(kwargs)
+            try:
+                raw = await resource.with_raw_response.create(**kwargs)
+            except Exception as e:
+                delay = self._on_error(key, e, attempt)
+                attempt += 1
+                if delay:
+                    await asyncio.sleep(delay)
+                continue
+            self._on_success(key, raw.headers)
+            return raw.parse()
+
+    def stats(self):
+        with self._lock:
+            return {key.name: key.stats() for key in self.keys}
+
+    def warm(self, connect=False):
+        """
+        Build every key's client now instead of on its first call; connect=True
+        also opens a keep-alive connection per key (GET /models, no tokens used)
+        """
+        for key in self.keys:
+            client = key.client
+            if connect:
+                try:
+                    client.models.list()
+                except Exception as e:
+                    logger.warning(f"Warmup request on {key.name} failed: {str(e)}")
+
+    def reset_clients(self):
+        """Drop clients (and their connection pools) inherited from a parent process"""
+        for key in self.keys:
+            key._client = None
+            key._async_client = None
+
+
+def create_groq_pool():
+    """Build the pool from GROQ_API_KEYS / GROQ_API_KEY and GROQ_BASE_URLS / GROQ_BASE_URL (None without keys)"""
+    keys = [k.strip() for k in os.getenv('GROQ_API_KEYS', '').split(',') if k.strip()]
+    if not keys:
+        single = os.getenv('GROQ_API_KEY') or os.getenv('OPENAI_API_KEY')
+        keys = [single] if single else []
+    if not keys:
+        return None
+    base_urls = os.getenv('GROQ_BASE_URLS') or os.getenv('GROQ_BASE_URL') or DEFAULT_BASE_URL
+    return GroqPool(
+        keys,
+        [u.strip() for u in base_urls.split(',') if u.strip()],
+        rate=float(os.getenv('GROQ_KEY_RPS', 0)),
+        burst=float(os.getenv('GROQ_KEY_BURST', 5)),
+        max_attempts=int(os.getenv('GROQ_MAX_ATTEMPTS', 4)),
+        queue_timeout=float(os.getenv('GROQ_QUEUE_TIMEOUT', 10)),
+        breaker_threshold=int(os.getenv('GROQ_BREAKER_THRESHOLD', 5)),
+        breaker_cooldown=float(os.getenv('GROQ_BREAKER_COOLDOWN', 30)),
+        timeout=float(os.getenv('GROQ_TIMEOUT', 60))
+    )
@@ -0,0 +1,44 @@
+"""
+gunicorn settings for server.py
+    gunicorn -c gunicorn.conf.py server:app
+
+The app is imported once in the master (preload_app) and the heavy packages
+(openai, gtts) are loaded there too, so forked workers share them instead
+of each paying the import on its first request. Every worker then drops the
+connections it inherited and starts its own background work (phrase bank
+build, WARMUP). SERVER_PRELOAD=0 goes back to importing the app per worker.
+
+With more than one worker, sessions, background jobs and incremental uploads
+must be visible to all of them, so SESSION_BACKEND defaults to sqlite here
+(set WEB_CONCURRENCY=1 to keep the in-process memory store).
+"""
+
+import os
+
+os.environ.setdefault('SERVER_PRELOAD', '1')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+if workers > 1:
+    os.environ.setdefault('SESSION_BACKEND', 'sqlite')
+# Threads keep long-poll (/wait) and SSE clients from blocking a whole worker.
+# Admission limits (see admission.py) are per worker and split its threads:
+# WAITING_REQUESTS (threads // 4) for long-poll/SSE waiters, PIPELINE_REQUESTS
+# (the rest but two) for the pipeline, and two for /status, /get-audio-stream
+# and the like. Raise GUNICORN_THREADS or use the ASGI server for many waiters.
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 120))
+preload_app = os.environ['SERVER_PRELOAD'].lower() in ('1', 'true', 'yes')
+
+
+def when_ready(arbiter):
+    if preload_app:
+        import server
+        server.preload()
+
+
+def post_fork(arbiter, worker):
+    if preload_app:
+        import server
+        server.after_fork()
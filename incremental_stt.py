@@ -0,0 +1,389 @@
+"""
+Incremental transcription of long recordings
+Instead of one upload after the user stops talking, a client opens an
+upload, posts the recording in ordered chunks while it is still speaking,
+and finishes it:
+    start  -> chunk 0, chunk 1, ... -> finish
+
+Each chunk must be decodable on its own (a complete WAV/webm/ogg file, or
+raw PCM described by the mimetype). Decoded audio is collected as 16 kHz
+mono and cut into segments of about segment_seconds at the quietest frame
+near the end, so words aren't split. Every segment is sent to Whisper as
+soon as it is cut, in parallel with the rest of the recording; silent
+segments are skipped. finish() flushes the tail and stitches the segment
+transcripts in order, so only the last few seconds are still being
+transcribed when the user stops.
+
+Chunks that can't be decoded (no NumPy, no decoder) become segments of
+their own and are sent as-is.
+
+Upload state lives in the shared session store (like /jobs), so start, chunk
+and finish requests may land on different gunicorn workers:
+    record 'upload'/<id>          metadata, segment results; blob = undecided
+                                  tail of the recording (float32 samples)
+    record 'upload-chunk'/<id>:N  out-of-order chunk N waiting for the gap
+A segment is transcribed by the worker that cut it and its text is written
+back to the record; finish() polls the record until every segment is done.
+"""
+
+import re
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import audio_preprocess
+from audio_preprocess import np, TARGET_RATE
+from session_store import MemorySessionStore
+
+logger = logging.getLogger(__name__)
+
+# Cut points are searched from this fraction of a segment onwards
+MIN_SEGMENT_FRACTION = 0.5
+FRAME_MS = 20
+
+
+class UploadError(Exception):
+    """A chunk or finish request that can't be accepted; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class SegmentFailed(Exception):
+    """A segment could not be transcribed (maybe by another worker); retry_after is kept from overload errors"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _words(text):
+    return re.sub(r'[^\w\s]', '', text).split()
+
+
+def stitch(texts):
+    """Join segment transcripts, dropping a word repeated across a boundary"""
+    stitched = []
+    for text in texts:
+        words = (text or '').split()
+        if not words:
+            continue
+        if stitched and _words(stitched[-1]) and _words(stitched[-1]) == _words(words[0]):
+            words = words[1:]
+        stitched.extend(words)
+    return ' '.join(stitched)
+
+
+def quietest_cut(samples, rate, start):
+    """Sample index of the quietest frame at or after start"""
+    frame = max(1, int(rate * FRAME_MS / 1000))
+    first = start // frame
+    n_frames = len(samples) // frame
+    if n_frames <= first:
+        return len(samples)
+    frames = samples[first * frame:n_frames * frame].reshape(-1, frame)
+    energy = np.mean(frames ** 2, axis=1)
+    return int((first + np.argmin(energy)) * frame + frame // 2)
+
+
+class IncrementalUploads:
+    """Incremental uploads kept in the session store plus this worker's segment transcription pool"""
+
+    def __init__(self, transcribe, store=None, workers=4, segment_seconds=5.0, ttl=120,
+                 max_bytes=10 * 1024 * 1024, poll_interval=0.1):
+        """
+        transcribe(filename, bytes, mimetype, engine) -> text is called for every segment,
+        engine being the name given to start() (None for the default)
+        """
+        self.transcribe = transcribe
+        self.store = store if store is not None else MemorySessionStore(ttl=ttl)
+        self.workers = workers
+        self.segment_seconds = segment_seconds
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._futures = {}  # (upload_id, segment) -> future, for segments transcribing here
+        self._executor = None
+        self._counters = {'started': 0, 'finished': 0, 'expired': 0, 'segments': 0}
+
+    def _pool(self):
+        # Created lazily so gunicorn forks don't inherit dead threads
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='stt-segment')
+            return self._executor
+
+    def start(self, device_id, filename=None, mimetype=None, engine=None):
+        """Open an upload and return its snapshot; engine names the STT engine for its segments"""
+        now = time.time()
+        upload = {
+            'id': uuid.uuid4().hex,
+            'device_id': device_id,
+            'filename': filename or 'recording.webm',
+            'mimetype': mimetype,
+            'engine': engine,
+            'next_seq': 0,
+            'pending': {},  # str(seq) -> mimetype of chunks waiting for a gap
+            'bytes': 0,
+            'buffered': 0,
+            'segments': [],
+            'finished': False,
+            'created': now,
+            'touched': now
+        }
+        self.store.put_record('upload', upload['id'], upload, blob=b'')
+        with self._lock:
+            self._counters['started'] += 1
+        return self.snapshot(upload)
+
+    def get(self, upload_id):
+        """Snapshot of an open upload, or None"""
+        upload = self._load(upload_id)
+        return self.snapshot(upload) if upload is not None else None
+
+    def _load(self, upload_id):
+        upload = self.store.get_record('upload', upload_id)
+        if upload is not None and upload['touched'] < time.time() - self.ttl:
+            self._delete(upload)
+            with self._lock:
+                self._counters['expired'] += 1
+            return None
+        return upload
+
+    def _delete(self, upload):
+        for seq in upload['pending']:
+            self.store.delete_record('upload-chunk', f"{upload['id']}:{seq}")
+        self.store.delete_record('upload', upload['id'])
+
+    def _buffer(self, upload_id):
+        if np is None:
+            return None
+        return np.frombuffer(self.store.get_blob('upload', upload_id) or b'', dtype=np.float32)
+
+    def _save(self, upload, buffer):
+        upload['buffered'] = len(buffer) if buffer is not None else 0
+        blob = buffer.astype(np.float32).tobytes() if buffer is not None else b''
+        self.store.put_record('upload', upload['id'], upload, blob=blob)
+
+    def add_chunk(self, upload_id, seq, data, mimetype=None):
+        """
+        Accept chunk number seq (0-based) and return (accepted, snapshot)
+        Out-of-order chunks wait in the store for the gap to fill; a retried chunk isn't accepted twice.
+        """
+        submits = []
+        with self.store.lock(f'upload:{upload_id}'):
+            upload = self._load(upload_id)
+            if upload is None:
+                raise UploadError('upload not found', 404)
+            if upload['finished']:
+                raise UploadError('upload already finished', 409)
+            if seq < upload['next_seq'] or str(seq) in upload['pending']:
+                return False, self.snapshot(upload)
+            if upload['bytes'] + len(data) > self.max_bytes:
+                raise UploadError('upload too large', 413)
+            upload['bytes'] += len(data)
+            upload['touched'] = time.time()
+            mimetype = mimetype or upload['mimetype']
+            if seq > upload['next_seq']:
+                self.store.put_record('upload-chunk', f'{upload_id}:{seq}', {}, blob=data)
+                upload['pending'][str(seq)] = mimetype
+                self.store.put_record('upload', upload_id, upload)
+                return True, self.snapshot(upload)
+
+            buffer = self._buffer(upload_id)
+            while True:
+                buffer = self._ingest(upload, buffer, data, mimetype, submits)
+                upload['next_seq'] += 1
+                # A waiting chunk's mimetype may itself be None (raw chunks of an upload without one)
+                if str(upload['next_seq']) not in upload['pending']:
+                    break
+                mimetype = upload['pending'].pop(str(upload['next_seq']))
+                key = f"{upload_id}:{upload['next_seq']}"
+                data = self.store.get_blob('upload-chunk', key) or b''
+                self.store.delete_record('upload-chunk', key)
+            self._save(upload, buffer)
+
+        for submit in submits:
+            self._submit(upload_id, *submit)
+        with self._changed:
+            self._changed.notify_all()
+        return True, self.snapshot(upload)
+
+    def _ingest(self, upload, buffer, data, mimetype, submits):
+        decoder = audio_preprocess.find_decoder(upload['filename'], mimetype) if np is not None else None
+        if decoder is not None:
+            try:
+                samples, rate = decoder(data, mimetype)
+            except Exception as e:
+                logger.warning(f"Chunk decode failed, sending it as its own segment: {str(e)}")
+            else:
+                mono = audio_preprocess.resample(audio_preprocess.downmix(samples), rate)
+                return self._cut_segments(upload, np.concatenate([buffer, mono]), submits)
+        buffer = self._flush(upload, buffer, submits)
+        self._add_segment(upload, submits, upload['filename'], data, mimetype)
+        return buffer
+
+    def _cut_segments(self, upload, buffer, submits):
+        target = int(self.segment_seconds * TARGET_RATE)
+        while len(buffer) >= target:
+            cut = quietest_cut(buffer[:target * 2], TARGET_RATE, int(target * MIN_SEGMENT_FRACTION))
+            self._add_samples(upload, buffer[:cut], submits)
+            buffer = buffer[cut:]
+        return buffer
+
+    def _flush(self, upload, buffer, submits):
+        if buffer is not None and len(buffer):
+            self._add_samples(upload, buffer, submits)
+            buffer = buffer[:0]
+        return buffer
+
+    def _add_samples(self, upload, samples, submits):
+        if len(audio_preprocess.trim_silence(samples, TARGET_RATE)) == 0:
+            upload['segments'].append({'state': 'silent'})  # nothing for Whisper to hear
+            return
+        stem = upload['filename'].rsplit('.', 1)[0]
+        self._add_segment(
+            upload, submits,
+            f"{stem}-{len(upload['segments'])}.wav",
+            audio_preprocess.encode_wav(samples, TARGET_RATE),
+            'audio/wav'
+        )
+
+    def _add_segment(self, upload, submits, filename, data, mimetype):
+        submits.append((len(upload['segments']), filename, data, mimetype, upload['engine']))
+        upload['segments'].append({'state': 'transcribing'})
+
+    def _submit(self, upload_id, index, filename, data, mimetype, engine):
+        future = self._pool().submit(self.transcribe, filename, data, mimetype, engine)
+        with self._lock:
+            self._futures[(upload_id, index)] = future
+        future.add_done_callback(lambda f: self._segment_done(upload_id, index, f))
+
+    def _segment_done(self, upload_id, index, future):
+        with self._lock:
+            self._futures.pop((upload_id, index), None)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            segment = {'state': 'done', 'text': future.result()}
+        else:
+            logger.warning(f"Segment {index} of upload {upload_id} failed: {str(error)}")
+            segment = {
+                'state': 'failed',
+                'error': getattr(error, 'message', None) or str(error),
+                'retry_after': getattr(error, 'retry_after', None)
+            }
+        with self.store.lock(f'upload:{upload_id}'):
+            upload = self.store.get_record('upload', upload_id)
+            if upload is not None:
+                upload['segments'][index] = segment
+                self.store.put_record('upload', upload_id, upload)
+        with self._changed:
+            self._changed.notify_all()
+
+    def _pause(self, deadline):
+        """Wait for a local change, or poll_interval for one made by another worker"""
+        with self._changed:
+            self._changed.wait(max(0.0, min(self.poll_interval, deadline - time.monotonic())))
+
+    def finish(self, upload_id, expected_chunks=None, timeout=5.0, wait_timeout=60.0):
+        """
+        Flush the tail, wait for every segment, forget the upload and return (text, info)
+        expected_chunks lets chunk requests still in flight arrive first (up to timeout).
+        Raises UploadError for missing chunks (the upload stays open), SegmentFailed
+        for a failed segment and TimeoutError if segments don't finish in wait_timeout.
+        """
+        deadline = time.monotonic() + timeout
+        submits = []
+        while True:
+            with self.store.lock(f'upload:{upload_id}'):
+                upload = self._load(upload_id)
+                if upload is None:
+                    raise UploadError('upload not found', 404)
+                if upload['finished']:
+                    raise UploadError('upload already finished', 409)
+                arrived = expected_chunks is None or upload['next_seq'] >= expected_chunks
+                if arrived or time.monotonic() >= deadline:
+                    if not arrived:
+                        missing = [
+                            seq for seq in range(upload['next_seq'], expected_chunks)
+                            if str(seq) not in upload['pending']
+                        ]
+                        raise UploadError(f'missing chunks: {missing}', 409)
+                    if upload['pending']:
+                        raise UploadError(f"missing chunks before {min(map(int, upload['pending']))}", 409)
+                    upload['finished'] = True
+                    self._save(upload, self._flush(upload, self._buffer(upload_id), submits))
+                    break
+            self._pause(deadline)
+        for submit in submits:
+            self._submit(upload_id, *submit)
+
+        started = time.perf_counter()
+        wait_deadline = time.monotonic() + wait_timeout
+        try:
+            while True:
+                upload = self.store.get_record('upload', upload_id)
+                if upload is None:
+                    raise UploadError('upload was cancelled', 409)
+                transcribing = sum(1 for s in upload['segments'] if s['state'] == 'transcribing')
+                if not transcribing:
+                    break
+                if time.monotonic() >= wait_deadline:
+                    raise TimeoutError(f'{transcribing} segments still transcribing')
+                self._pause(wait_deadline)
+        except TimeoutError:
+            self.discard(upload_id)
+            raise
+        self.store.delete_record('upload', upload_id)
+
+        segments = upload['segments']
+        with self._lock:
+            self._counters['finished'] += 1
+            self._counters['segments'] += len(segments)
+        failed = next((s for s in segments if s['state'] == 'failed'), None)
+        if failed is not None:
+            raise SegmentFailed(failed['error'], failed['retry_after'])
+        return stitch([s.get('text', '') for s in segments]), {
+            'chunks': upload['next_seq'],
+            'segments': len(segments),
+            'silent_segments': sum(1 for s in segments if s['state'] == 'silent'),
+            'bytes': upload['bytes'],
+            'tail_wait_ms': round((time.perf_counter() - started) * 1000, 1)
+        }
+
+    def discard(self, upload_id):
+        """Abort an upload (segments transcribing in this worker are cancelled)"""
+        with self.store.lock(f'upload:{upload_id}'):
+            upload = self.store.get_record('upload', upload_id)
+            if upload is not None:
+                self._delete(upload)
+        with self._lock:
+            futures = [f for key, f in self._futures.items() if key[0] == upload_id]
+        for future in futures:
+            future.cancel()
+        return upload is not None
+
+    @staticmethod
+    def snapshot(upload):
+        return {
+            'upload_id': upload['id'],
+            'device_id': upload['device_id'],
+            'next_seq': upload['next_seq'],
+            'pending_chunks': sorted(map(int, upload['pending'])),
+            'segments': len(upload['segments']),
+            'segments_done': sum(1 for s in upload['segments'] if s['state'] != 'transcribing'),
+            'buffered_seconds': round(upload['buffered'] / TARGET_RATE, 2),
+            'finished': upload['finished']
+        }
+
+    def stats(self):
+        """Counters of this worker; 'transcribing' = segments it is transcribing right now"""
+        with self._lock:
+            return dict(self._counters, transcribing=len(self._futures))
@@ -0,0 +1,31 @@
+"""
+App-owned state directory
+On-disk state that would otherwise default to a fixed /tmp path (single-flight
+lock files, the TTS disk cache) lives under INSTANCE_DIR instead, by default
+the Flask instance folder next to this file. Every directory handed out is
+mode 0700, so other local users can neither read it nor plant files in it.
+
+    lock_dir = private_dir('singleflight')   # None if it can't be created
+"""
+
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+INSTANCE_DIR = os.getenv(
+    'INSTANCE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+)
+
+
+def private_dir(name):
+    """<INSTANCE_DIR>/<name>, created or tightened to mode 0700; None if that fails"""
+    path = os.path.join(INSTANCE_DIR, name)
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        os.chmod(path, 0o700)
+    except OSError as e:
+        logger.warning(f"State directory {path} unavailable: {str(e)}")
+        return None
+    return path
@@ -0,0 +1,147 @@
+"""
+Background job queue for the voice pipeline
+/upload?async=1 returns a job ID immediately; a fixed pool of worker threads
+runs the STT -> LLM -> TTS stages and records per-stage state:
+    queued -> transcribing -> thinking -> speaking -> done (or error)
+Queue depth is bounded; submit() raises QueueFull when it is saturated.
+
+Jobs run in the worker that accepted them, but their state is written to the
+shared session store, so /jobs/<id> can be answered by any gunicorn worker
+(with the sqlite backend; the memory backend only works with one worker).
+"""
+
+import time
+import uuid
+import queue
+import logging
+import threading
+
+from session_store import MemorySessionStore
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATES = ('done', 'error')
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at its maximum depth"""
+
+    def __init__(self, retry_after):
+        super().__init__('job queue is full')
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    """Bounded queue of pipeline jobs run by a pool of worker threads"""
+
+    def __init__(self, workers=4, max_depth=32, ttl=600, store=None, poll_interval=0.25):
+        """store is the session store job records are shared through (in-process if None)"""
+        self.workers = workers
+        self.max_depth = max_depth
+        self.ttl = ttl
+        self.store = store if store is not None else MemorySessionStore(ttl=ttl)
+        self.poll_interval = poll_interval
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._changed = threading.Condition()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._avg_seconds = 5.0
+
+    def _ensure_workers(self):
+        # Workers start lazily so gunicorn forks don't inherit dead threads
+        with self._start_lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._worker, daemon=True, name='job-worker')
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, device_id, fn, *args):
+        """
+        Queue fn(*args, on_stage=...) and return the job snapshot
+        Raises QueueFull when max_depth jobs are already waiting.
+        """
+        self._ensure_workers()
+        now = time.time()
+        job = {
+            'id': uuid.uuid4().hex,
+            'device_id': device_id,
+            'state': 'queued',
+            'stages': {'queued': now},
+            'result': None,
+            'error': None,
+            'version': 0,
+            'created_at': now,
+            'updated_at': now
+        }
+        self.store.put_record('job', job['id'], job)
+        try:
+            self._queue.put_nowait((job['id'], fn, args))
+        except queue.Full:
+            self.store.delete_record('job', job['id'])
+            raise QueueFull(self.retry_after())
+        logger.info(f"Queued job {job['id']} (depth {self._queue.qsize()})")
+        return dict(job)
+
+    def get(self, job_id):
+        """Return a snapshot of the job or None (also once a finished job is older than the TTL)"""
+        job = self.store.get_record('job', job_id)
+        if job is not None and job['state'] in FINAL_STATES and job['updated_at'] < time.time() - self.ttl:
+            self.store.delete_record('job', job_id)
+            return None
+        return job
+
+    def wait(self, job_id, version, timeout):
+        """
+        Block until the job changes past `version` (or timeout), return its snapshot
+        Jobs run here wake the waiter right away; jobs run by another worker are
+        noticed by polling the store every poll_interval.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['version'] > version:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(min(remaining, self.poll_interval))
+
+    def depth(self):
+        """Number of jobs waiting for a worker"""
+        return self._queue.qsize()
+
+    def retry_after(self):
+        """Rough seconds until a queue slot frees up"""
+        return max(1, int(self._avg_seconds * self._queue.qsize() / self.workers))
+
+    def _set_state(self, job_id, state, **fields):
+        with self.store.lock(f'job:{job_id}'):
+            job = self.store.get_record('job', job_id)
+            if job is None:
+                return
+            now = time.time()
+            job['state'] = state
+            job['stages'] = dict(job['stages'], **{state: now})
+            job.update(fields)
+            job['version'] += 1
+            job['updated_at'] = now
+            self.store.put_record('job', job_id, job)
+        with self._changed:
+            self._changed.notify_all()
+
+    def _worker(self):
+        while True:
+            job_id, fn, args = self._queue.get()
+            started = time.monotonic()
+            try:
+                result = fn(*args, on_stage=lambda stage: self._set_state(job_id, stage))
+                self._set_state(job_id, 'done', result=result)
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {str(e)}")
+                self._set_state(job_id, 'error', error=getattr(e, 'message', str(e)))
+            finally:
+                elapsed = time.monotonic() - started
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+                self._queue.task_done()
@@ -0,0 +1,193 @@
+"""
+Lightweight in-process latency metrics for the voice pipeline
+Each stage (stt, llm, tts, audio_send, ...) gets a histogram with fixed
+buckets, a small reservoir of recent samples for p50/p90/p99, error counts
+and payload sizes. render_prometheus() produces the /metrics text format.
+
+Metrics are per process: under gunicorn each worker reports its own numbers.
+"""
+
+import os
+import time
+import bisect
+import resource
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Latency buckets in seconds (Prometheus `le` labels)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.9, 0.99)
+RESERVOIR_SIZE = 2048
+
+
+def process_memory():
+    """Current and peak resident memory of this process in bytes"""
+    rss = 0
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {'rss_bytes': rss, 'peak_rss_bytes': max(peak, rss)}
+
+
+class StageStats:
+    """Histogram, recent-sample reservoir, error and payload counters for one stage"""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.payload_bytes = 0
+        self.payload_count = 0
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, seconds, error=False, size=None):
+        index = bisect.bisect_left(BUCKETS, seconds)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+        if error:
+            self.errors += 1
+        if size is not None:
+            self.payload_bytes += size
+            self.payload_count += 1
+
+    def quantiles(self):
+        samples = sorted(self.recent)
+        if not samples:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in QUANTILES}
+
+
+class Span:
+    """Handle yielded by Metrics.timer(); set .size once the payload size is known"""
+
+    __slots__ = ('size', 'elapsed')
+
+    def __init__(self):
+        self.size = None
+        self.elapsed = 0.0
+
+
+class Metrics:
+    """Registry of per-stage stats plus free-form gauges"""
+
+    def __init__(self, prefix='voice'):
+        self.prefix = prefix
+        self._stages = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, error=False, size=None):
+        """Record one stage timing"""
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            stats.observe(seconds, error, size)
+
+    @contextmanager
+    def timer(self, stage, timings=None, size=None):
+        """
+        Time a block as `stage`. Exceptions are counted as errors and re-raised.
+        If a timings dict is given, the duration (ms) is also stored in it.
+        """
+        span = Span()
+        span.size = size
+        start = time.perf_counter()
+        error = False
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            span.elapsed = time.perf_counter() - start
+            self.observe(stage, span.elapsed, error, span.size)
+            if timings is not None:
+                timings[stage] = round(span.elapsed * 1000, 1)
+
+    def register_gauge(self, name, help_text, fn):
+        """Expose fn() -> {labels_tuple_or_None: value} as a gauge at scrape time"""
+        self._gauges[name] = (help_text, fn)
+
+    def snapshot(self):
+        """Per-stage summary as a dict (seconds)"""
+        with self._lock:
+            stages = list(self._stages.items())
+            result = {}
+            for stage, stats in stages:
+                quantiles = stats.quantiles()
+                result[stage] = {
+                    'count': stats.count,
+                    'errors': stats.errors,
+                    'mean': stats.total / stats.count if stats.count else 0.0,
+                    'p50': quantiles[0.5],
+                    'p90': quantiles[0.9],
+                    'p99': quantiles[0.99],
+                    'payload_bytes': stats.payload_bytes
+                }
+            return result
+
+    def render_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        p = self.prefix
+        lines = [
+            f'# HELP {p}_stage_duration_seconds Pipeline stage latency',
+            f'# TYPE {p}_stage_duration_seconds histogram'
+        ]
+        with self._lock:
+            stages = sorted(self._stages.items())
+            for stage, stats in stages:
+                cumulative = 0
+                for bound, count in zip(BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'{p}_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{p}_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats.count}')
+                lines.append(f'{p}_stage_duration_seconds_sum{{stage="{stage}"}} {stats.total:.6f}')
+                lines.append(f'{p}_stage_duration_seconds_count{{stage="{stage}"}} {stats.count}')
+
+            lines += [
+                f'# HELP {p}_stage_latency_seconds Recent pipeline stage latency quantiles',
+                f'# TYPE {p}_stage_latency_seconds summary'
+            ]
+            for stage, stats in stages:
+                for q, value in stats.quantiles().items():
+                    lines.append(f'{p}_stage_latency_seconds{{stage="{stage}",quantile="{q}"}} {value:.6f}')
+                lines.append(f'{p}_stage_latency_seconds_sum{{stage="{stage}"}} {stats.total:.6f}')
+                lines.append(f'{p}_stage_latency_seconds_count{{stage="{stage}"}} {stats.count}')
+
+            lines += [
+                f'# HELP {p}_stage_errors_total Pipeline stage failures',
+                f'# TYPE {p}_stage_errors_total counter'
+            ]
+            lines += [f'{p}_stage_errors_total{{stage="{stage}"}} {stats.errors}' for stage, stats in stages]
+
+            lines += [
+                f'# HELP {p}_stage_payload_bytes Payload size handled by each stage',
+                f'# TYPE {p}_stage_payload_bytes summary'
+            ]
+            for stage, stats in stages:
+                if stats.payload_count:
+                    lines.append(f'{p}_stage_payload_bytes_sum{{stage="{stage}"}} {stats.payload_bytes}')
+                    lines.append(f'{p}_stage_payload_bytes_count{{stage="{stage}"}} {stats.payload_count}')
+
+        for name, (help_text, fn) in sorted(self._gauges.items()):
+            lines += [f'# HELP {p}_{name} {help_text}', f'# TYPE {p}_{name} gauge']
+            try:
+                values = fn()
+            except Exception:
+                continue
+            for labels, value in values.items():
+                label_text = ''
+                if labels:
+                    label_text = '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+                lines.append(f'{p}_{name}{label_text} {value}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,213 @@
+"""
+Pre-synthesized phrase bank
+Fixed messages (error texts, status prompts) are synthesized once, at build
+time or on first startup, into a single packed archive. The server memory-maps
+it and serves entries by ID, so devices can play these messages without a
+gTTS call or network access.
+
+Archive layout (little-endian):
+    b'PHRB' | u16 version | u16 reserved | u32 index length
+    index   - UTF-8 JSON {"lang", "voice", "entries": {id: [offset, length, key, text]}}
+    data    - mp3 blobs, each starting on a 16-byte boundary
+
+key is tts_cache.make_key(text, lang, voice); a rebuild only synthesizes
+phrases whose key changed and copies the rest from the previous archive.
+
+Build from the command line:
+    python phrase_bank.py --output phrases.bank [--phrases phrases.json]
+"""
+
+import os
+import json
+import mmap
+import fcntl
+import struct
+import logging
+import argparse
+
+from tts_cache import make_key
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PHRB'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+ALIGN = 16
+
+# Messages the server sends, by ID (texts match server.py)
+DEFAULT_PHRASES = {
+    'no_audio': 'لم يتم إرسال ملف صوتي',
+    'empty_filename': 'اسم الملف فارغ',
+    'no_text': 'لم يتم إرسال نص',
+    'too_large': 'الملف كبير جداً. الحد الأقصى 10MB',
+    'busy': 'السيرفر مشغول، حاول مرة أخرى',
+    'stt_error': 'خطأ في تحويل الصوت',
+    'llm_error': 'خطأ في الذكاء الاصطناعي',
+    'tts_error': 'خطأ في TTS',
+    'server_error': 'خطأ في السيرفر',
+    'ready': 'جاهز، تحدث الآن',
+    'processing': 'جاري المعالجة، انتظر قليلاً',
+    'cleared': 'تم المسح بنجاح',
+}
+
+
+def load_phrases(path=None):
+    """Phrase list: DEFAULT_PHRASES updated with a JSON file of {id: text} (null removes an entry)"""
+    phrases = dict(DEFAULT_PHRASES)
+    if path:
+        with open(path, encoding='utf-8') as f:
+            for phrase_id, text in json.load(f).items():
+                if text is None:
+                    phrases.pop(phrase_id, None)
+                else:
+                    phrases[phrase_id] = text
+    return phrases
+
+
+class PhraseBank:
+    """Read-only, memory-mapped phrase archive"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mtime = os.fstat(f.fileno()).st_mtime
+        magic, version, _, index_length = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mmap.close()
+            raise ValueError(f'{path} is not a phrase bank (version {VERSION})')
+        index = json.loads(self._mmap[HEADER.size:HEADER.size + index_length].decode('utf-8'))
+        self.lang = index['lang']
+        self.voice = index['voice']
+        self._entries = {phrase_id: tuple(entry) for phrase_id, entry in index['entries'].items()}
+        self._view = memoryview(self._mmap)
+
+    @classmethod
+    def open(cls, path):
+        """Open an archive, or return None if it is missing or unreadable"""
+        try:
+            return cls(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Phrase bank {path} unusable: {str(e)}")
+            return None
+
+    def __contains__(self, phrase_id):
+        return phrase_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ids(self):
+        return list(self._entries)
+
+    def get(self, phrase_id):
+        """(memoryview of the mp3, key, text) for a phrase, or None"""
+        entry = self._entries.get(phrase_id)
+        if entry is None:
+            return None
+        offset, length, key, text = entry
+        return self._view[offset:offset + length], key, text
+
+    def stale(self, phrases, lang, voice=''):
+        """IDs in phrases that are missing from the archive or have different text"""
+        return [
+            phrase_id for phrase_id, text in phrases.items()
+            if self._entries.get(phrase_id, (None, None, None))[2] != make_key(text, lang, voice)
+        ]
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'phrases': len(self._entries),
+            'bytes': len(self._mmap)
+        }
+
+    def close(self):
+        # Views handed out earlier keep the map alive until they are released
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+
+
+def build(path, phrases, synthesize, lang='ar', voice=''):
+    """
+    Write an archive for phrases ({id: text}); synthesize(text) returns mp3 bytes
+    Entries whose text is unchanged are copied from the existing archive.
+    Concurrent builders (gunicorn workers) are serialized with a lock file.
+    Returns {'synthesized': n, 'reused': n, 'bytes': n}.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(f'{path}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        previous = PhraseBank.open(path)
+        try:
+            blobs, entries = [], {}
+            stats = {'synthesized': 0, 'reused': 0, 'bytes': 0}
+            for phrase_id, text in phrases.items():
+                key = make_key(text, lang, voice)
+                old = previous.get(phrase_id) if previous is not None else None
+                if old is not None and old[1] == key:
+                    data = old[0].tobytes()
+                    stats['reused'] += 1
+                else:
+                    data = synthesize(text)
+                    stats['synthesized'] += 1
+                blobs.append((phrase_id, key, text, data))
+        finally:
+            if previous is not None:
+                previous.close()
+
+        # Offsets depend on the index length, which depends on the offsets: size the index first
+        def index_bytes(base):
+            offset = base
+            for phrase_id, key, text, data in blobs:
+                offset = -(-offset // ALIGN) * ALIGN
+                entries[phrase_id] = [offset, len(data), key, text]
+                offset += len(data)
+            return json.dumps({'lang': lang, 'voice': voice, 'entries': entries}, ensure_ascii=False).encode('utf-8')
+
+        index = index_bytes(0)
+        while True:
+            base = -(-(HEADER.size + len(index)) // ALIGN) * ALIGN
+            resized = index_bytes(base)
+            if len(resized) == len(index):
+                index = resized
+                break
+            index = resized
+
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, 0, len(index)))
+            f.write(index)
+            for phrase_id, key, text, data in blobs:
+                f.write(b'\0' * (entries[phrase_id][0] - f.tell()))
+                f.write(data)
+            stats['bytes'] = f.tell()
+        os.replace(tmp_path, path)
+    logger.info(f"Phrase bank {path}: {stats}")
+    return stats
+
+
+def main():
+    from tts_engine import PooledGTTS
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--output', default='phrases.bank')
+    parser.add_argument('--phrases', help='JSON file of {id: text} added to the defaults')
+    parser.add_argument('--lang', default='ar')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    def synthesize(text):
+        return b''.join(PooledGTTS(text=text, lang=args.lang).stream())
+
+    print(json.dumps(build(args.output, load_phrases(args.phrases), synthesize, args.lang, 'gtts')))
+
+
+if __name__ == '__main__':
+    main()
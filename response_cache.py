@@ -0,0 +1,148 @@
+"""
+Response cache for repeated questions
+Sits between Whisper and the LLM call. Questions are normalized (Arabic
+diacritics removed, alef/ya/ta-marbuta forms unified, whitespace collapsed)
+and looked up in:
+    1. an exact-match index on the normalized text
+    2. an optional character n-gram index (Jaccard similarity >= threshold)
+Entries keep the answer text and its mp3 so a hit skips both LLM and TTS.
+Eviction is by TTL and by entry count (least recently used first).
+"""
+
+import re
+import time
+import threading
+from collections import OrderedDict, defaultdict
+
+# Harakat, superscript alef and tatweel
+_DIACRITICS = re.compile('[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+_CHAR_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+})
+
+
+def normalize_arabic(text):
+    """Normalize text for cache lookups"""
+    text = _DIACRITICS.sub('', text or '')
+    text = text.translate(_CHAR_MAP).lower()
+    text = _PUNCTUATION.sub(' ', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+def char_ngrams(text, n=3):
+    """Set of character n-grams (with word-boundary padding)"""
+    padded = f' {text} '
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class ResponseCache:
+    """Exact + n-gram similarity cache of (response_text, mp3) per question"""
+
+    def __init__(self, max_entries=256, ttl=3600, similarity=0.85, ngram=3):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.ngram = ngram
+        self._entries = OrderedDict()
+        self._index = defaultdict(set)
+        self._lock = threading.Lock()
+        self._counters = {'exact_hits': 0, 'similar_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def get(self, question):
+        """Return (response_text, audio_bytes) for a matching question, or None"""
+        key = normalize_arabic(question)
+        if not key:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires'] > now:
+                self._entries.move_to_end(key)
+                self._counters['exact_hits'] += 1
+                return entry['response_text'], entry['audio']
+
+            match = self._similar(key, now) if self.similarity else None
+            if match is not None:
+                self._entries.move_to_end(match)
+                self._counters['similar_hits'] += 1
+                entry = self._entries[match]
+                return entry['response_text'], entry['audio']
+
+            self._counters['misses'] += 1
+            return None
+
+    def put(self, question, response_text, audio):
+        """Cache the answer and its mp3 for a question"""
+        key = normalize_arabic(question)
+        if not key:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            grams = char_ngrams(key, self.ngram)
+            self._entries[key] = {
+                'response_text': response_text,
+                'audio': audio,
+                'grams': grams,
+                'expires': time.monotonic() + self.ttl
+            }
+            for gram in grams:
+                self._index[gram].add(key)
+            self._counters['stores'] += 1
+            self._evict()
+
+    def stats(self):
+        """Return hit/miss counters"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        lookups = stats['exact_hits'] + stats['similar_hits'] + stats['misses']
+        stats['hit_ratio'] = round(
+            (stats['exact_hits'] + stats['similar_hits']) / lookups, 4
+        ) if lookups else 0.0
+        return stats
+
+    # Internals (caller holds self._lock)
+
+    def _similar(self, key, now):
+        """Best entry whose n-gram Jaccard similarity clears the threshold"""
+        grams = char_ngrams(key, self.ngram)
+        overlap = defaultdict(int)
+        for gram in grams:
+            for candidate in self._index.get(gram, ()):
+                overlap[candidate] += 1
+        best, best_score = None, self.similarity
+        for candidate, shared in overlap.items():
+            entry = self._entries[candidate]
+            if entry['expires'] <= now:
+                continue
+            score = shared / (len(grams) + len(entry['grams']) - shared)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for gram in entry['grams']:
+            keys = self._index.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[gram]
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [key for key, entry in self._entries.items() if entry['expires'] <= now]
+        for key in expired:
+            self._remove(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self._counters['evictions'] += 1
+        self._counters['evictions'] += len(expired)
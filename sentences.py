@@ -0,0 +1,52 @@
+"""
+Sentence splitting for Arabic/English text
+Used to cut streamed LLM output into pieces that can be synthesized early.
+"""
+
+import re
+
+# Sentence-ending punctuation (Latin and Arabic) and newlines
+SENTENCE_END = re.compile(r'([.!?؟۔…]+|\n+)')
+
+# Don't send tiny fragments to TTS on their own
+MIN_SENTENCE_CHARS = 20
+
+
+def split_sentences(text, min_chars=MIN_SENTENCE_CHARS):
+    """Split complete text into sentences (short ones are merged forward)"""
+    splitter = SentenceSplitter(min_chars=min_chars)
+    sentences = splitter.feed(text)
+    sentences.extend(splitter.flush())
+    return sentences
+
+
+class SentenceSplitter:
+    """Incremental splitter: feed text deltas, get back finished sentences"""
+
+    def __init__(self, min_chars=MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ''
+
+    def feed(self, delta):
+        """Add a text delta and return any sentences it completed"""
+        self._buffer += delta
+        sentences = []
+        start = 0
+        for match in SENTENCE_END.finditer(self._buffer):
+            end = match.end()
+            # Punctuation at the very end may still be followed by more of
+            # itself (e.g. '...'), so wait for the next delta
+            if end == len(self._buffer) and not match.group().startswith('\n'):
+                break
+            sentence = self._buffer[start:end].strip()
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = end
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return whatever text is left once the stream has ended"""
+        sentence = self._buffer.strip()
+        self._buffer = ''
+        return [sentence] if sentence else []
@@ -6,12 +6,45 @@ Fixed for Python 3.13 - No pydub dependency
 
 import os
 import io
+import json
+import time
+import uuid
+import base64
+import shutil
+import hashlib
 import logging
-from flask import Flask, request, jsonify, send_file, render_template_string
+import tempfile
+import threading
+from urllib.parse import urlencode
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Request, request, jsonify, send_file, Response, g
 from flask_cors import CORS
-from openai import OpenAI
-from gtts import gTTS  # إضافة مكتبة الصوت المجانية
+from tts_engine import ParallelTTS, pooled_gtts as gTTS, import_gtts, reset_session, warm as warm_gtts  # إضافة مكتبة الصوت المجانية (مع جلسة HTTP مشتركة)
 from dotenv import load_dotenv
+from session_store import create_session_store, clean_device_id
+from device_events import create_device_events
+from web_ui import WebUI
+from device_frame import MIME_TYPE as FRAME_MIME_TYPE, STATE_READY, frame_parts, frame_state
+from sentences import SentenceSplitter
+from tts_cache import TTSCache, create_tts_cache, make_key
+from response_cache import ResponseCache, normalize_arabic
+from singleflight import create_single_flight
+from conversation import ConversationMemory
+from jobs import JobQueue, QueueFull, FINAL_STATES
+from incremental_stt import IncrementalUploads, UploadError, SegmentFailed
+from batch import BatchRunner, ItemTooLarge, archive_kind, iter_audio
+import phrase_bank
+from engines import (
+    EngineRegistry, EngineUnavailable, KINDS, audio_length,
+    GroqSTT, GroqLLM, GTTSEngine, FasterWhisperSTT, LlamaCppLLM, EspeakTTS, FakeSTT, FakeLLM, FakeTTS
+)
+from metrics import Metrics, process_memory
+from groq_pool import PoolBusy, create_groq_pool, import_openai
+from admission import Overloaded, create_admission_control
+import audio_preprocess
+import audio_formats
+from audio_formats import FormatUnavailable, Transcoder
 
 # Load environment variables
 load_dotenv()
@@ -23,40 +56,936 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Uploads larger than this are spooled to a temp file while the body is parsed
+UPLOAD_SPOOL_SIZE = int(os.getenv('UPLOAD_SPOOL_SIZE', 256 * 1024))
+# Read whole uploads into memory like older versions did (for benchmark comparisons)
+UPLOAD_IN_MEMORY = os.getenv('UPLOAD_IN_MEMORY', '').lower() in ('1', 'true', 'yes')
+
+
+class SpooledRequest(Request):
+    """Request whose file uploads are spooled to disk past UPLOAD_SPOOL_SIZE"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE, mode='rb+')
+
+
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = SpooledRequest
 CORS(app)
 
 # Configure max upload size (10MB)
-app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE
+
+# Model settings
+STT_MODEL = "whisper-large-v3"  # موديل مجاني وسريع
+LLM_MODEL = "llama3-8b-8192"  # موديل مجاني ذكي
+SYSTEM_PROMPT = "أنت مساعد صوتي ذكي ومفيد. أجب بشكل مختصر ومفيد باللغة العربية."
+TTS_LANG = 'ar'
+
+# Long answers are synthesized as parallel gTTS chunks (see tts_engine.py)
+TTS_PARALLEL_WORKERS = int(os.getenv('TTS_PARALLEL_WORKERS', 4))
+
+# Streaming mode: parallel TTS workers and how long readers wait for chunks
+STREAM_TTS_WORKERS = int(os.getenv('STREAM_TTS_WORKERS', 2))
+STREAM_POLL_INTERVAL = 0.05
+STREAM_TIMEOUT = 60
+
+# Audio delivery: body chunk size for constrained clients (0 = one piece),
+# overridable per request with ?chunk=<bytes>
+AUDIO_CHUNK_SIZE = int(os.getenv('AUDIO_CHUNK_SIZE', 0))
+MIN_CHUNK_SIZE = 256
+MAX_CHUNK_SIZE = 1024 * 1024
+
+# Downmix/resample/trim uploads before Whisper (also per request with ?preprocess=1)
+AUDIO_PREPROCESS = os.getenv('AUDIO_PREPROCESS', '').lower() in ('1', 'true', 'yes')
+
+# Multi-turn memory per device (0 turns disables it); CONVERSATION_SUMMARY=llm
+# summarizes old turns with the LLM instead of keeping short extracts
+CONVERSATION_TURNS = int(os.getenv('CONVERSATION_TURNS', 8))
+CONVERSATION_TOKEN_BUDGET = int(os.getenv('CONVERSATION_TOKEN_BUDGET', 2048))
+CONVERSATION_TTL = int(os.getenv('CONVERSATION_TTL', 600))
+MAX_ANSWER_TOKENS = 150
 
-# Initialize Groq client (using OpenAI library format)
+# Incremental uploads (/upload/start -> chunks -> finish, see incremental_stt.py)
+STT_SEGMENT_SECONDS = float(os.getenv('STT_SEGMENT_SECONDS', 5))
+STT_SEGMENT_WORKERS = int(os.getenv('STT_SEGMENT_WORKERS', 4))
+INCREMENTAL_UPLOAD_TTL = int(os.getenv('INCREMENTAL_UPLOAD_TTL', 120))
+
+# Batch reprocessing (/batch, see batch.py): threads per pipeline stage and request limits
+BATCH_STT_WORKERS = int(os.getenv('BATCH_STT_WORKERS', 4))
+BATCH_LLM_WORKERS = int(os.getenv('BATCH_LLM_WORKERS', 4))
+BATCH_TTS_WORKERS = int(os.getenv('BATCH_TTS_WORKERS', 4))
+BATCH_MAX_WORKERS = 16
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 200 * 1024 * 1024))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 1000))
+
+# Pre-synthesized fixed messages (see phrase_bank.py)
+# PHRASE_BANK_BUILD: 'missing' builds/refreshes the archive in the background when
+# phrases are missing or changed, '0' only uses an archive built ahead of time
+PHRASE_BANK_PATH = os.getenv('PHRASE_BANK', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'phrases.bank'))
+PHRASE_BANK_PHRASES = os.getenv('PHRASE_BANK_PHRASES')
+PHRASE_BANK_BUILD = os.getenv('PHRASE_BANK_BUILD', 'missing').lower()
+
+# Startup (see gunicorn.conf.py). SERVER_PRELOAD=1 means the app is imported once in the
+# gunicorn master: per-process background work then starts in each worker after fork.
+# WARMUP does first-use work in the background right after startup:
+# 'imports' (openai/gtts and API clients) or 'connections' (also opens keep-alive connections)
+SERVER_PRELOAD = os.getenv('SERVER_PRELOAD', '').lower() in ('1', 'true', 'yes')
+WARMUP = os.getenv('WARMUP', '').lower()
+
+# Web UI: the page is precompressed once at startup (see web_ui.py);
+# WEB_UI_SPLIT_ASSETS=1 serves its CSS/JS as separately cached, versioned files
+WEB_UI_SPLIT_ASSETS = os.getenv('WEB_UI_SPLIT_ASSETS', '').lower() in ('1', 'true', 'yes')
+# WEB_UI_INCREMENTAL=1 streams recordings through incremental uploads (see incremental_stt.py)
+WEB_UI_INCREMENTAL = os.getenv('WEB_UI_INCREMENTAL', '').lower() in ('1', 'true', 'yes')
+
+# Server-sent events: keep-alive interval and maximum connection time
+SSE_KEEPALIVE = 15
+SSE_TIMEOUT = 300
+
+# Long-poll /wait: default and maximum time a device waits for its audio (seconds).
+# Each waiter holds a worker thread, so run gunicorn with threads (gthread) or ASGI;
+# under gthread only WAITING_REQUESTS waiters per worker are admitted (see below).
+LONG_POLL_TIMEOUT = float(os.getenv('LONG_POLL_TIMEOUT', 25))
+LONG_POLL_MAX = 55
+
+# Binary device frame (/device/frame, see device_frame.py): largest audio inlined in a frame
+DEVICE_FRAME_INLINE_MAX = int(os.getenv('DEVICE_FRAME_INLINE_MAX', 256 * 1024))
+
+# Admission control (see admission.py): adaptive concurrency limits for the STT/LLM/TTS
+# calls and a cap on requests inside the pipeline endpoints (ADMISSION=0 turns it off).
+# Endpoints listed here are refused early with 503 + Retry-After when their first stage
+# or the cap is full, so /status and /get-audio-stream keep the remaining threads.
+PIPELINE_ENDPOINTS = {
+    'upload_audio': 'stt',
+    'finish_incremental_upload': 'llm',
+    'text_to_speech': 'tts',
+    'batch_process': 'stt',
+}
+# Long-poll and SSE endpoints hold a thread while they wait, so they get a bulkhead of
+# their own (WAITING_REQUESTS, a quarter of the threads by default) and are refused with
+# 503 + Retry-After beyond it. Many waiting devices are cheaper on the ASGI server.
+WAITING_ENDPOINTS = {'wait_for_audio', 'device_events_stream', 'device_frame', 'job_events'}
+WAITING_RETRY_AFTER = 2
+
+# Initialize Groq client pool (OpenAI library format, one or more keys - see groq_pool.py)
 try:
-    # استخدم مفتاح Groq هنا
-    api_key = os.getenv('GROQ_API_KEY') or os.getenv('OPENAI_API_KEY')
+    # استخدم مفاتيح Groq هنا (GROQ_API_KEYS أو GROQ_API_KEY)
+    groq_pool = create_groq_pool()
     
-    if not api_key:
+    if groq_pool is None:
         logger.error("GROQ_API_KEY not found in environment variables")
         client = None
     else:
         # توجيه العميل لسيرفرات Groq المجانية
-        client = OpenAI(
-            api_key=api_key,
-            base_url="https://api.groq.com/openai/v1"
-        )
-        logger.info("Groq client initialized successfully")
+        client = groq_pool.client
+        logger.info(f"Groq client pool initialized with {len(groq_pool.keys)} key(s)")
 except Exception as e:
     logger.error(f"Failed to initialize Groq client: {str(e)}")
+    groq_pool = None
     client = None
 
-# Global state for ESP32 communication
-esp32_data = {
-    'status': 'ready',  # ready, processing, sending_to_esp32
-    'audio_data': None,
-    'has_audio': False,
-    'text': '',
-    'response_text': ''
-}
+# Per-stage latency histograms exposed at /metrics (see metrics.py)
+metrics = Metrics()
+
+# STT / LLM / TTS backends, chosen by STT_ENGINE / LLM_ENGINE / TTS_ENGINE or per request (see engines.py)
+engine_registry = EngineRegistry([
+    GroqSTT(client, STT_MODEL), FasterWhisperSTT(), FakeSTT(),
+    GroqLLM(client, LLM_MODEL), LlamaCppLLM(), FakeLLM(),
+    # gTTS is looked up at call time so benchmarks can swap in their stand-in
+    GTTSEngine(lambda text, lang: gTTS(text=text, lang=lang)), EspeakTTS(), FakeTTS()
+])
+for kind in KINDS:
+    configured = os.getenv(f'{kind.upper()}_ENGINE')
+    if configured:
+        try:
+            engine_registry.set_default(kind, configured)
+        except EngineUnavailable as e:
+            logger.error(f"{str(e)}; keeping {engine_registry.get(kind).name if engine_registry.available(kind) else 'none'}")
+
+def is_overload_error(e):
+    """Failures meaning the backend is saturated: they shrink the stage's concurrency limit"""
+    if isinstance(e, (PoolBusy, Overloaded, TimeoutError)) or 'Timeout' in type(e).__name__:
+        return True
+    response = getattr(e, 'response', None) or getattr(e, 'rsp', None)  # openai / gTTS errors
+    status = getattr(e, 'status_code', None) or getattr(response, 'status_code', None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+# Per-stage concurrency limits driven by observed latency (see admission.py)
+admission = create_admission_control(KINDS, is_overload=is_overload_error)
+
+# Per-device state for ESP32 communication (see session_store.py)
+sessions = create_session_store()
+
+# Wakes /wait, /events and /ws clients when their session changes, in any worker (see device_events.py)
+device_events = create_device_events()
+sessions.add_listener(device_events.on_session_change)
+
+def summarize_turns(summary, turns):
+    """Condense older conversation turns into a short Arabic summary with the LLM"""
+    transcript = '\n'.join(
+        f"{'المستخدم' if role == 'user' else 'المساعد'}: {text}" for role, text in turns
+    )
+    answer = engine_registry.get('llm').complete(
+        [
+            {"role": "system", "content": "لخص المحادثة التالية في جمل قصيرة باللغة العربية مع الحفاظ على المعلومات المهمة."},
+            {"role": "user", "content": f"{summary}\n{transcript}".strip()}
+        ],
+        max_tokens=120,
+        temperature=0.3
+    )
+    return answer.strip()
+
+
+# Per-device conversation history sent with each question (see conversation.py)
+conversation = None
+if CONVERSATION_TURNS > 0:
+    conversation = ConversationMemory(
+        sessions,
+        max_turns=CONVERSATION_TURNS,
+        token_budget=CONVERSATION_TOKEN_BUDGET,
+        max_tokens=MAX_ANSWER_TOKENS,
+        ttl=CONVERSATION_TTL,
+        summarize=summarize_turns if os.getenv('CONVERSATION_SUMMARY', '').lower() == 'llm' else None
+    )
+
+# Cache of synthesized speech shared by /tts and /upload (see tts_cache.py)
+tts_cache = create_tts_cache()
+
+# Identical in-flight gTTS and LLM calls run once, also across gunicorn workers (see singleflight.py)
+single_flight = create_single_flight()
+
+# Other playback formats (PCM, IMA-ADPCM, low-bitrate mp3), converted once per format (see audio_formats.py)
+transcoder = Transcoder(TTSCache(
+    memory_max_bytes=int(float(os.getenv('AUDIO_FORMAT_CACHE_MB', 16)) * 1024 * 1024),
+    disk_dir=os.path.join(tts_cache.disk_dir, 'formats') if tts_cache.disk_dir else None,
+    disk_max_bytes=tts_cache.disk_max_bytes,
+    suffix='.audio'
+))
+if audio_formats.missing_requirement('pcm16'):
+    logger.warning(f"Only mp3 playback is available: {audio_formats.missing_requirement('pcm16')} is not installed")
+
+# Answers (text + mp3) to repeated questions, checked before the LLM (see response_cache.py)
+response_cache = None
+if os.getenv('RESPONSE_CACHE', '1').lower() not in ('0', 'false', 'no'):
+    response_cache = ResponseCache(
+        max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', 256)),
+        ttl=int(os.getenv('RESPONSE_CACHE_TTL', 3600)),
+        similarity=float(os.getenv('RESPONSE_CACHE_SIMILARITY', 0.85))
+    )
+
+
+def get_device_id():
+    """Read the device/session ID from the query string, form or X-Device-ID header"""
+    return clean_device_id(
+        request.args.get('device_id')
+        or request.form.get('device_id')
+        or request.headers.get('X-Device-ID')
+    )
+
+
+def request_engines():
+    """Engines for this request: ?stt= / ?llm= / ?tts= (query or form), else the configured defaults"""
+    return engine_registry.select(
+        request.values.get('stt'), request.values.get('llm'), request.values.get('tts')
+    )
+
+
+def engine_error(e):
+    """400 for a requested engine that isn't available, 500 if the configured default isn't"""
+    logger.error(str(e))
+    status = 400 if request.values.get(e.kind) else 500
+    return jsonify({'status': 'error', 'error': str(e), 'available': e.available}), status
+
+
+def request_flag(name):
+    """True if a boolean option is set in the query string or form"""
+    value = request.args.get(name) or request.form.get(name) or ''
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def negotiate_format():
+    """Playback format from ?format= or the Accept header (see audio_formats.py)"""
+    return audio_formats.negotiate(request.args.get('format'), request.headers.get('Accept'))
+
+
+def format_error(e):
+    """400 for an unknown ?format=, 406 for one this server can't produce"""
+    body = {'error': f'Unsupported audio format: {e.args[0]}', 'formats': audio_formats.available_formats()}
+    if isinstance(e, FormatUnavailable):
+        body['requires'] = audio_formats.missing_requirement(e.args[0])
+        return jsonify(body), 406
+    return jsonify(body), 400
+
+
+def transcode(fmt, key, load):
+    """Convert mp3 to fmt (cached per source and format)"""
+    if fmt.encode is None:
+        return load()
+    with metrics.timer('transcode') as span:
+        data = transcoder.convert(fmt, key, load)
+        span.size = len(data)
+    return data
+
+
+def chat_messages(user_text, device_id=None):
+    """Build the chat prompt for one user utterance, with the device's conversation so far"""
+    if conversation is not None and device_id is not None:
+        with metrics.timer('context_trim') as span:
+            messages, info = conversation.build_messages(SYSTEM_PROMPT, device_id, user_text)
+            span.size = sum(len(m['content'].encode('utf-8')) for m in messages)
+        return messages
+    return [
+        {
+            "role": "system",
+            "content": SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": user_text
+        }
+    ]
+
+
+def remember(device_id, user_text, response_text):
+    """Add one exchange to the device's conversation history"""
+    if conversation is not None:
+        conversation.record(device_id, user_text, response_text)
+
+
+def context_free(device_id):
+    """True when an answer can't depend on earlier turns, so the response cache applies"""
+    return conversation is None or not conversation.active(device_id)
+
+
+def _engine_synthesize(engine, text, lang):
+    with admission.stage('tts').slot(), \
+            metrics.timer('gtts' if engine.name == 'gtts' else f'tts_{engine.name}') as span:
+        data = engine.synthesize(text, lang)
+        span.size = len(data)
+    return data
+
+
+def _coalesced_tts(engine, text, lang):
+    # The engine name is the cache "voice"
+    key = f'tts:{make_key(text, lang, engine.name)}'
+    return single_flight.do(key, lambda: _engine_synthesize(engine, text, lang))
+
+
+def _synthesize_chunk(text, lang, engine=None):
+    engine = engine or engine_registry.get('tts')
+    return tts_cache.get_or_synthesize(
+        text, lang, engine.name, lambda text, lang: _coalesced_tts(engine, text, lang)
+    )
+
+
+tts_engine = ParallelTTS(_synthesize_chunk, max_workers=TTS_PARALLEL_WORKERS)
+
+
+def synthesize_mp3(text, lang=TTS_LANG, engine=None):
+    """
+    Convert text to mp3 bytes with the TTS engine (gTTS by default)
+    Long text is split into chunks synthesized in parallel; every chunk is
+    served from the TTS cache when possible.
+    """
+    return tts_engine.synthesize(text, lang, engine=engine)
+
+
+phrase_texts = phrase_bank.load_phrases(PHRASE_BANK_PHRASES)
+phrases = phrase_bank.PhraseBank.open(PHRASE_BANK_PATH)
+
+
+def build_phrase_bank():
+    """Synthesize missing or changed phrases into the archive, then serve from the new one"""
+    global phrases
+    try:
+        # The default engine speaks the phrases, so its name is the archive's voice
+        engine = engine_registry.get('tts')
+        phrase_bank.build(
+            PHRASE_BANK_PATH, phrase_texts,
+            lambda text: synthesize_mp3(text, TTS_LANG, engine=engine), TTS_LANG, engine.name
+        )
+    except Exception as e:
+        logger.warning(f"Phrase bank build failed: {str(e)}")
+        return
+    phrases = phrase_bank.PhraseBank.open(PHRASE_BANK_PATH)
+
+
+def warmup(connect=False):
+    """Heavy imports and API clients (plus keep-alive connections with connect) before the first request"""
+    with metrics.timer('warmup'):
+        if groq_pool is not None:
+            groq_pool.warm(connect)
+        warm_gtts(connect)
+    logger.info(f"Warmup done ({'connections' if connect else 'imports'})")
+
+
+def start_background():
+    """Per-process background work: phrase bank build and warmup"""
+    try:
+        voice = engine_registry.get('tts').name
+    except EngineUnavailable:
+        voice = None  # no engine to speak the phrases with
+    if PHRASE_BANK_BUILD not in ('0', 'false', 'no') and voice is not None and (
+            phrases is None or phrases.stale(phrase_texts, TTS_LANG, voice)):
+        threading.Thread(target=build_phrase_bank, daemon=True, name='phrase-bank').start()
+    if WARMUP in ('imports', 'connections'):
+        threading.Thread(target=warmup, args=(WARMUP == 'connections',), daemon=True, name='warmup').start()
+
+
+def preload():
+    """
+    Run once in the gunicorn master before it forks: import the heavy
+    packages so every worker shares them instead of importing its own.
+    Nothing here may start threads or open connections.
+    """
+    started = time.perf_counter()
+    import_openai()
+    import_gtts()
+    logger.info(f"Preloaded openai and gtts in {time.perf_counter() - started:.2f}s")
+
+
+def after_fork():
+    """Run in each gunicorn worker forked from a preloaded master"""
+    global phrases
+    # Connections and clients opened by the master must not be shared between processes
+    if sessions.backend == 'sqlite':
+        sessions.reopen()
+    if groq_pool is not None:
+        groq_pool.reset_clients()
+    reset_session()
+    # The master may have an outdated archive mapped (it doesn't rebuild it itself)
+    phrases = phrase_bank.PhraseBank.open(PHRASE_BANK_PATH)
+    start_background()
+
+
+if not SERVER_PRELOAD:
+    start_background()
+
+
+def phrase_url(phrase_id):
+    """URL of the pre-synthesized audio for a fixed message, or None if it isn't in the bank"""
+    bank = phrases
+    return f'/phrases/{phrase_id}' if bank is not None and phrase_id in bank else None
+
+
+stream_tts_executor = ThreadPoolExecutor(
+    max_workers=STREAM_TTS_WORKERS,
+    thread_name_prefix='stream-tts'
+)
+
+
+def stream_response(device_id, user_text, engines=None):
+    """
+    Streaming mode worker
+    Reads the LLM answer as it is generated, cuts it into sentences and
+    synthesizes each one as soon as it is complete. Finished mp3 chunks are
+    appended to the device session in order.
+    """
+    pending = deque()
+    response_parts = []
+    first_chunk = True
+    started = time.perf_counter()
+    engines = engines or engine_registry.select()
+    cacheable = context_free(device_id) and engine_registry.is_default(engines)
+
+    def flush_ready(wait=False):
+        nonlocal first_chunk
+        while pending and (wait or pending[0].done()):
+            sessions.append_audio_chunk(device_id, pending.popleft().result())
+            if first_chunk:
+                first_chunk = False
+                sessions.update(device_id, status='sending_to_esp32')
+                metrics.observe('first_audio', time.perf_counter() - started)
+                logger.info(f"First audio chunk ready (device {device_id})")
+
+    try:
+        splitter = SentenceSplitter()
+        # The LLM slot is held until the answer is complete
+        with admission.stage('llm').slot():
+            stream = engines.llm.stream(
+                chat_messages(user_text, device_id),
+                max_tokens=MAX_ANSWER_TOKENS,
+                temperature=0.7
+            )
+            for delta in stream:
+                response_parts.append(delta)
+                for sentence in splitter.feed(delta):
+                    pending.append(stream_tts_executor.submit(synthesize_mp3, sentence, engine=engines.tts))
+                flush_ready()
+        for sentence in splitter.flush():
+            pending.append(stream_tts_executor.submit(synthesize_mp3, sentence, engine=engines.tts))
+        flush_ready(wait=True)
+
+        response_text = ''.join(response_parts)
+        audio_bytes = b''.join(sessions.get_audio_chunks(device_id))
+        sessions.update(
+            device_id,
+            response_text=response_text,
+            audio_data=audio_bytes,
+            has_audio=True,
+            status='sending_to_esp32',
+            stream_state='done'
+        )
+        remember(device_id, user_text, response_text)
+        if response_cache is not None and cacheable:
+            response_cache.put(user_text, response_text, audio_bytes)
+        metrics.observe('llm_stream', time.perf_counter() - started, size=len(audio_bytes))
+        logger.info(f"Streaming completed: {response_text[:50]}...")
+    except Exception as e:
+        logger.error(f"Streaming error: {str(e)}")
+        metrics.observe('llm_stream', time.perf_counter() - started, error=True)
+        for future in pending:
+            future.cancel()
+        sessions.update(device_id, status='ready', stream_state='error')
+
+
+def iter_audio_stream(device_id):
+    """Yield a device's mp3 chunks as they are produced until its stream ends"""
+    seq = 0
+    deadline = time.monotonic() + STREAM_TIMEOUT
+    while time.monotonic() < deadline:
+        chunks = sessions.get_audio_chunks(device_id, seq)
+        seq += len(chunks)
+        yield from chunks
+        if chunks:
+            continue
+        if sessions.get(device_id)['stream_state'] != 'streaming':
+            # Pick up anything appended just before the stream finished
+            yield from sessions.get_audio_chunks(device_id, seq)
+            break
+        time.sleep(STREAM_POLL_INTERVAL)
+    sessions.update(device_id, status='ready')
+
+def _cache_gauges():
+    values = {}
+    for name, value in tts_cache.stats().items():
+        values[(('cache', 'tts'), ('counter', name))] = value
+    for name, value in transcoder.cache.stats().items():
+        values[(('cache', 'formats'), ('counter', name))] = value
+    if response_cache is not None:
+        for name, value in response_cache.stats().items():
+            values[(('cache', 'responses'), ('counter', name))] = value
+    return values
+
+
+metrics.register_gauge('cache', 'TTS, format and response cache counters', _cache_gauges)
+
+
+def _groq_gauges():
+    values = {}
+    for name, stats in groq_pool.stats().items():
+        for field in ('calls', 'successes', 'rate_limited', 'errors', 'in_flight',
+                      'remaining_requests', 'remaining_tokens', 'headroom'):
+            if stats[field] is not None:
+                values[(('key', name), ('field', field))] = stats[field]
+        values[(('key', name), ('field', 'breaker_open'))] = int(stats['breaker'] != 'closed')
+    return values
+
+
+if conversation is not None:
+    metrics.register_gauge(
+        'conversation', 'Conversation memory: prompt tokens and trimmed/compacted turns',
+        lambda: {(('counter', name),): value for name, value in conversation.stats().items()}
+    )
+
+metrics.register_gauge(
+    'singleflight', 'Coalesced gTTS/LLM calls',
+    lambda: {(('counter', name),): value for name, value in single_flight.stats().items()}
+)
+
+def _engine_gauges():
+    values = {}
+    for kind, info in engine_registry.stats().items():
+        for name, stats in info['engines'].items():
+            for field, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    values[(('kind', kind), ('engine', name), ('field', field))] = value
+    return values
+
+
+metrics.register_gauge('engine', 'STT/LLM/TTS engines: calls, errors, latency and throughput', _engine_gauges)
+
+if groq_pool is not None:
+    metrics.register_gauge('groq_key', 'Groq API key pool: counters, rate-limit headroom, breaker', _groq_gauges)
+
+
+def iter_view(view, chunk_size):
+    """Yield a memoryview as bytes chunks (WSGI bodies must be bytes)"""
+    started = time.perf_counter()
+    sent = 0
+    try:
+        if not chunk_size or chunk_size >= len(view):
+            # The whole stored object: hand it over without copying
+            if isinstance(view.obj, bytes) and len(view) == len(view.obj):
+                chunks = [view.obj]
+            else:
+                chunks = [view.tobytes()]
+        else:
+            chunks = (view[offset:offset + chunk_size].tobytes()
+                      for offset in range(0, len(view), chunk_size))
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        # The server may close us right after the last chunk; only a short send is an error
+        metrics.observe(
+            'audio_send', time.perf_counter() - started,
+            error=sent < len(view), size=sent
+        )
+
+
+def requested_chunk_size():
+    """Body chunk size from ?chunk= or AUDIO_CHUNK_SIZE, clamped (0 = one piece)"""
+    chunk_size = request.args.get('chunk', type=int) or AUDIO_CHUNK_SIZE
+    if chunk_size:
+        chunk_size = min(max(chunk_size, MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+    return chunk_size
+
+
+def send_audio(device_id, session, fmt=audio_formats.FORMATS['mp3']):
+    """
+    Send a device's stored audio with ETag/If-None-Match and Range support
+    so devices can skip audio they already have and resume partial downloads.
+    Formats other than mp3 are transcoded (once) and served from memory.
+    """
+    source_etag = session['audio_etag']
+    etag = audio_formats.variant_etag(source_etag, fmt)
+    chunk_size = requested_chunk_size()
+    
+    if request.if_none_match.contains(etag):
+        sessions.update(device_id, status='ready')
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.vary.add('Accept')
+        return response
+    
+    data = None
+    size = session['audio_size']
+    if fmt.encode is not None:
+        def load():
+            current = sessions.get(device_id)
+            if current['audio_etag'] != source_etag:
+                raise LookupError('audio replaced during transcode')
+            return current['audio_data']
+        try:
+            data = transcode(fmt, source_etag, load)
+        except LookupError:
+            return jsonify({'error': 'Audio changed, retry'}), 409
+        size = len(data)
+    
+    def load_view(start, end):
+        if data is not None:
+            return memoryview(data)[start:end]
+        return sessions.audio_view(device_id, start, end)
+    
+    response, complete = range_response(load_view, size, etag, fmt.mimetype, chunk_size)
+    # Only a download that reaches the end of the file counts as delivered
+    if complete:
+        sessions.update(device_id, status='ready')
+    return response
+
+
+def range_response(load_view, size, etag, mimetype, chunk_size=0, cache_control='no-cache'):
+    """
+    200/206/416 response for size bytes of audio honouring Range and If-Range
+    load_view(start, end) returns a memoryview of that byte range (or None).
+    Returns (response, reaches_end).
+    """
+    start, end, status_code = 0, size, 200
+    byte_range = request.range
+    if_range = request.if_range
+    if (byte_range is not None and len(byte_range.ranges) == 1
+            and (if_range.etag is None and if_range.date is None or if_range.etag == etag)):
+        span = byte_range.range_for_length(size)
+        if span is None:
+            response = jsonify({'error': 'Requested range not satisfiable'})
+            response.status_code = 416
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response, False
+        start, end = span
+        status_code = 206
+    
+    view = load_view(start, end)
+    if view is None:
+        return (jsonify({'error': 'No audio available'}), 404), False
+    
+    response = Response(
+        iter_view(view, chunk_size),
+        status=status_code,
+        mimetype=mimetype,
+        direct_passthrough=True
+    )
+    response.headers['Content-Length'] = str(len(view))
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Cache-Control'] = cache_control
+    response.set_etag(etag)
+    response.vary.add('Accept')
+    if status_code == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{start + len(view) - 1}/{size}'
+    return response, start + len(view) >= size
+
+
+class PipelineError(Exception):
+    """A pipeline stage failed; message is the user-facing error text"""
+
+    # Phrase bank entry a device can play for each failed stage
+    STAGE_PHRASES = {'transcribing': 'stt_error', 'thinking': 'llm_error', 'speaking': 'tts_error'}
+
+    def __init__(self, stage, message, retry_after=None):
+        super().__init__(message)
+        self.stage = stage
+        self.message = message
+        self.retry_after = retry_after
+        self.phrase = 'busy' if retry_after else self.STAGE_PHRASES.get(stage, 'server_error')
+
+    @classmethod
+    def from_exception(cls, stage, prefix, e):
+        """Wrap a stage failure; Groq pool saturation and shed requests keep their Retry-After hint"""
+        if isinstance(e, (PoolBusy, Overloaded)) or isinstance(e, SegmentFailed) and e.retry_after:
+            return cls(stage, 'السيرفر مشغول، حاول مرة أخرى', retry_after=e.retry_after)
+        return cls(stage, f'{prefix}: {str(e)}')
+
+    def response(self):
+        """JSON error response: 503 + Retry-After when Groq or a stage is saturated, else 500"""
+        response = jsonify({
+            'status': 'error',
+            'stage': self.stage,
+            'error': self.message,
+            'audio_url': phrase_url(self.phrase)
+        })
+        if self.retry_after:
+            # Every Groq key is rate limited or the stage is full: tell the client when to come back
+            response.headers['Retry-After'] = str(self.retry_after)
+            return response, 503
+        return response, 500
+
+
+def detach_upload(stream):
+    """Copy an upload into a spooled temp file owned by the caller (request files close with the request)"""
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE, mode='rb+')
+    stream.seek(0)
+    shutil.copyfileobj(stream, spool)
+    spool.seek(0)
+    return spool
+
+
+def transcribe_audio(filename, audio, mimetype, engine=None):
+    """Speech to text, Groq Whisper by default (audio is bytes or a file, which is streamed to Groq)"""
+    engine = engine or engine_registry.get('stt')
+    with admission.stage('stt').slot():
+        return engine.transcribe(filename, audio, mimetype, language='ar')
+
+
+def generate_response(user_text, device_id=None, engine=None):
+    """Get the assistant's answer, Groq Llama 3 by default (concurrent identical prompts share one call)"""
+    engine = engine or engine_registry.get('llm')
+    messages = chat_messages(user_text, device_id)
+    
+    def ask():
+        with admission.stage('llm').slot():
+            return engine.complete(messages, max_tokens=MAX_ANSWER_TOKENS, temperature=0.7)
+    
+    prompt = json.dumps(
+        [engine.name, engine.model] + [[m['role'], normalize_arabic(m['content'])] for m in messages],
+        ensure_ascii=False
+    )
+    key = f"llm:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()}"
+    return single_flight.do(key, ask)
+
+
+def run_transcription(device_id, filename, audio, mimetype, timings=None, engine=None):
+    """Step 1: Transcribe audio using Groq Whisper (FREE) or the selected STT engine"""
+    logger.info("Starting Whisper transcription (Groq)...")
+    try:
+        with metrics.timer('stt', timings, size=audio_length(audio)):
+            user_text = transcribe_audio(filename, audio, mimetype, engine)
+    except Exception as e:
+        logger.error(f"Whisper error: {str(e)}")
+        sessions.update(device_id, status='ready')
+        raise PipelineError.from_exception('transcribing', 'خطأ في تحويل الصوت', e) from e
+    sessions.update(device_id, text=user_text)
+    logger.info(f"Transcription: {user_text[:50]}...")
+    return user_text
+
+
+def run_response(device_id, user_text, timings=None, engine=None):
+    """Step 2: Get AI response using Groq Llama 3 (FREE) or the selected LLM engine"""
+    logger.info("Getting AI response (Llama 3)...")
+    try:
+        with metrics.timer('llm', timings) as span:
+            response_text = generate_response(user_text, device_id, engine)
+            span.size = len(response_text.encode('utf-8'))
+    except Exception as e:
+        logger.error(f"AI error: {str(e)}")
+        sessions.update(device_id, status='ready')
+        raise PipelineError.from_exception('thinking', 'خطأ في الذكاء الاصطناعي', e) from e
+    sessions.update(device_id, response_text=response_text)
+    logger.info(f"AI response: {response_text[:50]}...")
+    return response_text
+
+
+def run_speech(device_id, response_text, timings=None, engine=None):
+    """Step 3: Convert to speech using Google TTS (FREE) or the selected TTS engine and store it for the ESP32"""
+    logger.info("Converting to speech (gTTS)...")
+    try:
+        with metrics.timer('tts', timings) as span:
+            audio_bytes = synthesize_mp3(response_text, engine=engine)
+            span.size = len(audio_bytes)
+    except Exception as e:
+        logger.error(f"TTS error: {str(e)}")
+        sessions.update(device_id, status='ready')
+        raise PipelineError.from_exception('speaking', 'خطأ في TTS', e) from e
+    sessions.update(
+        device_id,
+        audio_data=audio_bytes,
+        has_audio=True,
+        status='sending_to_esp32',
+        stream_state='idle'
+    )
+    logger.info("TTS successful")
+    return audio_bytes
+
+
+def answer_from_cache(device_id, user_text, timings=None, engines=None):
+    """Serve a repeated question from the response cache (skips LLM and TTS), return the answer or None"""
+    if engines is not None and not engine_registry.is_default(engines):
+        return None  # cached answers come from the default engines
+    if response_cache is None or not context_free(device_id):
+        return None
+    with metrics.timer('response_cache', timings):
+        cached = response_cache.get(user_text)
+    if cached is None:
+        return None
+    response_text, audio_bytes = cached
+    sessions.update(
+        device_id,
+        response_text=response_text,
+        audio_data=audio_bytes,
+        has_audio=True,
+        status='sending_to_esp32',
+        stream_state='idle'
+    )
+    remember(device_id, user_text, response_text)
+    logger.info(f"Response cache hit: {user_text[:50]}...")
+    return response_text
+
+
+def process_utterance(device_id, filename, audio, mimetype, on_stage=None, timings=None, engines=None):
+    """
+    Run the full STT -> LLM -> TTS pipeline for one recording (bytes or a file)
+    on_stage(name) is called as each stage starts (transcribing, thinking, speaking).
+    Stage durations (ms) are collected in the result's 'timings'.
+    Raises PipelineError if a stage fails.
+    """
+    on_stage = on_stage or (lambda stage: None)
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    sessions.update(device_id, status='processing')
+
+    engines = engines or engine_registry.select()
+
+    on_stage('transcribing')
+    user_text = run_transcription(device_id, filename, audio, mimetype, timings, engines.stt)
+    return process_transcript(device_id, user_text, on_stage, timings, started, engines)
+
+
+def think(device_id, user_text, timings=None, engines=None):
+    """LLM stage: (response_text, cached); a response cache hit already stored the audio"""
+    response_text = answer_from_cache(device_id, user_text, timings, engines)
+    if response_text is not None:
+        return response_text, True
+    return run_response(device_id, user_text, timings, engines.llm), False
+
+
+def speak(device_id, user_text, response_text, timings=None, engines=None, cacheable=False):
+    """
+    TTS stage: synthesize and store the answer, then add the exchange to the
+    conversation (only once the device can play it) and the response cache
+    """
+    audio_bytes = run_speech(device_id, response_text, timings, engines.tts)
+    remember(device_id, user_text, response_text)
+    if response_cache is not None and cacheable:
+        response_cache.put(user_text, response_text, audio_bytes)
+    return audio_bytes
+
+
+def process_transcript(device_id, user_text, on_stage=None, timings=None, started=None, engines=None):
+    """LLM -> TTS part of the pipeline for an utterance that is already transcribed"""
+    on_stage = on_stage or (lambda stage: None)
+    timings = {} if timings is None else timings
+    started = time.perf_counter() if started is None else started
+    engines = engines or engine_registry.select()
+
+    on_stage('thinking')
+    cacheable = context_free(device_id) and engine_registry.is_default(engines)
+    response_text, cached = think(device_id, user_text, timings, engines)
+    if not cached:
+        on_stage('speaking')
+        speak(device_id, user_text, response_text, timings, engines, cacheable)
+
+    return {
+        'text': user_text,
+        'response': response_text,
+        'cached': cached,
+        'device_id': device_id,
+        'audio_url': f'/get-audio-stream?device_id={device_id}',
+        'timings': dict(timings, pipeline=round((time.perf_counter() - started) * 1000, 1))
+    }
+
+
+def process_upload_job(device_id, filename, audio, mimetype, engines=None, on_stage=None):
+    """Background job: process_utterance, then close the job's copy of the upload"""
+    try:
+        return process_utterance(device_id, filename, audio, mimetype, on_stage=on_stage, engines=engines)
+    finally:
+        if hasattr(audio, 'close'):
+            audio.close()
+
+
+def transcribe_segment(filename, audio_bytes, mimetype, engine=None):
+    """Whisper call for one segment of an incremental upload (engine is an STT engine name)"""
+    with metrics.timer('stt_segment', size=len(audio_bytes)):
+        return transcribe_audio(filename, audio_bytes, mimetype, engine_registry.get('stt', engine))
+
+
+incremental_uploads = IncrementalUploads(
+    transcribe_segment,
+    store=sessions,
+    workers=STT_SEGMENT_WORKERS,
+    segment_seconds=STT_SEGMENT_SECONDS,
+    ttl=INCREMENTAL_UPLOAD_TTL,
+    max_bytes=MAX_UPLOAD_SIZE
+)
+
+
+# Background pipeline jobs for /upload?async=1 (see jobs.py)
+job_queue = JobQueue(
+    workers=int(os.getenv('JOB_WORKERS', 4)),
+    max_depth=int(os.getenv('JOB_QUEUE_DEPTH', 32)),
+    store=sessions
+)
+metrics.register_gauge('job_queue_depth', 'Background jobs waiting for a worker', lambda: {None: job_queue.depth()})
+metrics.register_gauge(
+    'device_events', 'Long-poll/SSE waiters and cross-worker session notifications',
+    lambda: {(('counter', name),): value for name, value in device_events.stats().items()}
+)
+metrics.register_gauge(
+    'admission', 'Per-stage concurrency limits, queues and shed requests',
+    lambda: {
+        (('stage', name), ('field', field)): value
+        for name, stats in admission.stats().items()
+        for field, value in stats.items() if value is not None
+    }
+)
+metrics.register_gauge(
+    'process_memory_bytes', 'Resident memory of this worker',
+    lambda: {(('kind', name),): value for name, value in process_memory().items()}
+)
+
 
 # HTML page with embedded CSS and JavaScript
 HTML_PAGE = """
@@ -305,8 +1234,25 @@ HTML_PAGE = """
     </div>
 
     <script>
+        // With WEB_UI_INCREMENTAL=1 the recording is also sent while the user speaks:
+        // an AudioWorklet taps the microphone and every CHUNK_MS the new samples go
+        // out as one gapless 16 kHz PCM chunk (/upload/start -> /upload/<id>/chunk ->
+        // /upload/<id>/finish), so the server transcribes it as it arrives. The
+        // MediaRecorder keeps the whole take, which is sent to /upload instead if a
+        // chunk or the finish request fails.
+        const INCREMENTAL = __WEB_UI_INCREMENTAL__;
+        const CHUNK_MS = 3000;
+        const PCM_RATE = 16000;
+        const TAP_WORKLET = `
+            registerProcessor('pcm-tap', class extends AudioWorkletProcessor {
+                process(inputs) {
+                    if (inputs[0].length) this.port.postMessage(inputs[0][0].slice());
+                    return true;
+                }
+            });`;
         let mediaRecorder;
         let audioChunks = [];
+        let incremental = null;
         const recordBtn = document.getElementById('recordBtn');
         const stopBtn = document.getElementById('stopBtn');
         const clearBtn = document.getElementById('clearBtn');
@@ -340,6 +1286,7 @@ HTML_PAGE = """
                     }
                 }
                 
+                incremental = INCREMENTAL ? await startIncremental(stream) : null;
                 mediaRecorder = new MediaRecorder(stream, options);
                 audioChunks = [];
 
@@ -351,7 +1298,11 @@ HTML_PAGE = """
 
                 mediaRecorder.onstop = async () => {
                     const audioBlob = new Blob(audioChunks, { type: options.mimeType });
-                    await uploadAudio(audioBlob);
+                    if (incremental) {
+                        await finishIncremental(incremental, audioBlob);
+                    } else {
+                        await uploadAudio(audioBlob);
+                    }
                 };
 
                 mediaRecorder.start();
@@ -369,8 +1320,119 @@ HTML_PAGE = """
             }
         });
 
+        async function startIncremental(stream) {
+            let upload = null;
+            try {
+                const formData = new FormData();
+                formData.append('mimetype', 'audio/pcm');
+                formData.append('filename', 'recording.pcm');
+                const response = await fetch('/upload/start', { method: 'POST', body: formData });
+                if (!response.ok) return null;
+                const data = await response.json();
+                upload = { id: data.upload_id, seq: 0, sends: [], failed: false };
+
+                const context = new AudioContext();
+                const moduleUrl = URL.createObjectURL(new Blob([TAP_WORKLET], { type: 'application/javascript' }));
+                await context.audioWorklet.addModule(moduleUrl);
+                URL.revokeObjectURL(moduleUrl);
+                const source = context.createMediaStreamSource(stream);
+                const tap = new AudioWorkletNode(context, 'pcm-tap');
+                let frames = [];
+                let length = 0;
+                tap.port.onmessage = (event) => {
+                    frames.push(event.data);
+                    length += event.data.length;
+                };
+                source.connect(tap);
+                tap.connect(context.destination);  // the tap outputs silence
+
+                upload.flush = () => {
+                    const samples = new Float32Array(length);
+                    let offset = 0;
+                    frames.forEach(frame => {
+                        samples.set(frame, offset);
+                        offset += frame.length;
+                    });
+                    const { pcm, used } = toPcm16(samples, context.sampleRate);
+                    // Samples that don't make up a whole output sample start the next chunk
+                    frames = [samples.subarray(used)];
+                    length = samples.length - used;
+                    sendChunk(upload, pcm);
+                };
+                upload.timer = setInterval(upload.flush, CHUNK_MS);
+                upload.stop = () => {
+                    clearInterval(upload.timer);
+                    upload.flush();
+                    source.disconnect();
+                    tap.disconnect();
+                    context.close();
+                };
+                return upload;
+            } catch (error) {
+                console.error('Incremental upload unavailable:', error);
+                if (upload) {
+                    fetch('/upload/' + upload.id, { method: 'DELETE' }).catch(() => {});
+                }
+                return null;
+            }
+        }
+
+        function toPcm16(samples, rate) {
+            // Each output sample averages its share of the input (a cheap anti-alias filter)
+            const ratio = rate / PCM_RATE;
+            const pcm = new Int16Array(Math.floor(samples.length / ratio));
+            for (let i = 0; i < pcm.length; i++) {
+                const start = Math.floor(i * ratio);
+                const end = Math.max(start + 1, Math.floor((i + 1) * ratio));
+                let sum = 0;
+                for (let j = start; j < end; j++) sum += samples[j];
+                const value = Math.max(-1, Math.min(1, sum / (end - start)));
+                pcm[i] = value < 0 ? value * 32768 : value * 32767;
+            }
+            return { pcm, used: Math.floor(pcm.length * ratio) };
+        }
+
+        function sendChunk(upload, pcm) {
+            if (pcm.length === 0 || upload.failed) return;
+            const seq = upload.seq++;
+            upload.sends.push(
+                fetch('/upload/' + upload.id + '/chunk?seq=' + seq, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'audio/pcm' },
+                    body: pcm
+                }).then(response => {
+                    if (!response.ok) upload.failed = true;
+                }, () => {
+                    upload.failed = true;
+                })
+            );
+        }
+
+        async function finishIncremental(upload, audioBlob) {
+            await Promise.all(upload.sends);
+            if (!upload.failed) {
+                try {
+                    const response = await fetch('/upload/' + upload.id + '/finish?chunks=' + upload.seq, {
+                        method: 'POST'
+                    });
+                    // A lost upload or missing chunks: send the recording again as a whole
+                    if (response.status !== 404 && response.status !== 409) {
+                        showResult(await response.json());
+                        return;
+                    }
+                } catch (error) {
+                    console.error('Incremental upload error:', error);
+                }
+            }
+            fetch('/upload/' + upload.id, { method: 'DELETE' }).catch(() => {});
+            await uploadAudio(audioBlob);
+        }
+
         stopBtn.addEventListener('click', () => {
             if (mediaRecorder && mediaRecorder.state !== 'inactive') {
+                if (incremental) {
+                    incremental.stop();
+                }
                 mediaRecorder.stop();
                 mediaRecorder.stream.getTracks().forEach(track => track.stop());
             }
@@ -414,20 +1476,7 @@ HTML_PAGE = """
                     body: formData
                 });
 
-                const data = await response.json();
-
-                if (data.status === 'ok') {
-                    statusText.innerHTML = '✅ تم المعالجة بنجاح!';
-                    statusBox.classList.add('success');
-                    transcriptText.textContent = data.text;
-                    responseText.textContent = data.response;
-                    result.style.display = 'block';
-                    clearBtn.disabled = false;
-                } else {
-                    statusText.innerHTML = '❌ حدث خطأ: ' + (data.error || 'خطأ غير معروف');
-                    statusBox.classList.add('error');
-                    clearBtn.disabled = false;
-                }
+                showResult(await response.json());
             } catch (error) {
                 console.error('Upload error:', error);
                 statusText.innerHTML = '❌ خطأ في الاتصال بالسيرفر. حاول مرة أخرى.';
@@ -435,15 +1484,101 @@ HTML_PAGE = """
                 clearBtn.disabled = false;
             }
         }
+
+        function showResult(data) {
+            if (data.status === 'ok') {
+                statusText.innerHTML = '✅ تم المعالجة بنجاح!';
+                statusBox.classList.add('success');
+                transcriptText.textContent = data.text;
+                responseText.textContent = data.response;
+                result.style.display = 'block';
+                clearBtn.disabled = false;
+            } else {
+                statusText.innerHTML = '❌ حدث خطأ: ' + (data.error || 'خطأ غير معروف');
+                statusBox.classList.add('error');
+                clearBtn.disabled = false;
+            }
+        }
     </script>
 </body>
 </html>
 """
 
+web_ui = WebUI(
+    HTML_PAGE.replace('__WEB_UI_INCREMENTAL__', 'true' if WEB_UI_INCREMENTAL else 'false'),
+    split_assets=WEB_UI_SPLIT_ASSETS
+)
+
+def ui_response(name):
+    """Precompressed UI file in the client's preferred encoding, with conditional GET"""
+    result = web_ui.respond(name, request.headers.get('Accept-Encoding'), request.headers.get('If-None-Match'))
+    if result is None:
+        return jsonify({'error': 'Not found'}), 404
+    status, body, headers = result
+    return Response(body, status=status, headers=headers)
+
+def admit_waiter():
+    """Take a waiter slot for a long-poll/SSE request (a frame without ?wait= doesn't wait)"""
+    if request.endpoint == 'device_frame' and not request.args.get('wait', 0, type=float):
+        return None
+    if not admission.waiters.try_acquire():
+        logger.warning(f"Shedding {request.path}: long-poll/SSE cap reached")
+        return PipelineError.from_exception('admission', '', Overloaded('waiters', WAITING_RETRY_AFTER)).response()
+    g.admitted = admission.waiters
+    return None
+
+@app.before_request
+def admit_request():
+    """Refuse pipeline requests up front when their first stage or the request cap is full"""
+    if request.endpoint in WAITING_ENDPOINTS:
+        return admit_waiter()
+    stage = PIPELINE_ENDPOINTS.get(request.endpoint)
+    if stage is None:
+        return None
+    try:
+        admission.stage(stage).check()
+    except Overloaded as e:
+        logger.warning(f"Shedding {request.path}: {str(e)}")
+        return PipelineError.from_exception('admission', '', e).response()
+    if not admission.bulkhead.try_acquire():
+        logger.warning(f"Shedding {request.path}: pipeline request cap reached")
+        return PipelineError.from_exception('admission', '', Overloaded('requests', admission.retry_after())).response()
+    g.admitted = admission.bulkhead
+    return None
+
+@app.after_request
+def release_after_response(response):
+    """
+    Hold the bulkhead slot until a streamed body is sent: generated bodies (/batch,
+    ?stream=1, SSE) run after the view. Passthrough bodies (send_file) don't run close
+    callbacks, so their slot is released at teardown like any other response.
+    """
+    if response.is_streamed and not response.direct_passthrough and 'admitted' in g:
+        response.call_on_close(g.pop('admitted').release)
+    return response
+
+@app.teardown_request
+def release_request(error=None):
+    bulkhead = g.pop('admitted', None)
+    if bulkhead is not None:
+        bulkhead.release()
+
+def detach_admission():
+    """Hand the request's bulkhead slot to work that outlives it; call the result when that work is done"""
+    bulkhead = g.pop('admitted', None)
+    if bulkhead is not None:
+        return bulkhead.release
+    return lambda: None
+
 @app.route('/')
 def index():
     """Serve the main HTML page"""
-    return render_template_string(HTML_PAGE)
+    return ui_response('index.html')
+
+@app.route('/assets/<name>')
+def ui_asset(name):
+    """Versioned CSS/JS of the page (WEB_UI_SPLIT_ASSETS=1)"""
+    return ui_response(name)
 
 @app.route('/upload', methods=['POST'])
 def upload_audio():
@@ -452,18 +1587,16 @@ def upload_audio():
     Process: Audio -> Groq Whisper (STT) -> Groq Llama3 -> gTTS -> Store for ESP32
     """
     try:
-        if client is None:
-            logger.error("Groq client not initialized")
-            return jsonify({
-                'status': 'error',
-                'error': 'Groq API key not configured'
-            }), 500
-
-        if 'audio' not in request.files:
+        with metrics.timer('upload_ingest') as span:
+            # Parses the multipart body; the file lands in a spooled temp file
+            has_audio = 'audio' in request.files
+        
+        if not has_audio:
             logger.warning("No audio file in request")
             return jsonify({
                 'status': 'error',
-                'error': 'لم يتم إرسال ملف صوتي'
+                'error': 'لم يتم إرسال ملف صوتي',
+                'audio_url': phrase_url('no_audio')
             }), 400
         
         audio_file = request.files['audio']
@@ -472,130 +1605,440 @@ def upload_audio():
             logger.warning("Empty audio filename")
             return jsonify({
                 'status': 'error',
-                'error': 'اسم الملف فارغ'
+                'error': 'اسم الملف فارغ',
+                'audio_url': phrase_url('empty_filename')
             }), 400
         
-        logger.info(f"Received audio file: {audio_file.filename}")
+        try:
+            engines = request_engines()
+        except EngineUnavailable as e:
+            return engine_error(e)
         
-        esp32_data['status'] = 'processing'
+        device_id = get_device_id()
+        logger.info(f"Received audio file: {audio_file.filename} (device {device_id})")
         
-        # Step 1: Transcribe audio using Groq Whisper (FREE)
-        logger.info("Starting Whisper transcription (Groq)...")
-        try:
-            audio_file.seek(0)
-            audio_bytes = audio_file.read()
-            
-            transcript = client.audio.transcriptions.create(
-                model="whisper-large-v3",  # موديل مجاني وسريع
-                file=(audio_file.filename, audio_bytes, audio_file.mimetype),
-                language="ar"
-            )
-            user_text = transcript.text
-            esp32_data['text'] = user_text
-            logger.info(f"Transcription: {user_text[:50]}...")
-        except Exception as e:
-            logger.error(f"Whisper error: {str(e)}")
-            esp32_data['status'] = 'ready'
-            return jsonify({
-                'status': 'error',
-                'error': f'خطأ في تحويل الصوت: {str(e)}'
-            }), 500
+        # The upload stays in its spooled file and is streamed to Whisper from there
+        audio = audio_file.stream
+        audio.seek(0)
+        upload_size = span.size = audio_length(audio)
+        filename, mimetype = audio_file.filename, audio_file.mimetype
+        memory = {
+            'upload_bytes': upload_size,
+            'in_memory_bytes': upload_size if upload_size <= UPLOAD_SPOOL_SIZE else 0
+        }
+        if UPLOAD_IN_MEMORY:
+            audio = audio.read()
+            memory['in_memory_bytes'] += upload_size
         
-        # Step 2: Get AI response using Groq Llama 3 (FREE)
-        logger.info("Getting AI response (Llama 3)...")
-        try:
-            chat_response = client.chat.completions.create(
-                model="llama3-8b-8192",  # موديل مجاني ذكي
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "أنت مساعد صوتي ذكي ومفيد. أجب بشكل مختصر ومفيد باللغة العربية."
-                    },
-                    {
-                        "role": "user",
-                        "content": user_text
-                    }
-                ],
-                max_tokens=150,
-                temperature=0.7
-            )
-            
-            response_text = chat_response.choices[0].message.content
-            esp32_data['response_text'] = response_text
-            logger.info(f"AI response: {response_text[:50]}...")
-        except Exception as e:
-            logger.error(f"AI error: {str(e)}")
-            esp32_data['status'] = 'ready'
+        # Optional preprocessing: smaller, shorter audio for Whisper (decoding needs the bytes)
+        preprocess_metrics = None
+        timings = {}
+        if AUDIO_PREPROCESS or request_flag('preprocess'):
+            with metrics.timer('preprocess', timings, size=upload_size):
+                if not isinstance(audio, bytes):
+                    audio = audio.read()
+                    memory['in_memory_bytes'] += upload_size
+                filename, audio, mimetype, preprocess_metrics = audio_preprocess.preprocess(
+                    filename, audio, mimetype
+                )
+            logger.info(f"Preprocessing: {preprocess_metrics}")
+        
+        # Background mode: queue the pipeline and return a job ID right away
+        if request_flag('async'):
+            # The request's file is closed when the response is sent
+            job_audio = audio if isinstance(audio, bytes) else detach_upload(audio)
+            try:
+                job = job_queue.submit(
+                    device_id,
+                    process_upload_job,
+                    device_id, filename, job_audio, mimetype, engines
+                )
+            except QueueFull as e:
+                if not isinstance(job_audio, bytes):
+                    job_audio.close()
+                logger.warning(f"Job queue full, rejecting upload (device {device_id})")
+                response = jsonify({
+                    'status': 'error',
+                    'error': 'السيرفر مشغول، حاول مرة أخرى',
+                    'audio_url': phrase_url('busy')
+                })
+                response.headers['Retry-After'] = str(e.retry_after)
+                return response, 429
             return jsonify({
-                'status': 'error',
-                'error': f'خطأ في الذكاء الاصطناعي: {str(e)}'
-            }), 500
+                'status': 'queued',
+                'job_id': job['id'],
+                'device_id': device_id,
+                'status_url': f"/jobs/{job['id']}",
+                'events_url': f"/jobs/{job['id']}/events",
+                'preprocess': preprocess_metrics,
+                'memory': dict(memory, **process_memory())
+            }), 202
         
-        # Step 3: Convert to speech using Google TTS (FREE)
-        logger.info("Converting to speech (gTTS)...")
         try:
-            tts = gTTS(text=response_text, lang='ar')
-            
-            mp3_fp = io.BytesIO()
-            tts.write_to_fp(mp3_fp)
-            mp3_fp.seek(0)
-            
-            audio_bytes = mp3_fp.getvalue()
+            # Streaming mode: LLM + TTS continue in the background, audio is
+            # delivered sentence by sentence on /get-audio-stream?stream=1
+            if request_flag('stream'):
+                sessions.update(device_id, status='processing')
+                user_text = run_transcription(device_id, filename, audio, mimetype, timings, engines.stt)
+                response_text = answer_from_cache(device_id, user_text, timings, engines)
+                if response_text is not None:
+                    return jsonify({
+                        'status': 'ok',
+                        'text': user_text,
+                        'response': response_text,
+                        'cached': True,
+                        'device_id': device_id,
+                        'audio_url': f'/get-audio-stream?device_id={device_id}',
+                        'preprocess': preprocess_metrics,
+                        'memory': dict(memory, **process_memory()),
+                        'timings': timings
+                    })
+                sessions.reset_audio_chunks(device_id)
+                sessions.update(
+                    device_id,
+                    audio_data=None,
+                    has_audio=False,
+                    response_text='',
+                    stream_state='streaming'
+                )
+                release = detach_admission()
+                
+                def run_stream():
+                    try:
+                        stream_response(device_id, user_text, engines)
+                    finally:
+                        release()
+                
+                threading.Thread(target=run_stream, daemon=True).start()
+                return jsonify({
+                    'status': 'ok',
+                    'text': user_text,
+                    'response': None,
+                    'streaming': True,
+                    'device_id': device_id,
+                    'audio_url': f'/get-audio-stream?device_id={device_id}&stream=1',
+                    'preprocess': preprocess_metrics,
+                    'memory': dict(memory, **process_memory()),
+                    'timings': timings
+                })
             
-            esp32_data['audio_data'] = audio_bytes
-            esp32_data['has_audio'] = True
-            esp32_data['status'] = 'sending_to_esp32'
-            logger.info("TTS successful")
-        except Exception as e:
-            logger.error(f"TTS error: {str(e)}")
-            esp32_data['status'] = 'ready'
-            return jsonify({
-                'status': 'error',
-                'error': f'خطأ في TTS: {str(e)}'
-            }), 500
+            result = process_utterance(device_id, filename, audio, mimetype, timings=timings, engines=engines)
+        except PipelineError as e:
+            return e.response()
         
         logger.info("Processing completed successfully")
-        return jsonify({
-            'status': 'ok',
-            'text': user_text,
-            'response': response_text,
-            'audio_url': '/get-audio-stream'
-        })
+        return jsonify(dict(
+            result, status='ok', preprocess=preprocess_metrics,
+            memory=dict(memory, **process_memory())
+        ))
         
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
-        esp32_data['status'] = 'ready'
+        sessions.update(get_device_id(), status='ready')
         return jsonify({
             'status': 'error',
-            'error': f'خطأ غير متوقع: {str(e)}'
+            'error': f'خطأ غير متوقع: {str(e)}',
+            'audio_url': phrase_url('server_error')
         }), 500
 
+@app.route('/upload/start', methods=['POST'])
+def start_incremental_upload():
+    """Open an incremental upload; the recording then arrives in ordered chunks"""
+    try:
+        stt = request_engines().stt
+    except EngineUnavailable as e:
+        return engine_error(e)
+    device_id = get_device_id()
+    upload_id = incremental_uploads.start(
+        device_id,
+        filename=request.values.get('filename'),
+        mimetype=request.values.get('mimetype'),
+        engine=stt.name
+    )['upload_id']
+    logger.info(f"Incremental upload {upload_id} started (device {device_id})")
+    return jsonify({
+        'status': 'ok',
+        'upload_id': upload_id,
+        'device_id': device_id,
+        'chunk_url': f'/upload/{upload_id}/chunk',
+        'finish_url': f'/upload/{upload_id}/finish',
+        'segment_seconds': STT_SEGMENT_SECONDS
+    }), 201
+
+@app.route('/upload/<upload_id>/chunk', methods=['POST'])
+def upload_chunk(upload_id):
+    """
+    Add chunk ?seq=N (0-based) to an incremental upload
+    The chunk is a multipart 'audio' file or the raw request body.
+    """
+    try:
+        seq = int(request.values.get('seq', ''))
+    except ValueError:
+        return jsonify({'status': 'error', 'error': 'seq must be an integer'}), 400
+    
+    with metrics.timer('upload_chunk') as span:
+        if 'audio' in request.files:
+            chunk = request.files['audio']
+            data, mimetype = chunk.read(), chunk.mimetype
+        else:
+            data, mimetype = request.get_data(), request.mimetype or None
+        span.size = len(data)
+        if not data:
+            return jsonify({'status': 'error', 'error': 'empty chunk'}), 400
+        try:
+            accepted, upload = incremental_uploads.add_chunk(upload_id, seq, data, mimetype)
+        except UploadError as e:
+            return jsonify({'status': 'error', 'error': str(e)}), e.status
+    
+    return jsonify(dict(upload, status='ok', accepted=accepted)), 202
+
+@app.route('/upload/<upload_id>/finish', methods=['POST'])
+def finish_incremental_upload(upload_id):
+    """
+    Close an incremental upload and run the rest of the pipeline
+    ?chunks=N waits briefly for chunk requests still in flight. Answers like /upload.
+    """
+    upload = incremental_uploads.get(upload_id)
+    if upload is None:
+        return jsonify({'status': 'error', 'error': 'upload not found'}), 404
+    expected = request.values.get('chunks')
+    device_id = upload['device_id']
+    try:
+        engines = request_engines()
+    except EngineUnavailable as e:
+        return engine_error(e)
+    timings = {}
+    started = time.perf_counter()
+    
+    try:
+        sessions.update(device_id, status='processing')
+        try:
+            with metrics.timer('stt', timings):
+                user_text, segments = incremental_uploads.finish(
+                    upload_id, int(expected) if expected and expected.isdigit() else None
+                )
+        except UploadError as e:
+            sessions.update(device_id, status='ready')
+            return jsonify({'status': 'error', 'error': str(e)}), e.status
+        except Exception as e:
+            logger.error(f"Whisper error: {str(e)}")
+            sessions.update(device_id, status='ready')
+            raise PipelineError.from_exception('transcribing', 'خطأ في تحويل الصوت', e) from e
+        sessions.update(device_id, text=user_text)
+        logger.info(f"Incremental transcription ({segments['segments']} segments): {user_text[:50]}...")
+        
+        result = process_transcript(device_id, user_text, timings=timings, started=started, engines=engines)
+    except PipelineError as e:
+        return e.response()
+    
+    return jsonify(dict(result, status='ok', segments=segments))
+
+@app.route('/upload/<upload_id>', methods=['GET', 'DELETE'])
+def incremental_upload(upload_id):
+    """Progress of an incremental upload, or abort it"""
+    if request.method == 'DELETE':
+        if not incremental_uploads.discard(upload_id):
+            return jsonify({'status': 'error', 'error': 'upload not found'}), 404
+        return jsonify({'status': 'cancelled'})
+    upload = incremental_uploads.get(upload_id)
+    if upload is None:
+        return jsonify({'status': 'error', 'error': 'upload not found'}), 404
+    return jsonify(upload)
+
+def batch_workers(stage, default):
+    """?<stage>_workers= for a batch, clamped to 1..BATCH_MAX_WORKERS"""
+    return max(1, min(int(request.args.get(f'{stage}_workers', default)), BATCH_MAX_WORKERS))
+
+@app.route('/batch', methods=['POST'])
+def batch_process():
+    """
+    Run many recordings through the same STT -> LLM -> TTS steps as /upload
+    Input: multipart 'audio' and/or 'archive' (zip/tar) files, or a raw zip/tar body.
+    The stages are pipelined, each with its own thread limit (?stt_workers=,
+    ?llm_workers=, ?tts_workers=). One NDJSON line is streamed per item as it
+    finishes (in completion order, with its 'index'), then a summary line.
+    Item i is stored for device <device_id>-<i>; ?include_audio=1 embeds the mp3 as base64.
+    """
+    request.max_content_length = BATCH_MAX_SIZE
+    try:
+        engines = request_engines()
+        workers = {
+            'stt': batch_workers('stt', BATCH_STT_WORKERS),
+            'llm': batch_workers('llm', BATCH_LLM_WORKERS),
+            'tts': batch_workers('tts', BATCH_TTS_WORKERS)
+        }
+    except EngineUnavailable as e:
+        return engine_error(e)
+    except ValueError:
+        return jsonify({'status': 'error', 'error': 'worker counts must be integers'}), 400
+    
+    # The items are read after this view returns, when the request's own files are closed
+    if request.mimetype == 'multipart/form-data':
+        files = [
+            (f.filename, detach_upload(f.stream), f.mimetype)
+            for field in ('audio', 'archive') for f in request.files.getlist(field)
+        ]
+    else:
+        kind = archive_kind(None, request.mimetype)
+        if kind is None:
+            return jsonify({'status': 'error', 'error': 'send audio files or a zip/tar archive'}), 415
+        body = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE, mode='rb+')
+        shutil.copyfileobj(request.stream, body)
+        body.seek(0)
+        files = [(f'batch.{kind}', body, request.mimetype)]
+    if not files:
+        return jsonify({
+            'status': 'error',
+            'error': 'لم يتم إرسال ملف صوتي',
+            'audio_url': phrase_url('no_audio')
+        }), 400
+    
+    prefix = (request.values.get('device_id') or '').strip()[:48] or f'batch-{uuid.uuid4().hex[:8]}'
+    preprocess = AUDIO_PREPROCESS or request_flag('preprocess')
+    include_audio = request_flag('include_audio')
+    
+    truncated = []
+    
+    def items():
+        for index, (name, audio, mimetype) in enumerate(iter_audio(files, MAX_UPLOAD_SIZE)):
+            if index >= BATCH_MAX_ITEMS:
+                truncated.append(name)
+                return
+            yield {
+                'index': index,
+                'file': name,
+                'device_id': clean_device_id(f'{prefix}-{index}'),
+                'audio': audio,
+                'mimetype': mimetype,
+                'timings': {}
+            }
+    
+    def transcribe_item(item):
+        audio, filename, mimetype = item.pop('audio'), os.path.basename(item['file']), item['mimetype']
+        if isinstance(audio, ItemTooLarge):
+            error = PipelineError('receiving', f'الملف كبير جداً. الحد الأقصى 10MB ({str(audio)})')
+            error.phrase = 'too_large'
+            raise error
+        sessions.update(item['device_id'], status='processing')
+        if preprocess:
+            with metrics.timer('preprocess', item['timings'], size=len(audio)):
+                filename, audio, mimetype, item['preprocess'] = audio_preprocess.preprocess(filename, audio, mimetype)
+        item['text'] = run_transcription(item['device_id'], filename, audio, mimetype, item['timings'], engines.stt)
+    
+    def think_item(item):
+        item['cacheable'] = context_free(item['device_id']) and engine_registry.is_default(engines)
+        item['response'], item['cached'] = think(item['device_id'], item['text'], item['timings'], engines)
+    
+    def speak_item(item):
+        if item['cached']:
+            audio_bytes = sessions.get(item['device_id'])['audio_data'] if include_audio else None
+        else:
+            audio_bytes = speak(
+                item['device_id'], item['text'], item['response'], item['timings'], engines, item['cacheable']
+            )
+        if include_audio:
+            item['audio'] = base64.b64encode(audio_bytes).decode('ascii')
+    
+    runner = BatchRunner([
+        ('stt', transcribe_item, workers['stt']),
+        ('llm', think_item, workers['llm']),
+        ('tts', speak_item, workers['tts'])
+    ])
+    
+    def generate():
+        started = time.perf_counter()
+        counts = {'items': 0, 'errors': 0}
+        try:
+            for item, error in runner.run(items()):
+                counts['items'] += 1
+                record = {'index': item['index'], 'file': item['file'], 'device_id': item['device_id']}
+                if error is None:
+                    record.update(
+                        status='ok', text=item['text'], response=item['response'], cached=item['cached'],
+                        audio_url=f"/get-audio-stream?{urlencode({'device_id': item['device_id']})}",
+                        preprocess=item.get('preprocess'), timings=item['timings']
+                    )
+                    if include_audio:
+                        record['audio'] = item['audio']
+                else:
+                    counts['errors'] += 1
+                    if not isinstance(error, PipelineError):
+                        logger.error(f"Batch item {item['index']} failed: {str(error)}")
+                        error = PipelineError('processing', f'خطأ غير متوقع: {str(error)}')
+                    record.update(
+                        status='error', stage=error.stage, error=error.message,
+                        retry_after=error.retry_after, audio_url=phrase_url(error.phrase), timings=item['timings']
+                    )
+                yield json.dumps(record, ensure_ascii=False) + '\n'
+        except Exception as e:
+            # Unreadable archive: the items read before it were still processed
+            logger.error(f"Batch input error: {str(e)}")
+            counts['errors'] += 1
+            yield json.dumps({'status': 'error', 'error': f'bad batch input: {str(e)}'}, ensure_ascii=False) + '\n'
+        finally:
+            for _, fileobj, _ in files:
+                fileobj.close()
+        wall = time.perf_counter() - started
+        metrics.observe('batch', wall, size=counts['items'])
+        logger.info(f"Batch {prefix}: {counts['items']} items, {counts['errors']} errors in {wall:.1f}s")
+        yield json.dumps({'summary': dict(
+            counts,
+            wall_ms=round(wall * 1000, 1),
+            items_per_second=round(counts['items'] / wall, 2) if wall else 0.0,
+            workers=workers,
+            stage_busy_s=runner.stats(),
+            truncated=bool(truncated)
+        )}) + '\n'
+    
+    return Response(
+        generate(),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/tts', methods=['POST'])
 def text_to_speech():
     """Convert text to speech using gTTS (FREE)"""
     try:
-        data = request.get_json()
+        # A missing or non-JSON body is a client error like an empty text
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = {}
         text = data.get('text', '')
         
-        if not text:
-            return jsonify({'error': 'لم يتم إرسال نص'}), 400
+        if not text or not isinstance(text, str):
+            return jsonify({'error': 'لم يتم إرسال نص', 'audio_url': phrase_url('no_text')}), 400
+        
+        try:
+            fmt = negotiate_format()
+        except (KeyError, FormatUnavailable) as e:
+            return format_error(e)
+        
+        try:
+            engine = engine_registry.get('tts', request.args.get('tts') or data.get('tts'))
+        except EngineUnavailable as e:
+            logger.error(str(e))
+            return jsonify({'error': str(e), 'available': e.available}), 400
         
         logger.info(f"TTS request: {text[:50]}...")
         
-        tts = gTTS(text=text, lang='ar')
-        mp3_fp = io.BytesIO()
-        tts.write_to_fp(mp3_fp)
-        mp3_fp.seek(0)
+        mp3_bytes = synthesize_mp3(text, engine=engine)
+        audio_bytes = transcode(fmt, make_key(text, TTS_LANG, engine.name), lambda: mp3_bytes)
         
         logger.info("TTS generation successful")
         
-        return send_file(
-            mp3_fp,
-            mimetype='audio/mpeg',
+        response = send_file(
+            io.BytesIO(audio_bytes),
+            mimetype=fmt.mimetype,
             as_attachment=True,
-            download_name='speech.mp3'
+            download_name=f'speech.{fmt.extension}'
         )
+        response.vary.add('Accept')
+        return response
         
+    except Overloaded as e:
+        logger.warning(f"TTS request shed: {str(e)}")
+        return PipelineError.from_exception('speaking', 'خطأ في TTS', e).response()
     except Exception as e:
         logger.error(f"TTS error: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -604,20 +2047,26 @@ def text_to_speech():
 def get_audio_stream():
     """Return audio for ESP32"""
     try:
-        if not esp32_data['has_audio'] or esp32_data['audio_data'] is None:
-            logger.warning("No audio available")
-            return jsonify({'error': 'No audio available'}), 404
+        device_id = get_device_id()
         
-        audio_bytes = esp32_data['audio_data']
-        logger.info("Sending audio to ESP32")
+        try:
+            fmt = negotiate_format()
+        except (KeyError, FormatUnavailable) as e:
+            return format_error(e)
         
-        esp32_data['status'] = 'ready'
+        session = sessions.get(device_id, include_audio=False)
         
-        return send_file(
-            io.BytesIO(audio_bytes),
-            mimetype='audio/mpeg',
-            as_attachment=False
-        )
+        # Progressive streaming is mp3 only; other formats wait for the full answer
+        if request_flag('stream') and fmt.encode is None and session['stream_state'] == 'streaming':
+            logger.info(f"Streaming audio to ESP32 (device {device_id})")
+            return Response(iter_audio_stream(device_id), mimetype='audio/mpeg')
+        
+        if not session['has_audio'] or not session['audio_size']:
+            logger.warning(f"No audio available for device {device_id}")
+            return jsonify({'error': 'No audio available'}), 404
+        
+        logger.info(f"Sending audio to ESP32 (device {device_id})")
+        return send_audio(device_id, session, fmt)
         
     except Exception as e:
         logger.error(f"Error sending audio: {str(e)}")
@@ -626,33 +2075,277 @@ def get_audio_stream():
 @app.route('/status', methods=['GET'])
 def get_status():
     """Return system status"""
+    device_id = get_device_id()
+    session = sessions.get(device_id)
     status = {
         'server': 'online',
-        'esp32_status': esp32_data['status'],
-        'has_audio': esp32_data['has_audio']
+        'device_id': device_id,
+        'esp32_status': session['status'],
+        'has_audio': session['has_audio'],
+        'worker': os.getpid()
     }
     return jsonify(status)
 
+def audio_state(device_id, session, known_seq=None):
+    """
+    What a waiting device needs to know about its session
+    ready: new audio can be fetched from audio_url (known_seq is the answer it last played,
+    see audio_seq in session_store.py)
+    """
+    streaming = session['stream_state'] == 'streaming'
+    fresh = session['has_audio'] and session['audio_seq'] != known_seq
+    query = {'device_id': device_id}
+    if streaming:
+        query['stream'] = '1'
+    return {
+        'device_id': device_id,
+        'ready': session['status'] == 'sending_to_esp32' and (streaming or fresh),
+        'status': session['status'],
+        'streaming': streaming,
+        'audio_url': f'/get-audio-stream?{urlencode(query)}',
+        'seq': session['audio_seq'],
+        'audio_etag': session['audio_etag'],
+        'audio_size': session['audio_size'],
+        'text': session['text'],
+        'response': session['response_text']
+    }
+
+def known_audio_seq():
+    """Number of the answer the device already played (?seq=, 'seq' of the last audio_state)"""
+    return request.args.get('seq', type=int)
+
+@app.route('/wait', methods=['GET'])
+def wait_for_audio():
+    """
+    Long-poll replacement for polling /status
+    Answers as soon as new audio is ready for the device (200 + audio_state),
+    or with 204 after ?timeout= seconds so the device simply asks again.
+    """
+    device_id = get_device_id()
+    known_seq = known_audio_seq()
+    try:
+        timeout = min(float(request.args.get('timeout', LONG_POLL_TIMEOUT)), LONG_POLL_MAX)
+    except ValueError:
+        return jsonify({'error': 'timeout must be a number'}), 400
+    
+    with metrics.timer('long_poll'):
+        deadline = time.monotonic() + timeout
+        while True:
+            # Version first: a change after the read below still wakes the wait
+            version = device_events.version(device_id)
+            state = audio_state(device_id, sessions.get(device_id, include_audio=False), known_seq)
+            if state['ready']:
+                return jsonify(state)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return '', 204
+            device_events.wait(device_id, version, remaining)
+
+@app.route('/events', methods=['GET'])
+def device_events_stream():
+    """Push a device's session changes as server-sent events (audio_ready / status)"""
+    device_id = get_device_id()
+    known_seq = known_audio_seq()
+    
+    def generate():
+        last = None
+        deadline = time.monotonic() + SSE_TIMEOUT
+        while time.monotonic() < deadline:
+            version = device_events.version(device_id)
+            state = audio_state(device_id, sessions.get(device_id, include_audio=False), known_seq)
+            if state != last:
+                last = state
+                event = 'audio_ready' if state['ready'] else 'status'
+                yield f"event: {event}\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
+            else:
+                yield ': keep-alive\n\n'
+            device_events.wait(device_id, version, SSE_KEEPALIVE)
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/device/frame', methods=['GET'])
+def device_frame():
+    """
+    Binary status frame for constrained devices (layout in device_frame.py)
+    ?seq= is the answer the device last played, ?wait= long-polls up to that many
+    seconds for a new one, and ready audio of up to ?max= bytes is inlined, so one
+    keep-alive request replaces polling /status and then fetching /get-audio-stream.
+    """
+    device_id = get_device_id()
+    try:
+        fmt = negotiate_format()
+        timeout = min(float(request.args.get('wait', 0)), LONG_POLL_MAX)
+    except (KeyError, FormatUnavailable) as e:
+        return format_error(e)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number'}), 400
+    known_seq = known_audio_seq()
+    inline_max = min(request.args.get('max', DEVICE_FRAME_INLINE_MAX, type=int), DEVICE_FRAME_INLINE_MAX)
+    
+    with metrics.timer('device_frame') as span:
+        deadline = time.monotonic() + timeout
+        while True:
+            version = device_events.version(device_id)
+            session = sessions.get(device_id, include_audio=False)
+            source_etag = session['audio_etag']
+            state = audio_state(device_id, session, known_seq)
+            remaining = deadline - time.monotonic()
+            if state['ready'] or remaining <= 0:
+                break
+            device_events.wait(device_id, version, remaining)
+        
+        code = frame_state(state)
+        audio, audio_length = None, session['audio_size'] if code == STATE_READY else 0
+        if code == STATE_READY and fmt.encode is not None:
+            def load():
+                current = sessions.get(device_id)
+                if current['audio_etag'] != source_etag:
+                    raise LookupError('audio replaced during transcode')
+                return current['audio_data']
+            try:
+                audio = transcode(fmt, source_etag, load)
+            except LookupError:
+                return jsonify({'error': 'Audio changed, retry'}), 409
+            audio_length = len(audio)
+        if code == STATE_READY and audio_length <= inline_max:
+            if audio is None:
+                view = sessions.audio_view(device_id, 0, audio_length)
+                if view is not None and len(view) == audio_length:
+                    audio = view.obj if isinstance(view.obj, bytes) and len(view.obj) == len(view) else view.tobytes()
+        else:
+            audio = None
+        
+        parts = frame_parts(code, state['seq'], audio_length, audio, session['has_audio'], fmt.name)
+        span.size = sum(len(part) for part in parts)
+    if audio is not None:
+        # The whole answer went out with the frame, as after a full /get-audio-stream
+        sessions.update(device_id, status='ready')
+    
+    response = Response(parts, mimetype=FRAME_MIME_TYPE, direct_passthrough=True)
+    response.headers['Content-Length'] = str(span.size)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @app.route('/clear', methods=['POST'])
 def clear_audio():
     """Clear audio buffer"""
-    esp32_data['audio_data'] = None
-    esp32_data['has_audio'] = False
-    esp32_data['status'] = 'ready'
-    esp32_data['text'] = ''
-    esp32_data['response_text'] = ''
+    device_id = get_device_id()
+    sessions.clear(device_id)
     
-    logger.info("Buffer cleared")
-    return jsonify({'status': 'cleared'})
+    logger.info(f"Buffer cleared (device {device_id})")
+    return jsonify({'status': 'cleared', 'audio_url': phrase_url('cleared')})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Return the state of a background upload job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Push background job stage changes as server-sent events"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def generate(job):
+        version = -1
+        deadline = time.monotonic() + SSE_TIMEOUT
+        while job is not None and time.monotonic() < deadline:
+            if job['version'] > version:
+                version = job['version']
+                yield f"event: {job['state']}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+                if job['state'] in FINAL_STATES:
+                    return
+            else:
+                yield ': keep-alive\n\n'
+            job = job_queue.wait(job_id, version, SSE_KEEPALIVE)
+    
+    return Response(
+        generate(job),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/phrases', methods=['GET'])
+def list_phrases():
+    """IDs and texts of the pre-synthesized messages"""
+    bank = phrases
+    if bank is None:
+        return jsonify({'phrases': {}, 'building': PHRASE_BANK_BUILD not in ('0', 'false', 'no')})
+    entries = {}
+    for phrase_id in bank.ids():
+        view, _, text = bank.get(phrase_id)
+        entries[phrase_id] = {'text': text, 'bytes': len(view), 'url': f'/phrases/{phrase_id}'}
+    return jsonify({'phrases': entries, 'bank': bank.stats()})
+
+@app.route('/phrases/<phrase_id>', methods=['GET'])
+def get_phrase(phrase_id):
+    """Audio of a fixed message straight from the memory-mapped phrase bank (no synthesis)"""
+    bank = phrases
+    entry = bank.get(phrase_id) if bank is not None else None
+    if entry is None:
+        return jsonify({'error': 'Phrase not found'}), 404
+    view, key, _ = entry
+    
+    try:
+        fmt = negotiate_format()
+    except (KeyError, FormatUnavailable) as e:
+        return format_error(e)
+    etag = audio_formats.variant_etag(key, fmt)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.vary.add('Accept')
+        return response
+    
+    if fmt.encode is not None:
+        view = memoryview(transcode(fmt, key, view.tobytes))
+    response, _ = range_response(
+        lambda start, end: view[start:end], len(view), etag, fmt.mimetype,
+        requested_chunk_size(), cache_control='public, max-age=86400'
+    )
+    return response
+
+@app.route('/engines', methods=['GET'])
+def list_engines():
+    """STT/LLM/TTS engines: defaults, availability and per-engine latency/throughput"""
+    return jsonify(engine_registry.stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for this worker"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Return cache hit/miss counters"""
+    return jsonify({
+        'tts': tts_cache.stats(),
+        'formats': transcoder.cache.stats(),
+        'singleflight': single_flight.stats(),
+        'incremental_uploads': incremental_uploads.stats(),
+        'device_events': device_events.stats(),
+        'admission': admission.stats(),
+        'web_ui': web_ui.stats(),
+        'phrases': phrases.stats() if phrases is not None else None,
+        'responses': response_cache.stats() if response_cache is not None else None
+    })
 
 @app.errorhandler(413)
 def request_entity_too_large(error):
-    return jsonify({'error': 'الملف كبير جداً. الحد الأقصى 10MB'}), 413
+    return jsonify({'error': 'الملف كبير جداً. الحد الأقصى 10MB', 'audio_url': phrase_url('too_large')}), 413
 
 @app.errorhandler(500)
 def internal_server_error(error):
     logger.error(f"Internal error: {str(error)}")
-    return jsonify({'error': 'خطأ في السيرفر'}), 500
+    return jsonify({'error': 'خطأ في السيرفر', 'audio_url': phrase_url('server_error')}), 500
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 10000))
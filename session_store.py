@@ -0,0 +1,546 @@
+"""
+Per-device session store for ESP32 communication
+Replaces the single global state dict so every device gets its own audio slot.
+Backends:
+    memory - in-process dict (single worker / development)
+    sqlite - shared SQLite file, visible to every gunicorn worker
+
+Besides device sessions a store keeps small named records (JSON plus an
+optional blob) for state that must be visible to every worker, such as
+background jobs and incremental uploads:
+    store.put_record('job', job_id, job)
+    store.get_record('job', job_id)
+Read-modify-write sequences hold store.lock(f'{kind}:{key}').
+"""
+
+import os
+import json
+import hashlib
+import time
+import fcntl
+import sqlite3
+import logging
+import tempfile
+import threading
+import zlib
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEVICE_ID = 'default'
+
+# Default session layout (mirrors the old esp32_data dict)
+DEFAULT_SESSION = {
+    'status': 'ready',  # ready, processing, sending_to_esp32
+    'audio_data': None,
+    'has_audio': False,
+    'text': '',
+    'response_text': '',
+    'stream_state': 'idle',  # idle, streaming, done, error
+    'audio_size': 0,
+    'audio_etag': '',
+    'audio_seq': 0,  # answer number, bumped for every new answer (see next_audio_seq)
+    'history': [],  # conversation ring buffer of [role, text] (see conversation.py)
+    'summary': '',
+    'history_at': 0
+}
+
+# How often (seconds) expired sessions are swept on access
+EVICT_INTERVAL = 60
+
+
+def clean_device_id(value):
+    """Normalize a client-supplied device ID (falls back to the default device)"""
+    return (value or '').strip()[:64] or DEFAULT_DEVICE_ID
+
+
+def new_session():
+    """Return a fresh session dict"""
+    return dict(DEFAULT_SESSION, history=[])
+
+
+def audio_fields(fields):
+    """Add audio_size/audio_etag to an update that replaces audio_data"""
+    if 'audio_data' in fields:
+        audio = fields['audio_data']
+        fields['audio_size'] = len(audio) if audio else 0
+        fields['audio_etag'] = hashlib.blake2b(audio, digest_size=12).hexdigest() if audio else ''
+    return fields
+
+
+def next_audio_seq(seq):
+    """
+    Number of the next answer: 32-bit, never 0, counting up from a clock-based
+    start so a cleared or expired session doesn't reuse the numbers of the old one
+    """
+    seq = (seq + 1) & 0xFFFFFFFF if seq else int(time.time() * 1000) & 0xFFFFFFFF
+    return seq or 1
+
+
+def answer_fields(session, fields):
+    """
+    Bump audio_seq in an update that starts a new answer: a stream starting, or
+    audio stored outside a stream (the final audio of a stream keeps its number)
+    """
+    starts_stream = fields.get('stream_state') == 'streaming'
+    new_audio = fields.get('audio_data') and session['stream_state'] != 'streaming'
+    if starts_stream or new_audio:
+        fields['audio_seq'] = next_audio_seq(session['audio_seq'])
+    return fields
+
+
+class _KeyLocks:
+    """
+    Per-key re-entrant locks for threads in this process
+    A key's lock is reference counted (holders and waiters) and only dropped
+    once nobody uses it, so two threads can never end up with different locks
+    for the same key.
+    """
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, users]
+        self._guard = threading.Lock()
+
+    @contextmanager
+    def hold(self, key):
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.RLock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+    def __len__(self):
+        with self._guard:
+            return len(self._locks)
+
+
+class _Listeners:
+    """Change callbacks: listener(device_id, fields) after update, fields=None after clear"""
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _changed(self, device_id, fields):
+        for listener in self._listeners:
+            try:
+                listener(device_id, fields)
+            except Exception as e:
+                logger.warning(f"Session listener failed: {str(e)}")
+
+
+class MemorySessionStore(_Listeners):
+    """In-process session store with per-device locking and TTL eviction"""
+
+    backend = 'memory'
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._sessions = {}
+        self._chunks = {}
+        self._touched = {}
+        self._records = {}  # (kind, key) -> [json, blob, touched]
+        self._records_lock = threading.Lock()
+        self._locks = _KeyLocks()
+        self._listeners = []
+        self._last_evict = time.monotonic()
+
+    @contextmanager
+    def lock(self, device_id):
+        """Hold the device (or record) lock for a read-modify-write sequence"""
+        with self._locks.hold(device_id):
+            yield
+
+    def get(self, device_id, include_audio=True):
+        """Return a copy of the device session (fresh defaults if unknown)"""
+        self._maybe_evict()
+        with self.lock(device_id):
+            session = self._sessions.get(device_id)
+            if session is None:
+                return new_session()
+            return dict(session)
+
+    def update(self, device_id, **fields):
+        """Merge fields into the device session and return the new state"""
+        self._maybe_evict()
+        with self.lock(device_id):
+            session = self._sessions.setdefault(device_id, new_session())
+            session.update(answer_fields(session, audio_fields(fields)))
+            self._touched[device_id] = time.monotonic()
+            session = dict(session)
+        self._changed(device_id, fields)
+        return session
+
+    def audio_view(self, device_id, start=0, end=None):
+        """Zero-copy memoryview of the stored audio (or a byte range of it)"""
+        with self.lock(device_id):
+            audio = self._sessions.get(device_id, {}).get('audio_data')
+            if audio is None:
+                return None
+            return memoryview(audio)[start:end]
+
+    def clear(self, device_id):
+        """Reset the device session to defaults"""
+        with self.lock(device_id):
+            self._sessions.pop(device_id, None)
+            self._chunks.pop(device_id, None)
+            self._touched.pop(device_id, None)
+        self._changed(device_id, None)
+
+    def append_audio_chunk(self, device_id, chunk):
+        """Append one streamed audio chunk, return its sequence number"""
+        with self.lock(device_id):
+            chunks = self._chunks.setdefault(device_id, [])
+            chunks.append(chunk)
+            self._touched[device_id] = time.monotonic()
+            return len(chunks) - 1
+
+    def get_audio_chunks(self, device_id, start=0):
+        """Return streamed audio chunks from sequence number `start` on"""
+        with self.lock(device_id):
+            return self._chunks.get(device_id, [])[start:]
+
+    def reset_audio_chunks(self, device_id):
+        """Drop streamed audio chunks before a new stream starts"""
+        with self.lock(device_id):
+            self._chunks.pop(device_id, None)
+
+    def devices(self):
+        """Return the IDs of all live sessions"""
+        return list(self._sessions)
+
+    def get_record(self, kind, key):
+        """Return a copy of the record stored under kind/key, or None"""
+        with self._records_lock:
+            entry = self._records.get((kind, key))
+            return json.loads(entry[0]) if entry is not None else None
+
+    def get_blob(self, kind, key):
+        """Return the blob stored with a record, or None"""
+        with self._records_lock:
+            entry = self._records.get((kind, key))
+            return entry[1] if entry is not None else None
+
+    def put_record(self, kind, key, record, blob=None):
+        """Store a JSON-serializable record; blob=None keeps the record's current blob"""
+        data = json.dumps(record, ensure_ascii=False)
+        with self._records_lock:
+            entry = self._records.get((kind, key))
+            if blob is None and entry is not None:
+                blob = entry[1]
+            self._records[(kind, key)] = [data, blob, time.monotonic()]
+
+    def delete_record(self, kind, key):
+        """Remove a record, return True if it existed"""
+        with self._records_lock:
+            return self._records.pop((kind, key), None) is not None
+
+    def evict_expired(self):
+        """Drop sessions not updated within the TTL, return how many were dropped"""
+        cutoff = time.monotonic() - self.ttl
+        with self._records_lock:
+            for record_key in [k for k, entry in self._records.items() if entry[2] < cutoff]:
+                del self._records[record_key]
+        expired = [key for key, ts in list(self._touched.items()) if ts < cutoff]
+        for device_id in expired:
+            with self.lock(device_id):
+                if self._touched.get(device_id, 0) < cutoff:
+                    self._sessions.pop(device_id, None)
+                    self._chunks.pop(device_id, None)
+                    self._touched.pop(device_id, None)
+        if expired:
+            logger.info(f"Evicted {len(expired)} expired sessions")
+        return len(expired)
+
+    def _maybe_evict(self):
+        now = time.monotonic()
+        if now - self._last_evict >= EVICT_INTERVAL:
+            self._last_evict = now
+            self.evict_expired()
+
+
+class SQLiteSessionStore(_Listeners):
+    """
+    Session store shared by all worker processes through one SQLite file.
+    Per-device locking uses an in-process lock plus an fcntl byte-range
+    lock on a sidecar file, so different devices never block each other.
+    """
+
+    backend = 'sqlite'
+    LOCK_SLOTS = 4096
+
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        # fcntl locks are per process, so each slot also needs a thread lock
+        self._slot_locks = [threading.RLock() for _ in range(self.LOCK_SLOTS)]
+        self._slot_depth = [0] * self.LOCK_SLOTS
+        self._listeners = []
+        self._last_evict = time.monotonic()
+        self._lock_fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                ' device_id TEXT PRIMARY KEY,'
+                ' data TEXT NOT NULL,'
+                ' audio BLOB,'
+                ' updated_at REAL NOT NULL)'
+            )
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at)'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS audio_chunks ('
+                ' device_id TEXT NOT NULL,'
+                ' seq INTEGER NOT NULL,'
+                ' data BLOB NOT NULL,'
+                ' PRIMARY KEY (device_id, seq))'
+            )
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS records ('
+                ' kind TEXT NOT NULL,'
+                ' key TEXT NOT NULL,'
+                ' data TEXT NOT NULL,'
+                ' blob BLOB,'
+                ' updated_at REAL NOT NULL,'
+                ' PRIMARY KEY (kind, key))'
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def reopen(self):
+        """Drop this process's connections, e.g. ones inherited from a parent across fork"""
+        self._local = threading.local()
+
+    def _slot(self, device_id):
+        return zlib.crc32(device_id.encode('utf-8')) % self.LOCK_SLOTS
+
+    @contextmanager
+    def lock(self, device_id):
+        """Hold the device (or record) lock across threads and worker processes"""
+        slot = self._slot(device_id)
+        with self._slot_locks[slot]:
+            if self._slot_depth[slot] == 0:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, slot)
+            self._slot_depth[slot] += 1
+            try:
+                yield
+            finally:
+                self._slot_depth[slot] -= 1
+                if self._slot_depth[slot] == 0:
+                    fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, slot)
+
+    def _read(self, conn, device_id, include_audio=True):
+        row = conn.execute(
+            'SELECT data, updated_at, ' + ('audio' if include_audio else 'NULL') +
+            ' FROM sessions WHERE device_id = ?',
+            (device_id,)
+        ).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        session = new_session()
+        session.update(json.loads(row[0]))
+        session['audio_data'] = row[2]
+        return session
+
+    def get(self, device_id, include_audio=True):
+        """Return a copy of the device session (fresh defaults if unknown)"""
+        self._maybe_evict()
+        session = self._read(self._connect(), device_id, include_audio)
+        return session if session is not None else new_session()
+
+    def update(self, device_id, **fields):
+        """
+        Merge fields into the device session and return the new state
+        (audio_data is only included when this update replaced it)
+        """
+        self._maybe_evict()
+        fields = audio_fields(fields)
+        with self.lock(device_id):
+            conn = self._connect()
+            session = self._read(conn, device_id, include_audio=False) or new_session()
+            session.update(answer_fields(session, fields))
+            data = json.dumps(
+                {k: v for k, v in session.items() if k != 'audio_data'},
+                ensure_ascii=False
+            )
+            # Only rewrite the audio blob when the audio itself changed
+            if 'audio_data' in fields:
+                conn.execute(
+                    'INSERT INTO sessions (device_id, data, audio, updated_at) VALUES (?, ?, ?, ?)'
+                    ' ON CONFLICT(device_id) DO UPDATE SET'
+                    ' data = excluded.data, audio = excluded.audio, updated_at = excluded.updated_at',
+                    (device_id, data, fields['audio_data'], time.time())
+                )
+            else:
+                # An expired row still holds the old answer's audio: drop it with the rest
+                now = time.time()
+                conn.execute(
+                    'INSERT INTO sessions (device_id, data, audio, updated_at) VALUES (?, ?, NULL, ?)'
+                    ' ON CONFLICT(device_id) DO UPDATE SET'
+                    ' data = excluded.data,'
+                    ' audio = CASE WHEN sessions.updated_at < ? THEN NULL ELSE sessions.audio END,'
+                    ' updated_at = excluded.updated_at',
+                    (device_id, data, now, now - self.ttl)
+                )
+        self._changed(device_id, fields)
+        return session
+
+    def audio_view(self, device_id, start=0, end=None):
+        """Read the stored audio (or a byte range of it) with incremental blob I/O"""
+        with self.lock(device_id):
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT rowid, length(audio) FROM sessions WHERE device_id = ? AND audio IS NOT NULL',
+                (device_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            size = row[1]
+            start = min(start, size)
+            end = size if end is None else min(end, size)
+            with conn.blobopen('sessions', 'audio', row[0], readonly=True) as blob:
+                blob.seek(start)
+                return memoryview(blob.read(max(0, end - start)))
+
+    def clear(self, device_id):
+        """Reset the device session to defaults"""
+        with self.lock(device_id):
+            conn = self._connect()
+            conn.execute('DELETE FROM sessions WHERE device_id = ?', (device_id,))
+            conn.execute('DELETE FROM audio_chunks WHERE device_id = ?', (device_id,))
+        self._changed(device_id, None)
+
+    def append_audio_chunk(self, device_id, chunk):
+        """Append one streamed audio chunk, return its sequence number"""
+        with self.lock(device_id):
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT COALESCE(MAX(seq) + 1, 0) FROM audio_chunks WHERE device_id = ?',
+                (device_id,)
+            ).fetchone()
+            conn.execute(
+                'INSERT INTO audio_chunks (device_id, seq, data) VALUES (?, ?, ?)',
+                (device_id, row[0], chunk)
+            )
+            conn.execute(
+                'UPDATE sessions SET updated_at = ? WHERE device_id = ?',
+                (time.time(), device_id)
+            )
+            return row[0]
+
+    def get_audio_chunks(self, device_id, start=0):
+        """Return streamed audio chunks from sequence number `start` on"""
+        rows = self._connect().execute(
+            'SELECT data FROM audio_chunks WHERE device_id = ? AND seq >= ? ORDER BY seq',
+            (device_id, start)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def reset_audio_chunks(self, device_id):
+        """Drop streamed audio chunks before a new stream starts"""
+        with self.lock(device_id):
+            self._connect().execute(
+                'DELETE FROM audio_chunks WHERE device_id = ?', (device_id,)
+            )
+
+    def devices(self):
+        """Return the IDs of all live sessions"""
+        rows = self._connect().execute(
+            'SELECT device_id FROM sessions WHERE updated_at >= ?',
+            (time.time() - self.ttl,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_record(self, kind, key):
+        """Return a copy of the record stored under kind/key, or None"""
+        row = self._connect().execute(
+            'SELECT data FROM records WHERE kind = ? AND key = ? AND updated_at >= ?',
+            (kind, key, time.time() - self.ttl)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def get_blob(self, kind, key):
+        """Return the blob stored with a record, or None"""
+        row = self._connect().execute(
+            'SELECT blob FROM records WHERE kind = ? AND key = ? AND updated_at >= ?',
+            (kind, key, time.time() - self.ttl)
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def put_record(self, kind, key, record, blob=None):
+        """Store a JSON-serializable record; blob=None keeps the record's current blob"""
+        data = json.dumps(record, ensure_ascii=False)
+        conn = self._connect()
+        if blob is None:
+            conn.execute(
+                'INSERT INTO records (kind, key, data, blob, updated_at) VALUES (?, ?, ?, NULL, ?)'
+                ' ON CONFLICT(kind, key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at',
+                (kind, key, data, time.time())
+            )
+        else:
+            conn.execute(
+                'INSERT INTO records (kind, key, data, blob, updated_at) VALUES (?, ?, ?, ?, ?)'
+                ' ON CONFLICT(kind, key) DO UPDATE SET'
+                ' data = excluded.data, blob = excluded.blob, updated_at = excluded.updated_at',
+                (kind, key, data, blob, time.time())
+            )
+
+    def delete_record(self, kind, key):
+        """Remove a record, return True if it existed"""
+        cursor = self._connect().execute('DELETE FROM records WHERE kind = ? AND key = ?', (kind, key))
+        return cursor.rowcount > 0
+
+    def evict_expired(self):
+        """Drop sessions not updated within the TTL, return how many were dropped"""
+        conn = self._connect()
+        cutoff = time.time() - self.ttl
+        conn.execute('DELETE FROM records WHERE updated_at < ?', (cutoff,))
+        cursor = conn.execute(
+            'DELETE FROM sessions WHERE updated_at < ?', (cutoff,)
+        )
+        conn.execute(
+            'DELETE FROM audio_chunks WHERE device_id NOT IN (SELECT device_id FROM sessions)'
+        )
+        if cursor.rowcount:
+            logger.info(f"Evicted {cursor.rowcount} expired sessions")
+        return cursor.rowcount
+
+    def _maybe_evict(self):
+        now = time.monotonic()
+        if now - self._last_evict >= EVICT_INTERVAL:
+            self._last_evict = now
+            self.evict_expired()
+
+
+def create_session_store():
+    """Build the session store configured by SESSION_BACKEND / SESSION_DB_PATH / SESSION_TTL"""
+    backend = os.getenv('SESSION_BACKEND', 'memory').lower()
+    ttl = int(os.getenv('SESSION_TTL', 3600))
+
+    if backend == 'sqlite':
+        path = os.getenv(
+            'SESSION_DB_PATH',
+            os.path.join(tempfile.gettempdir(), 'smart_sessions.db')
+        )
+        logger.info(f"Using SQLite session store at {path}")
+        return SQLiteSessionStore(path, ttl=ttl)
+
+    if backend != 'memory':
+        logger.warning(f"Unknown SESSION_BACKEND '{backend}', using memory")
+    return MemorySessionStore(ttl=ttl)
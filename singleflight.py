@@ -0,0 +1,202 @@
+"""
+Single-flight request coalescing
+When many devices ask for the same thing at once (a broadcast message, a
+popular prompt) only one caller does the work; the others wait and share
+its result.
+    in process     - the first caller for a key (the leader) runs fn, the
+                     rest wait on its Future
+    across workers - the leader also holds flock() on <dir>/<key>.lock; a
+                     leader in another gunicorn worker that finds the lock
+                     taken flags <dir>/<key>.waiting, waits for it and then
+                     reads the result the first worker left in
+                     <dir>/<key>.result instead of redoing the work; the
+                     result file is only written when that flag is set
+
+Results shared across workers must be bytes or str. The default <dir> is
+instance/singleflight (see instance_dir.py), private to the app's user.
+"""
+
+import os
+import time
+import fcntl
+import hashlib
+import logging
+import threading
+from concurrent.futures import Future
+
+from instance_dir import private_dir
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.01
+# Lock/result files untouched for this long are removed
+SWEEP_AGE = 600
+SWEEP_INTERVAL = 60
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls that share a key"""
+
+    def __init__(self, lock_dir=None, timeout=30.0):
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._counters = {
+            'leaders': 0,
+            'coalesced': 0,
+            'remote_waits': 0,
+            'remote_hits': 0
+        }
+        if lock_dir:
+            os.makedirs(lock_dir, mode=0o700, exist_ok=True)
+
+    def do(self, key, fn):
+        """Return fn(), shared with every concurrent caller using the same key"""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+                self._counters['leaders'] += 1
+            else:
+                self._counters['coalesced'] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._run_shared(key, fn) if self.lock_dir else fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._inflight)
+        return stats
+
+    # Cross-worker part
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.lock_dir, digest)
+
+    def _run_shared(self, key, fn):
+        path = self._path(key)
+        fd = os.open(f'{path}.lock', os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            waited_since = None
+            deadline = time.monotonic() + self.timeout
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if waited_since is None:
+                        waited_since = time.time()
+                        self._flag_waiting(path)
+                        with self._lock:
+                            self._counters['remote_waits'] += 1
+                    if time.monotonic() >= deadline:
+                        # The other worker is stuck; don't make this request wait forever
+                        logger.warning(f"Single-flight wait timed out for {key[:40]}")
+                        return fn()
+                    time.sleep(POLL_INTERVAL)
+
+            try:
+                os.utime(f'{path}.lock')
+                if waited_since is not None:
+                    result = self._read_result(path, waited_since)
+                    if result is not None:
+                        with self._lock:
+                            self._counters['remote_hits'] += 1
+                        return result
+                result = fn()
+                if self._take_waiting_flag(path):
+                    self._write_result(path, result)
+                return result
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+            self._maybe_sweep()
+
+    def _flag_waiting(self, path):
+        try:
+            os.close(os.open(f'{path}.waiting', os.O_CREAT | os.O_WRONLY, 0o600))
+        except OSError as e:
+            logger.warning(f"Single-flight wait flag failed: {str(e)}")
+
+    def _take_waiting_flag(self, path):
+        """True if a worker queued behind this leader (clears the flag for the next one)"""
+        try:
+            os.remove(f'{path}.waiting')
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"Single-flight wait flag failed: {str(e)}")
+            return True
+
+    def _read_result(self, path, newer_than):
+        """Result left by another worker after we started waiting, or None"""
+        try:
+            with open(f'{path}.result', 'rb') as f:
+                if os.fstat(f.fileno()).st_mtime < newer_than - 1:
+                    return None
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        kind, payload = data[:1], data[1:]
+        return payload.decode('utf-8') if kind == b's' else payload
+
+    def _write_result(self, path, result):
+        if isinstance(result, str):
+            data = b's' + result.encode('utf-8')
+        elif isinstance(result, (bytes, bytearray)):
+            data = b'b' + bytes(result)
+        else:
+            return
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, f'{path}.result')
+        except OSError as e:
+            logger.warning(f"Single-flight result write failed: {str(e)}")
+
+    def _maybe_sweep(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_sweep < SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+        try:
+            with os.scandir(self.lock_dir) as entries:
+                for entry in entries:
+                    try:
+                        if now - entry.stat().st_mtime > SWEEP_AGE:
+                            os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+        except OSError as e:
+            logger.warning(f"Single-flight sweep failed: {str(e)}")
+
+
+def create_single_flight():
+    """Build the coalescer configured by SINGLEFLIGHT_DIR (empty = in-process only) / SINGLEFLIGHT_TIMEOUT"""
+    lock_dir = os.getenv('SINGLEFLIGHT_DIR')
+    if lock_dir is None:
+        lock_dir = private_dir('singleflight')
+    return SingleFlight(
+        lock_dir=lock_dir or None,
+        timeout=float(os.getenv('SINGLEFLIGHT_TIMEOUT', 30))
+    )
@@ -0,0 +1,215 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdaptiveLimit, Bulkhead, Overloaded, StageLimiter, create_admission_control
+
+
+def test_bulkhead_caps_and_counts():
+    bulkhead = Bulkhead(2)
+    assert bulkhead.try_acquire() and bulkhead.try_acquire()
+    assert not bulkhead.try_acquire()
+    assert bulkhead.stats() == {'capacity': 2, 'in_use': 2, 'rejected': 1}
+    bulkhead.release()
+    assert bulkhead.try_acquire()
+    bulkhead.release()
+    bulkhead.release()
+    assert bulkhead.stats()['in_use'] == 0
+
+
+def test_bulkhead_of_zero_is_unlimited():
+    bulkhead = Bulkhead(0)
+    assert all(bulkhead.try_acquire() for _ in range(100))
+    assert bulkhead.stats()['rejected'] == 0
+
+
+def limiter(limit=1, max_queue=1, queue_timeout=0.05, **kwargs):
+    return StageLimiter('stt', AdaptiveLimit(initial=limit, max_limit=limit), max_queue=max_queue,
+                        queue_timeout=queue_timeout, **kwargs)
+
+
+def test_stage_slot_is_released_on_success_and_failure():
+    stage = limiter()
+    with stage.slot():
+        assert stage.stats()['in_flight'] == 1
+    with pytest.raises(ZeroDivisionError):
+        with stage.slot():
+            1 / 0
+    stats = stage.stats()
+    assert (stats['in_flight'], stats['admitted'], stats['failures']) == (0, 2, 1)
+
+
+def test_stage_queues_then_times_out():
+    stage = limiter(queue_timeout=0.05)
+    with stage.slot():
+        with pytest.raises(Overloaded) as error:
+            with stage.slot():
+                pass
+    assert error.value.stage == 'stt'
+    assert error.value.retry_after >= 1
+    stats = stage.stats()
+    assert (stats['queued'], stats['timeouts'], stats['in_flight'], stats['waiting']) == (1, 1, 0, 0)
+
+
+def test_stage_hands_the_slot_to_a_waiter():
+    stage = limiter(queue_timeout=5)
+    done = []
+
+    def waiter():
+        with stage.slot():
+            done.append(True)
+
+    with stage.slot():
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        while stage.stats()['waiting'] == 0:
+            time.sleep(0.001)
+    thread.join()
+    assert done == [True]
+    assert stage.stats()['queued'] == 1
+
+
+def test_stage_sheds_when_the_queue_is_full():
+    stage = limiter(max_queue=0)
+    with stage.slot():
+        with pytest.raises(Overloaded):
+            stage.check()
+        with pytest.raises(Overloaded):
+            with stage.slot():
+                pass
+    assert stage.stats()['shed'] == 2
+    stage.check()  # a free slot again
+
+
+def test_async_slot_takes_a_free_slot_and_records_latency():
+    stage = limiter()
+
+    async def call():
+        async with stage.aslot():
+            assert stage.stats()['in_flight'] == 1
+            await asyncio.sleep(0.01)
+
+    asyncio.run(call())
+    stats = stage.stats()
+    assert (stats['in_flight'], stats['admitted'], stats['queued']) == (0, 1, 0)
+    assert stats['latency_ms'] >= 10
+
+
+def test_async_slot_queues_without_blocking_the_loop():
+    stage = limiter(queue_timeout=5)
+
+    async def main():
+        order = []
+
+        async def holder():
+            async with stage.aslot():
+                await asyncio.sleep(0.05)  # the loop must keep running while the other call queues
+                order.append('holder')
+
+        async def waiter():
+            await asyncio.sleep(0.01)
+            async with stage.aslot():
+                order.append('waiter')
+
+        await asyncio.gather(holder(), waiter())
+        return order
+
+    assert asyncio.run(main()) == ['holder', 'waiter']
+    assert stage.stats()['queued'] == 1
+    assert stage.stats()['in_flight'] == 0
+
+
+def test_async_slot_times_out_with_overloaded():
+    stage = limiter(queue_timeout=0.05)
+
+    async def main():
+        async with stage.aslot():
+            with pytest.raises(Overloaded):
+                async with stage.aslot():
+                    pass
+
+    asyncio.run(main())
+    assert stage.stats()['timeouts'] == 1
+
+
+def test_cancelled_async_waiter_gives_its_slot_back():
+    stage = limiter(queue_timeout=5)
+
+    async def main():
+        async with stage.aslot():
+            waiter = asyncio.ensure_future(stage.aslot().__aenter__())
+            while stage.stats()['waiting'] == 0:
+                await asyncio.sleep(0.001)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        # The queued thread takes the freed slot and hands it straight back
+        for _ in range(500):
+            if stage.stats()['in_flight'] == 0:
+                break
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert stage.stats()['in_flight'] == 0
+
+
+def test_disabled_stage_admits_everything():
+    stage = limiter(max_queue=0, enabled=False)
+    with stage.slot(), stage.slot():
+        stage.check()
+    assert stage.stats()['admitted'] == 0
+
+
+def test_overload_errors_shrink_the_limit():
+    stage = limiter(limit=8, is_overload=lambda e: isinstance(e, TimeoutError))
+    stage.limit.max_limit = 8
+    with pytest.raises(TimeoutError):
+        with stage.slot():
+            raise TimeoutError()
+    assert stage.limit.current == 6
+    assert stage.limit.decreases == 1
+
+
+def test_adaptive_limit_grows_when_saturated_and_fast():
+    limit = AdaptiveLimit(initial=2, max_limit=4)
+    for _ in range(20):
+        limit.on_sample(0.1, in_flight=limit.current)
+    assert limit.current == 4
+    limit.on_sample(0.1, in_flight=1)  # not saturated: no growth signal
+    assert limit.increases > 0 and limit.decreases == 0
+
+
+def test_adaptive_limit_backs_off_on_latency():
+    limit = AdaptiveLimit(initial=8, tolerance=2.0, backoff=0.5, smoothing=1.0)
+    limit.on_sample(0.1, in_flight=1)
+    limit.on_sample(1.0, in_flight=1)
+    assert limit.current == 4
+    limit.on_sample(1.0, in_flight=1)  # at most one decrease per smoothed latency
+    assert limit.current == 4
+    assert limit.decreases == 1
+
+
+def test_adaptive_limit_never_drops_below_min():
+    limit = AdaptiveLimit(initial=2, min_limit=1, backoff=0.1)
+    limit.on_sample(0.1, in_flight=1, overloaded=True)
+    assert limit.current == 1
+
+
+def test_create_admission_control_from_env():
+    env = {'ADMISSION_STT_LIMIT': '3', 'ADMISSION_QUEUE': '2', 'GUNICORN_THREADS': '10'}
+    admission = create_admission_control(('stt', 'llm'), getenv=lambda name, default=None: env.get(name, default))
+    assert admission.stage('stt').limit.current == 3
+    assert admission.stage('llm').limit.current == 4
+    assert admission.stage('stt').max_queue == 2
+    assert admission.waiters.capacity == 2
+    assert admission.bulkhead.capacity == 6  # two threads stay free for cheap requests
+    assert set(admission.stats()) == {'stt', 'llm', 'requests', 'waiters'}
+
+
+def test_admission_can_be_turned_off():
+    env = {'ADMISSION': '0'}
+    admission = create_admission_control(('stt',), getenv=lambda name, default=None: env.get(name, default))
+    assert not admission.stage('stt').enabled
+    assert admission.bulkhead.capacity == admission.waiters.capacity == 0
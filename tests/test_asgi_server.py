@@ -0,0 +1,89 @@
+"""The ASGI app with the fake engines (same configuration as test_server_admission.py)"""
+
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip('starlette')
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    env = {
+        'STT_ENGINE': 'fake', 'LLM_ENGINE': 'fake', 'TTS_ENGINE': 'fake',
+        'PHRASE_BANK': str(tmp_path_factory.mktemp('bank') / 'phrases.bank'),
+        'PHRASE_BANK_BUILD': '0',
+        'RESPONSE_CACHE': '0'
+    }
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        import asgi_server
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    from starlette.testclient import TestClient
+    with TestClient(asgi_server.app) as client:
+        client.sessions = asgi_server.sessions
+        yield client
+
+
+def test_tts(client):
+    response = client.post('/tts', json={'text': 'مرحبا'})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'audio/mpeg'
+    assert response.content
+
+
+@pytest.mark.parametrize('body', [b'', b'not json', b'[1, 2]', b'{"text": 5}', b'{"text": ""}'])
+def test_tts_refuses_bad_bodies(client, body):
+    response = client.post('/tts', content=body, headers={'Content-Type': 'application/json'})
+    assert response.status_code == 400
+    assert response.json()['error']
+
+
+@pytest.fixture
+def off_loop(client, monkeypatch):
+    """Fail any session store call made on the event loop's thread"""
+    def checked(method):
+        def call(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return method(*args, **kwargs)
+            raise AssertionError(f'{method.__name__} called on the event loop')
+        return call
+
+    for name in ('get', 'update', 'clear', 'lock', 'get_audio_chunks', 'append_audio_chunk'):
+        monkeypatch.setattr(client.sessions, name, checked(getattr(client.sessions, name)))
+    return client
+
+
+def test_audio_delivery_keeps_the_store_off_the_loop(off_loop):
+    client = off_loop
+    assert client.get('/get-audio-stream?device_id=asgi-dev').status_code == 404
+    assert client.get('/wait?device_id=asgi-dev&timeout=0').status_code == 204
+
+    client.sessions.update('asgi-dev', audio_data=b'\xff\xf3' + bytes(100), has_audio=True, status='sending_to_esp32')
+    state = client.get('/wait?device_id=asgi-dev&timeout=1').json()
+    assert state['ready']
+    status = client.get('/status?device_id=asgi-dev').json()
+    assert (status['esp32_status'], status['has_audio']) == ('sending_to_esp32', True)
+
+    response = client.get('/get-audio-stream?device_id=asgi-dev')
+    assert response.status_code == 200
+    assert len(response.content) == 102
+    assert client.get('/status?device_id=asgi-dev').json()['esp32_status'] == 'ready'
+    assert client.get(f"/wait?device_id=asgi-dev&timeout=0&seq={state['seq']}").status_code == 204
+
+    assert client.post('/clear?device_id=asgi-dev').json()['status'] == 'cleared'
+    assert not client.get('/status?device_id=asgi-dev').json()['has_audio']
+
+
+def test_websocket_reports_the_session(off_loop):
+    with off_loop.websocket_connect('/ws?device_id=asgi-ws') as socket:
+        assert socket.receive_json()['event'] == 'status'
@@ -0,0 +1,147 @@
+import struct
+
+import numpy as np
+import pytest
+
+import audio_formats
+import audio_preprocess
+from audio_formats import (
+    ADPCM_BLOCK_ALIGN, ADPCM_SAMPLES_PER_BLOCK, FORMATS, FormatUnavailable, Transcoder,
+    _ADPCM_INDEX, _ADPCM_STEPS, encode_ima_adpcm, encode_pcm, negotiate, parse_accept, variant_etag
+)
+from tts_cache import TTSCache
+
+
+def decode_ima_adpcm(wav):
+    """Reference mono IMA-ADPCM WAV decoder; returns (rate, n_samples, int samples)"""
+    assert wav[:4] == b'RIFF' and wav[8:12] == b'WAVE'
+    chunks, offset = {}, 12
+    while offset < len(wav):
+        name, size = wav[offset:offset + 4], struct.unpack_from('<I', wav, offset + 4)[0]
+        chunks[name] = wav[offset + 8:offset + 8 + size]
+        offset += 8 + size
+    tag, channels, rate, _, block_align, bits, _, per_block = struct.unpack('<HHIIHHHH', chunks[b'fmt '])
+    assert (tag, channels, bits) == (0x11, 1, 4)
+    n_samples = struct.unpack('<I', chunks[b'fact'])[0]
+    data, samples = chunks[b'data'], []
+    for start in range(0, len(data), block_align):
+        block = data[start:start + block_align]
+        predictor, index, _ = struct.unpack_from('<hBB', block)
+        samples.append(predictor)
+        for byte in block[4:]:
+            for code in (byte & 0x0f, byte >> 4):
+                step = _ADPCM_STEPS[index]
+                delta = step >> 3
+                if code & 4:
+                    delta += step
+                if code & 2:
+                    delta += step >> 1
+                if code & 1:
+                    delta += step >> 2
+                predictor = max(-32768, min(32767, predictor - delta if code & 8 else predictor + delta))
+                index = max(0, min(88, index + _ADPCM_INDEX[code]))
+                samples.append(predictor)
+        assert len(block) == block_align and per_block == ADPCM_SAMPLES_PER_BLOCK
+    return rate, n_samples, np.array(samples[:n_samples])
+
+
+def tone(rate, seconds=0.5, frequency=440.0, level=0.5):
+    t = np.arange(int(rate * seconds)) / rate
+    return (level * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def test_pcm_is_clipped_16_bit_little_endian():
+    data = encode_pcm(np.array([0.0, 1.0, -1.0, 2.0], dtype=np.float32), 16000)
+    assert struct.unpack('<4h', data) == (0, 32767, -32767, 32767)
+
+
+def test_adpcm_round_trips_close_to_the_source():
+    samples = tone(16000)
+    wav = encode_ima_adpcm(samples, 16000)
+    rate, n_samples, decoded = decode_ima_adpcm(wav)
+    assert (rate, n_samples) == (16000, len(samples))
+    reference = np.clip(samples, -1, 1) * 32767
+    error = np.sqrt(np.mean((decoded - reference) ** 2))
+    assert error < 0.02 * 32767
+
+
+def test_adpcm_size_and_padding():
+    wav = encode_ima_adpcm(np.zeros(ADPCM_SAMPLES_PER_BLOCK + 1, dtype=np.float32), 8000)
+    _, n_samples, decoded = decode_ima_adpcm(wav)
+    assert n_samples == ADPCM_SAMPLES_PER_BLOCK + 1
+    assert not decoded.any()
+    data_length = struct.unpack_from('<I', wav, wav.index(b'data') + 4)[0]
+    assert data_length == 2 * ADPCM_BLOCK_ALIGN
+    assert struct.unpack_from('<I', wav, 4)[0] == len(wav) - 8
+
+
+def test_adpcm_of_empty_audio_is_one_silent_block():
+    _, n_samples, decoded = decode_ima_adpcm(encode_ima_adpcm(np.zeros(0, dtype=np.float32), 16000))
+    assert n_samples == 0 and len(decoded) == 0
+
+
+@pytest.fixture
+def with_decoder(monkeypatch):
+    """An in-process 'mp3' decoder producing a 24 kHz tone, so no ffmpeg is needed"""
+    calls = []
+
+    def decode(data, mimetype):
+        calls.append(data)
+        return tone(24000), 24000
+
+    monkeypatch.setattr(audio_preprocess, '_decoders', [(lambda filename, mimetype: True, decode)])
+    monkeypatch.setattr(audio_formats.shutil, 'which', lambda name: None)
+    return calls
+
+
+def test_missing_requirement(with_decoder, monkeypatch):
+    assert audio_formats.missing_requirement('mp3') is None
+    assert audio_formats.missing_requirement('pcm16') is None
+    assert audio_formats.missing_requirement('mp3-low') == 'ffmpeg'
+    monkeypatch.setattr(audio_preprocess, '_decoders', [])
+    assert audio_formats.missing_requirement('adpcm') == 'ffmpeg'
+    monkeypatch.setattr(audio_formats, 'np', None)
+    assert audio_formats.missing_requirement('adpcm') == 'numpy'
+
+
+def test_parse_accept_orders_by_quality_then_position(with_decoder):
+    assert parse_accept('audio/x-ima-adpcm;q=0.5, audio/pcm;rate=8000') == ['pcm8', 'adpcm']
+    assert parse_accept('audio/mpeg;bitrate=32000') == []  # mp3-low needs ffmpeg
+    assert parse_accept('audio/pcm;q=0, audio/*') == ['mp3']
+    assert parse_accept('text/html') == []
+
+
+def test_negotiate(with_decoder):
+    assert negotiate('PCM16') is FORMATS['pcm16']
+    assert negotiate(None, 'audio/x-ima-adpcm;rate=8000') is FORMATS['adpcm8']
+    assert negotiate(None, None) is FORMATS['mp3']
+    with pytest.raises(KeyError):
+        negotiate('flac')
+    with pytest.raises(FormatUnavailable):
+        negotiate('mp3-low')
+
+
+def test_transcoder_converts_each_source_once(with_decoder):
+    transcoder = Transcoder(TTSCache())
+    loads = []
+
+    def load():
+        loads.append(1)
+        return b'mp3 bytes'
+
+    first = transcoder.convert(FORMATS['pcm8'], 'key', load)
+    assert len(first) == 2 * 4000  # 0.5 s resampled to 8 kHz
+    assert transcoder.convert(FORMATS['pcm8'], 'key', load) == first
+    assert len(loads) == 1 and with_decoder == [b'mp3 bytes']
+    assert transcoder.convert(FORMATS['mp3'], 'key', load) == b'mp3 bytes'
+
+
+def test_transcoder_without_a_decoder(monkeypatch):
+    monkeypatch.setattr(audio_preprocess, '_decoders', [])
+    with pytest.raises(FormatUnavailable):
+        Transcoder(TTSCache()).convert(FORMATS['adpcm'], 'key', lambda: b'')
+
+
+def test_variant_etag():
+    assert variant_etag('abc', FORMATS['mp3']) == 'abc'
+    assert variant_etag('abc', FORMATS['adpcm']) == 'abc-adpcm'
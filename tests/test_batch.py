@@ -0,0 +1,158 @@
+import io
+import tarfile
+import threading
+import time
+import zipfile
+
+import pytest
+
+from batch import BatchRunner, ItemTooLarge, archive_kind, is_audio_name, iter_audio
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def tar_bytes(members, mode='w'):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+class NonSeekable(io.RawIOBase):
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self._data.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def test_names_and_kinds():
+    assert is_audio_name('clips/a.WAV')
+    assert not is_audio_name('clips/._a.wav')
+    assert not is_audio_name('notes.txt')
+    assert archive_kind('x.zip') == 'zip'
+    assert archive_kind('x.tar.gz') == 'tar'
+    assert archive_kind('upload', 'application/x-tar; charset=binary') == 'tar'
+    assert archive_kind('a.wav', 'audio/wav') is None
+
+
+def test_zip_members_in_order_skipping_non_audio():
+    archive = zip_bytes({'b.wav': b'bb', 'readme.txt': b'x', 'dir/a.mp3': b'a', '__MACOSX/._b.wav': b'junk'})
+    items = list(iter_audio([('clips.zip', archive, 'application/zip')], 100))
+    assert [(name, data) for name, data, _ in items] == [('b.wav', b'bb'), ('dir/a.mp3', b'a')]
+    assert items[1][2] == 'audio/mpeg'
+
+
+def test_tar_is_streamed_from_a_non_seekable_body():
+    body = NonSeekable(tar_bytes({'one.wav': b'1', 'two.ogg': b'22'}, 'w:gz').getvalue())
+    items = list(iter_audio([('clips.tgz', body, None)], 100))
+    assert [(name, data) for name, data, _ in items] == [('one.wav', b'1'), ('two.ogg', b'22')]
+
+
+def test_oversized_items_are_reported_not_read():
+    archive = zip_bytes({'big.wav': b'x' * 20, 'small.wav': b'x'})
+    plain = ('single.wav', io.BytesIO(b'y' * 20), 'audio/wav')
+    items = list(iter_audio([('clips.zip', archive, None), plain], 10))
+    assert [name for name, _, _ in items] == ['big.wav', 'small.wav', 'single.wav']
+    assert isinstance(items[0][1], ItemTooLarge)
+    assert items[1][1] == b'x'
+    assert isinstance(items[2][1], ItemTooLarge)
+
+
+def test_items_pass_every_stage_and_record_timings():
+    def stt(item):
+        item['text'] = f"text {item['n']}"
+
+    def llm(item):
+        item['answer'] = item['text'].upper()
+
+    runner = BatchRunner([('stt', stt, 2), ('llm', llm, 1)])
+    results = list(runner.run({'n': n} for n in range(5)))
+    assert sorted(item['answer'] for item, error in results) == [f'TEXT {n}' for n in range(5)]
+    assert all(error is None for _, error in results)
+    timings = results[0][0]['timings']
+    assert {'stt_wait', 'llm_wait', 'total'} <= set(timings)
+    assert set(runner.stats()) == {'stt', 'llm'}
+
+
+def test_a_failing_item_skips_the_later_stages():
+    later = []
+
+    def stt(item):
+        if item['n'] == 1:
+            raise ValueError('bad audio')
+
+    runner = BatchRunner([('stt', stt, 1), ('llm', lambda item: later.append(item['n']), 1)])
+    errors = {item['n']: error for item, error in runner.run({'n': n} for n in range(3))}
+    assert isinstance(errors[1], ValueError)
+    assert errors[0] is None and errors[2] is None
+    assert sorted(later) == [0, 2]
+
+
+def test_stages_overlap():
+    both_busy = threading.Event()
+    busy = {'stt': 0, 'llm': 0}
+    lock = threading.Lock()
+
+    def stage(name):
+        def run(item):
+            with lock:
+                busy[name] += 1
+                if busy['stt'] and busy['llm']:
+                    both_busy.set()
+            time.sleep(0.05)
+            with lock:
+                busy[name] -= 1
+        return run
+
+    runner = BatchRunner([('stt', stage('stt'), 1), ('llm', stage('llm'), 1)])
+    assert len(list(runner.run({'n': n} for n in range(4)))) == 4
+    assert both_busy.is_set()
+
+
+def test_read_ahead_is_bounded():
+    read = []
+    release = threading.Event()
+
+    def items():
+        for n in range(10):
+            read.append(n)
+            yield {'n': n}
+
+    runner = BatchRunner([('stt', lambda item: release.wait(5), 1)], max_in_flight=2)
+    results = runner.run(items())
+    consumer = threading.Thread(target=lambda: list(results))
+    consumer.start()
+    time.sleep(0.2)
+    assert len(read) <= 3  # two in flight, plus the one waiting for a slot
+    release.set()
+    consumer.join(5)
+    assert len(read) == 10
+
+
+def test_input_errors_surface_after_the_items_read_before_them():
+    def items():
+        yield {'n': 0}
+        raise zipfile.BadZipFile('truncated')
+
+    results = BatchRunner([('stt', lambda item: None, 1)]).run(items())
+    item, error = next(results)
+    assert item['n'] == 0 and error is None
+    with pytest.raises(zipfile.BadZipFile):
+        next(results)
@@ -0,0 +1,97 @@
+import threading
+import time
+
+from conversation import SUMMARY_PREFIX, ConversationMemory, estimate_tokens, extractive_summary
+from session_store import MemorySessionStore
+
+
+def memory(**kwargs):
+    return ConversationMemory(MemorySessionStore(), **kwargs)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('') == 4
+    assert estimate_tokens('x' * 10) == 8
+
+
+def test_extractive_summary_pairs_questions_and_answers():
+    turns = [['user', 'What is the capital? I wonder.'], ['assistant', 'Cairo. It is big.']]
+    assert extractive_summary('', turns, 600) == '- س: What is the capital? ج: Cairo.'
+    assert extractive_summary('- س: old', turns, 40) == '- س: What is the capital? ج: Cairo.'
+    assert extractive_summary('', [['user', 'ما العاصمة؟ سؤال.']], 600) == '- س: ما العاصمة؟'
+
+
+def test_new_conversation_is_just_system_and_user():
+    conversation = memory()
+    messages, info = conversation.build_messages('system', 'dev', 'hello')
+    assert messages == [{'role': 'system', 'content': 'system'}, {'role': 'user', 'content': 'hello'}]
+    assert info == {'prompt_tokens': estimate_tokens('system') + estimate_tokens('hello'),
+                    'turns_sent': 0, 'turns_trimmed': 0}
+    assert not conversation.active('dev')
+
+
+def test_recorded_turns_are_sent_in_order():
+    conversation = memory()
+    conversation.record('dev', 'q1', 'a1')
+    conversation.record('dev', 'q2', 'a2')
+    messages, info = conversation.build_messages('system', 'dev', 'q3')
+    assert [m['content'] for m in messages] == ['system', 'q1', 'a1', 'q2', 'a2', 'q3']
+    assert info['turns_sent'] == 2
+    assert conversation.active('dev')
+
+
+def test_ring_buffer_compacts_old_turns_into_the_summary():
+    conversation = memory(max_turns=2)
+    for n in range(3):
+        conversation.record('dev', f'question {n}?', f'answer {n}.')
+    messages, _ = conversation.build_messages('system', 'dev', 'next')
+    assert messages[1] == {'role': 'system', 'content': SUMMARY_PREFIX + '- س: question 0? ج: answer 0.'}
+    assert [m['content'] for m in messages[2:]] == ['question 1?', 'answer 1.', 'question 2?', 'answer 2.', 'next']
+    assert conversation.stats()['compactions'] == 1
+
+
+def test_budget_keeps_the_newest_whole_pairs():
+    conversation = memory(token_budget=60)
+    for n in range(5):
+        conversation.record('dev', 'q' * 25, f'a{n}' + 'a' * 23)
+    messages, info = conversation.build_messages('s', 'dev', 'u')
+    assert info['prompt_tokens'] <= 60
+    assert 0 < info['turns_sent'] < 5
+    assert info['turns_sent'] + info['turns_trimmed'] == 5
+    assert messages[-2]['content'].startswith('a4')
+    assert [m['role'] for m in messages[1:-1]] == ['user', 'assistant'] * info['turns_sent']
+
+
+def test_idle_conversation_starts_over():
+    conversation = memory(ttl=0.05)
+    conversation.record('dev', 'q', 'a')
+    time.sleep(0.1)
+    assert not conversation.active('dev')
+    assert conversation.stats()['expired'] == 1
+
+
+def test_custom_summarizer_runs_in_the_background():
+    done = threading.Event()
+
+    def summarize(summary, turns):
+        done.set()
+        return f'{len(turns)} turns'
+
+    conversation = memory(max_turns=1, summarize=summarize)
+    conversation.record('dev', 'q1', 'a1')
+    conversation.record('dev', 'q2', 'a2')
+    assert done.wait(5)
+    deadline = time.monotonic() + 5
+    while conversation.sessions.get('dev')['summary'] != '2 turns' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert conversation.sessions.get('dev')['summary'] == '2 turns'
+
+
+def test_failing_summarizer_falls_back_to_extractive():
+    conversation = memory(max_turns=1, summarize=lambda summary, turns: 1 / 0)
+    conversation.record('dev', 'q1', 'a1')
+    conversation.record('dev', 'q2', 'a2')
+    deadline = time.monotonic() + 5
+    while not conversation.sessions.get('dev')['summary'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert conversation.sessions.get('dev')['summary'] == '- س: q1 ج: a1'
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+
+from device_events import DeviceEvents
+
+
+@pytest.fixture
+def socket_dir():
+    # Short path: UNIX socket names are limited to ~100 bytes
+    path = tempfile.mkdtemp(prefix='ev-')
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def notify_later(events, device_id, delay=0.05):
+    timer = threading.Timer(delay, events.notify, args=(device_id,))
+    timer.start()
+    return timer
+
+
+def test_wait_wakes_on_notify():
+    events = DeviceEvents()
+    version = events.version('dev')
+    notify_later(events, 'dev')
+    started = time.monotonic()
+    assert events.wait('dev', version, 5) > version
+    assert time.monotonic() - started < 2
+    assert events.stats()['wakeups'] == 1
+    assert events.stats()['waiting'] == 0
+
+
+def test_wait_times_out_and_ignores_other_devices():
+    events = DeviceEvents()
+    version = events.version('dev')
+    events.notify('other')
+    assert events.wait('dev', version, 0.05) == version
+    assert events.stats()['timeouts'] == 1
+
+
+def test_notify_before_wait_is_not_missed():
+    events = DeviceEvents()
+    version = events.version('dev')
+    events.notify('dev')
+    started = time.monotonic()
+    assert events.wait('dev', version, 5) > version
+    assert time.monotonic() - started < 1
+
+
+def test_wait_async_wakes_on_notify_from_a_thread():
+    events = DeviceEvents()
+
+    async def main():
+        version = events.version('dev')
+        notify_later(events, 'dev')
+        return version, await events.wait_async('dev', version, 5)
+
+    before, after = asyncio.run(main())
+    assert after > before
+    assert events.stats()['waiting'] == 0
+
+
+def test_wait_async_timeout_leaves_no_waiter():
+    events = DeviceEvents()
+    assert asyncio.run(events.wait_async('dev', 0, 0.05)) == 0
+    assert events.stats()['timeouts'] == 1
+    assert events.stats()['waiting'] == 0
+
+
+def test_session_change_only_notifies_on_watched_fields():
+    events = DeviceEvents()
+    events.on_session_change('dev', {'last_text': 'hi'})
+    assert events.version('dev') == 0
+    events.on_session_change('dev', {'status': 'ready'})
+    first = events.version('dev')
+    events.on_session_change('dev', None)
+    assert events.version('dev') > first > 0
+
+
+def test_remembered_devices_are_bounded():
+    events = DeviceEvents(max_devices=3)
+    for n in range(10):
+        events.notify(f'dev-{n}')
+    stats = events.stats()
+    assert stats['devices'] == 3
+    assert stats['forgotten'] == 7
+    assert events.version('dev-0') == 0
+    assert events.version('dev-9') == 10
+
+
+def test_forgotten_device_never_goes_back_to_an_old_version():
+    events = DeviceEvents(max_devices=1)
+    events.notify('dev')
+    held = events.version('dev')
+    events.notify('other')  # forgets dev
+    assert events.version('dev') == 0
+    events.notify('dev')
+    assert events.version('dev') > held
+
+
+def test_devices_with_waiters_are_not_forgotten():
+    events = DeviceEvents(max_devices=1)
+    events.notify('dev')
+    version = events.version('dev')
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(events.wait('dev', version, 5)))
+    waiter.start()
+    while not events.stats()['waiting']:
+        time.sleep(0.01)
+    for n in range(5):
+        events.notify(f'other-{n}')
+    assert events.version('dev') == version
+    events.notify('dev')
+    waiter.join(5)
+    assert result and result[0] > version
+
+
+def test_notification_from_another_worker_wakes_waiters(socket_dir):
+    events = DeviceEvents(socket_dir=socket_dir)
+    version = events.version('dev')  # binds this worker's socket
+    own = os.path.join(socket_dir, f'worker-{os.getpid()}.sock')
+    assert os.path.exists(own)
+
+    def other_worker():
+        time.sleep(0.05)
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sender.sendto(b'dev', own)
+        sender.close()
+
+    threading.Thread(target=other_worker).start()
+    assert events.wait('dev', version, 5) > version
+    assert events.stats()['broadcasts_received'] == 1
+
+
+def test_notify_is_broadcast_to_other_workers(socket_dir):
+    events = DeviceEvents(socket_dir=socket_dir)
+    peer = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    peer.bind(os.path.join(socket_dir, 'worker-1.sock'))
+    peer.settimeout(5)
+    try:
+        events.notify('dev')
+        assert peer.recv(256) == b'dev'
+    finally:
+        peer.close()
+    assert events.stats()['broadcasts_sent'] == 1
+
+
+def test_dead_worker_sockets_are_removed(socket_dir):
+    events = DeviceEvents(socket_dir=socket_dir)
+    dead = os.path.join(socket_dir, 'worker-1.sock')
+    gone = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    gone.bind(dead)
+    gone.close()
+    events.notify('dev')
+    assert not os.path.exists(dead)
+    assert events.stats()['broadcasts_sent'] == 0
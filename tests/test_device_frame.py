@@ -0,0 +1,75 @@
+import pytest
+
+from device_frame import (
+    FLAG_INLINE, HEADER, STATE_IDLE, STATE_PROCESSING, STATE_READY, STATE_STREAMING,
+    FrameError, decode_frame, encode_frame, frame_parts, frame_size, frame_state
+)
+
+AUDIO = bytes(range(256)) * 4
+
+
+def test_round_trip_with_inlined_audio():
+    data = encode_frame(STATE_READY, 0xDEADBEEF, audio=AUDIO, has_audio=True, fmt='adpcm')
+    assert len(data) == frame_size(len(AUDIO), inline=True)
+    assert decode_frame(data) == {
+        'state': STATE_READY,
+        'inline': True,
+        'has_audio': True,
+        'format': 'adpcm',
+        'seq': 0xDEADBEEF,
+        'audio_length': len(AUDIO),
+        'audio': AUDIO
+    }
+
+
+def test_round_trip_without_audio():
+    data = encode_frame(STATE_READY, 7, audio_length=123456, has_audio=True)
+    assert len(data) == frame_size()
+    frame = decode_frame(data)
+    assert (frame['inline'], frame['audio'], frame['audio_length'], frame['seq']) == (False, None, 123456, 7)
+    assert frame['format'] == 'mp3'
+
+
+def test_parts_pass_the_audio_through():
+    parts = frame_parts(STATE_READY, 1, audio=AUDIO)
+    assert parts[1] is AUDIO
+    assert len(parts[0]) == HEADER.size
+    assert decode_frame(b''.join(parts))['audio'] == AUDIO
+
+
+def test_decode_accepts_memoryview():
+    data = encode_frame(STATE_READY, 3, audio=AUDIO)
+    assert decode_frame(memoryview(data))['audio'] == AUDIO
+
+
+@pytest.mark.parametrize('position', [0, 3, HEADER.size + 10, -1])
+def test_corruption_is_detected(position):
+    data = bytearray(encode_frame(STATE_READY, 3, audio=AUDIO))
+    data[position] ^= 0x01
+    with pytest.raises(FrameError):
+        decode_frame(bytes(data))
+
+
+def test_truncated_frames_are_rejected():
+    data = encode_frame(STATE_READY, 3, audio=AUDIO)
+    with pytest.raises(FrameError):
+        decode_frame(data[:-1])
+    with pytest.raises(FrameError):
+        decode_frame(data[:10])
+
+
+def test_inline_flag_without_audio_is_rejected():
+    data = bytearray(encode_frame(STATE_IDLE))
+    data[4] |= FLAG_INLINE
+    with pytest.raises(FrameError):
+        decode_frame(bytes(data))
+
+
+@pytest.mark.parametrize('state, expected', [
+    ({'ready': True, 'streaming': True, 'status': 'sending_to_esp32'}, STATE_STREAMING),
+    ({'ready': True, 'streaming': False, 'status': 'sending_to_esp32'}, STATE_READY),
+    ({'ready': False, 'streaming': False, 'status': 'processing'}, STATE_PROCESSING),
+    ({'ready': False, 'streaming': False, 'status': 'ready'}, STATE_IDLE),
+])
+def test_frame_state(state, expected):
+    assert frame_state(state) == expected
@@ -0,0 +1,74 @@
+import pytest
+
+from engines import (
+    EngineRegistry, EngineUnavailable, FakeLLM, FakeSTT, FakeTTS, GroqLLM, GroqSTT, Selection
+)
+
+
+def make_registry():
+    return EngineRegistry([
+        GroqSTT(client=None), FakeSTT(),  # no client: groq is registered but unavailable
+        FakeLLM(),
+        FakeTTS()
+    ])
+
+
+def test_first_registered_engine_is_the_default():
+    registry = EngineRegistry([FakeSTT(), GroqSTT(client=object()), GroqLLM(client=object()), FakeLLM(), FakeTTS()])
+    selection = registry.select()
+    assert isinstance(selection, Selection)
+    assert (selection.stt.name, selection.llm.name, selection.tts.name) == ('fake', 'groq', 'fake')
+    assert registry.is_default(selection)
+
+
+def test_select_by_name():
+    registry = EngineRegistry([GroqLLM(client=object()), FakeLLM(), FakeSTT(), FakeTTS()])
+    selection = registry.select(llm=' Fake ')
+    assert selection.llm.name == 'fake'
+    assert not registry.is_default(selection)
+
+
+def test_unavailable_and_unknown_engines_are_refused():
+    registry = make_registry()
+    with pytest.raises(EngineUnavailable) as error:
+        registry.get('stt', 'groq')
+    assert error.value.available == ['fake']
+    with pytest.raises(EngineUnavailable):
+        registry.get('stt')  # the default is groq, which has no client
+    with pytest.raises(EngineUnavailable):
+        registry.select(tts='espeak-ng')
+    assert isinstance(EngineUnavailable('stt', 'x', []), LookupError)
+
+
+def test_set_default():
+    registry = make_registry()
+    registry.set_default('stt', 'fake')
+    assert registry.get('stt').name == 'fake'
+    assert registry.is_default(registry.select())
+    with pytest.raises(EngineUnavailable):
+        registry.set_default('stt', 'groq')
+    assert registry.get('stt').name == 'fake'
+
+
+def test_register_can_replace_the_default():
+    registry = EngineRegistry([FakeLLM()])
+    registry.register(GroqLLM(client=object()), default=True)
+    assert registry.get('llm').name == 'groq'
+    assert registry.names('llm') == ['fake', 'groq']
+
+
+def test_engines_count_calls():
+    registry = make_registry()
+    stt, llm, tts = registry.select(stt='fake')
+    assert stt.transcribe('q.wav', b'\0' * 100, 'audio/wav') == stt.text
+    answer = llm.complete([{'role': 'user', 'content': 'hi'}])
+    assert ''.join(llm.stream([{'role': 'user', 'content': 'hi'}])).strip() == answer
+    assert len(tts.synthesize('abc')) == len(FakeTTS.FRAME) * 6
+
+    stats = registry.stats()
+    assert stats['stt']['default'] == 'groq'
+    assert stats['stt']['available'] == ['fake']
+    assert stats['stt']['engines']['fake']['calls'] == 1
+    assert stats['stt']['engines']['fake']['input_bytes'] == 100
+    assert stats['llm']['engines']['fake']['calls'] == 2
+    assert stats['tts']['engines']['fake']['output_bytes'] == len(FakeTTS.FRAME) * 6
@@ -0,0 +1,219 @@
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+import groq_pool
+from groq_pool import CircuitBreaker, GroqPool, PoolBusy, TokenBucket, create_groq_pool, parse_duration
+
+
+class FakeRaw:
+    def __init__(self, result, headers=None):
+        self.result = result
+        self.headers = headers or {}
+
+    def parse(self):
+        return self.result
+
+
+def api_error(status, headers=None):
+    # Only what the openai error classes and the pool read from an HTTP response
+    response = SimpleNamespace(status_code=status, headers=headers or {}, request=None)
+    cls = {
+        401: openai.AuthenticationError,
+        400: openai.BadRequestError,
+        429: openai.RateLimitError,
+        500: openai.InternalServerError
+    }[status]
+    return cls('error', response=response, body=None)
+
+
+def install(key, outcomes, calls=None):
+    """Make key's chat.completions return/raise the given outcomes in order; returns the call log"""
+    calls = [] if calls is None else calls
+
+    def create(**kwargs):
+        calls.append(key.name)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    key._client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(with_raw_response=SimpleNamespace(create=create)))
+    )
+    return calls
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    slept = []
+    monkeypatch.setattr(groq_pool.time, 'sleep', slept.append)
+    return slept
+
+
+def ask(pool):
+    return pool.client.chat.completions.create(messages=[{'role': 'user', 'content': 'hi'}], max_tokens=10)
+
+
+def test_parse_duration():
+    assert parse_duration('2m59.56s') == pytest.approx(179.56)
+    assert parse_duration('120ms') == pytest.approx(0.12)
+    assert parse_duration('7') == 7.0
+    assert parse_duration('') is None
+    assert parse_duration('soon') is None
+
+
+def test_token_bucket_disabled_by_zero_rate():
+    bucket = TokenBucket(0, 1)
+    for _ in range(10):
+        bucket.take(0.0)
+    assert bucket.wait_time(0.0) == 0.0
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(2.0, 1)
+    bucket.updated = 100.0
+    bucket.take(100.0)
+    assert bucket.wait_time(100.0) == pytest.approx(0.5)
+    assert bucket.wait_time(100.5) == 0.0
+
+
+def test_breaker_opens_after_threshold_and_half_opens_after_cooldown():
+    breaker = CircuitBreaker(threshold=2, cooldown=10.0)
+    breaker.record_failure(0.0)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure(1.0)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.wait_time(5.0) == pytest.approx(6.0)
+
+    assert breaker.wait_time(11.0) == 0.0
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.on_dispatch()
+    assert breaker.wait_time(11.0) > 0  # only one trial call at a time
+
+
+def test_breaker_trial_result_closes_or_reopens():
+    breaker = CircuitBreaker(threshold=1, cooldown=10.0)
+    breaker.record_failure(0.0)
+    breaker.wait_time(10.0)
+    breaker.on_dispatch()
+    breaker.record_failure(10.0)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    breaker.wait_time(20.0)
+    breaker.on_dispatch()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+
+
+def test_breaker_trips_at_once_when_asked():
+    breaker = CircuitBreaker(threshold=5)
+    breaker.record_failure(0.0, trip=True)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_select_prefers_the_key_with_most_headroom():
+    pool = GroqPool(['a', 'b', 'c'])
+    pool.keys[0].limit_requests, pool.keys[0].remaining_requests = 100, 10
+    pool.keys[1].limit_requests, pool.keys[1].remaining_requests = 100, 80
+    key, wait = pool._select(0)
+    assert key is pool.keys[2]  # unknown limits count as full headroom
+    assert wait == 0.0
+    pool.keys[2].limit_requests, pool.keys[2].remaining_requests = 100, 5
+    key, _ = pool._select(0)
+    assert key is pool.keys[1]
+    assert key.remaining_requests == 79  # reserved until the next headers arrive
+    assert key.in_flight == 1
+
+
+def test_select_reports_the_shortest_wait_when_no_key_is_ready(monkeypatch):
+    monkeypatch.setattr(groq_pool.time, 'monotonic', lambda: 100.0)
+    pool = GroqPool(['a', 'b'])
+    pool.keys[0].cooldown_until = 105.0
+    pool.keys[1].cooldown_until = 102.0
+    key, wait = pool._select(0)
+    assert key is None
+    assert wait == pytest.approx(2.0)
+
+
+def test_select_honours_remaining_tokens(monkeypatch):
+    monkeypatch.setattr(groq_pool.time, 'monotonic', lambda: 100.0)
+    pool = GroqPool(['a'])
+    key = pool.keys[0]
+    key.remaining_tokens, key.tokens_reset_at = 50, 103.0
+    assert pool._select(40)[0] is key
+    assert pool._select(40) == (None, pytest.approx(3.0))
+
+
+def test_rate_limited_call_fails_over_and_cools_the_key_down(no_sleep):
+    pool = GroqPool(['a', 'b'])
+    first, second = pool.keys
+    calls = install(first, [api_error(429, {'retry-after': '7'})])
+    install(second, [FakeRaw('answer', {'x-ratelimit-remaining-requests': '9'})], calls)
+    first.limit_requests = second.limit_requests = 10
+    second.remaining_requests = 5
+
+    assert ask(pool) == 'answer'
+    assert calls == ['key-0', 'key-1']
+    assert first.counters['rate_limited'] == 1
+    assert first.cooldown_until > groq_pool.time.monotonic() + 6
+    assert second.remaining_requests == 9
+    assert no_sleep == []  # the other key was free, no backoff
+
+
+def test_server_errors_are_retried_with_backoff(no_sleep):
+    pool = GroqPool(['a'], backoff_base=0.5, backoff_cap=2.0)
+    install(pool.keys[0], [api_error(500), api_error(500), FakeRaw('answer')])
+    assert ask(pool) == 'answer'
+    assert len(no_sleep) == 2
+    assert all(0 <= delay <= 2.0 for delay in no_sleep)
+    assert pool.keys[0].counters['errors'] == 2
+    assert pool.keys[0].breaker.state == CircuitBreaker.CLOSED  # the success closed it again
+
+
+def test_retries_stop_after_max_attempts(no_sleep):
+    pool = GroqPool(['a'], max_attempts=2)
+    install(pool.keys[0], [api_error(500), api_error(500), FakeRaw('never')])
+    with pytest.raises(openai.InternalServerError):
+        ask(pool)
+
+
+def test_bad_key_is_taken_out_of_rotation(no_sleep):
+    pool = GroqPool(['a', 'b'])
+    calls = install(pool.keys[0], [api_error(401)])
+    install(pool.keys[1], [FakeRaw('answer'), FakeRaw('again')], calls)
+    assert ask(pool) == 'answer'
+    assert pool.keys[0].breaker.state == CircuitBreaker.OPEN
+    assert ask(pool) == 'again'
+    assert calls == ['key-0', 'key-1', 'key-1']
+
+
+def test_client_errors_are_not_retried(no_sleep):
+    pool = GroqPool(['a', 'b'])
+    install(pool.keys[0], [api_error(400)])
+    install(pool.keys[1], [FakeRaw('never')])
+    with pytest.raises(openai.BadRequestError):
+        ask(pool)
+
+
+def test_pool_busy_when_no_key_frees_up_in_time(monkeypatch):
+    monkeypatch.setattr(groq_pool.time, 'monotonic', lambda: 100.0)
+    pool = GroqPool(['a'], queue_timeout=1.0)
+    pool.keys[0].cooldown_until = 130.0
+    with pytest.raises(PoolBusy) as error:
+        ask(pool)
+    assert error.value.retry_after == 30
+
+
+def test_backoff_is_capped():
+    pool = GroqPool(['a'], backoff_base=1.0, backoff_cap=3.0)
+    assert all(0 <= pool._backoff(attempt) <= 3.0 for attempt in range(10) for _ in range(20))
+
+
+def test_local_rate_limit_is_off_by_default(monkeypatch):
+    monkeypatch.setenv('GROQ_API_KEYS', 'a,b')
+    monkeypatch.delenv('GROQ_KEY_RPS', raising=False)
+    pool = create_groq_pool()
+    assert [key.bucket.rate for key in pool.keys] == [0.0, 0.0]
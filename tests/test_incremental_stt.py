@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+from incremental_stt import IncrementalUploads, SegmentFailed, UploadError, stitch
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+PCM = 'audio/pcm;rate=16000'
+
+
+def echo(filename, data, mimetype, engine):
+    """Transcript of an undecodable chunk is its bytes; of a WAV segment, its filename"""
+    return filename if mimetype == 'audio/wav' else data.decode()
+
+
+def tone(seconds, rate=16000):
+    t = np.arange(int(seconds * rate)) / rate
+    return (np.sin(2 * np.pi * 220 * t) * 8000).astype('<i2').tobytes()
+
+
+@pytest.fixture
+def uploads():
+    return IncrementalUploads(echo, segment_seconds=1.0)
+
+
+def test_stitch_drops_a_word_repeated_across_a_boundary():
+    assert stitch(['hello there', 'there, friend', '', None, 'ok']) == 'hello there friend ok'
+
+
+def test_undecodable_chunks_are_transcribed_in_order(uploads):
+    upload = uploads.start('dev', filename='recording.opus')
+    for seq, word in ((0, 'one'), (1, 'two'), (2, 'three')):
+        assert uploads.add_chunk(upload['upload_id'], seq, word.encode())[0]
+    text, info = uploads.finish(upload['upload_id'], 3)
+    assert text == 'one two three'
+    assert (info['chunks'], info['segments']) == (3, 3)
+    assert uploads.get(upload['upload_id']) is None
+
+
+def test_out_of_order_chunks_without_mimetype_are_reassembled(uploads):
+    upload_id = uploads.start('dev', filename='recording.opus')['upload_id']
+    accepted, snapshot = uploads.add_chunk(upload_id, 2, b'three', None)
+    assert accepted and snapshot['pending_chunks'] == [2]
+    uploads.add_chunk(upload_id, 1, b'two', None)
+    accepted, snapshot = uploads.add_chunk(upload_id, 0, b'one', None)
+    assert accepted
+    assert (snapshot['next_seq'], snapshot['pending_chunks']) == (3, [])
+    assert uploads.store.get_blob('upload-chunk', f'{upload_id}:1') is None
+    assert uploads.finish(upload_id, 3)[0] == 'one two three'
+
+
+def test_retried_chunk_is_not_accepted_twice(uploads):
+    upload_id = uploads.start('dev', filename='recording.opus')['upload_id']
+    assert uploads.add_chunk(upload_id, 1, b'two')[0]
+    assert not uploads.add_chunk(upload_id, 1, b'two')[0]
+    assert uploads.add_chunk(upload_id, 0, b'one')[0]
+    assert not uploads.add_chunk(upload_id, 0, b'one')[0]
+    assert uploads.finish(upload_id, 2)[0] == 'one two'
+
+
+def test_pcm_is_cut_into_segments_and_silence_skipped(uploads):
+    upload_id = uploads.start('dev', filename='recording.pcm', mimetype=PCM)['upload_id']
+    uploads.add_chunk(upload_id, 0, tone(1.5))
+    snapshot = uploads.add_chunk(upload_id, 1, bytes(32000))[1]  # one second of silence
+    assert snapshot['segments'] >= 1
+    assert 0 < snapshot['buffered_seconds'] < 1.0
+    uploads.add_chunk(upload_id, 2, tone(0.5))
+    text, info = uploads.finish(upload_id, 3)
+    assert info['silent_segments'] >= 1
+    words = text.split()
+    assert len(words) == info['segments'] - info['silent_segments']
+    assert all(word.startswith('recording-') and word.endswith('.wav') for word in words)
+
+
+def test_missing_chunks_keep_the_upload_open(uploads):
+    upload_id = uploads.start('dev', filename='recording.opus')['upload_id']
+    uploads.add_chunk(upload_id, 0, b'one')
+    uploads.add_chunk(upload_id, 2, b'three')
+    with pytest.raises(UploadError) as error:
+        uploads.finish(upload_id, 3, timeout=0.05)
+    assert error.value.status == 409
+    assert 'missing chunks: [1]' in str(error.value)
+    uploads.add_chunk(upload_id, 1, b'two')
+    assert uploads.finish(upload_id, 3)[0] == 'one two three'
+
+
+def test_unknown_finished_and_oversized_uploads_are_refused():
+    uploads = IncrementalUploads(echo, max_bytes=10)
+    with pytest.raises(UploadError) as error:
+        uploads.add_chunk('nope', 0, b'x')
+    assert error.value.status == 404
+    upload_id = uploads.start('dev', filename='recording.opus')['upload_id']
+    with pytest.raises(UploadError) as error:
+        uploads.add_chunk(upload_id, 0, b'x' * 11)
+    assert error.value.status == 413
+    uploads.finish(upload_id)
+    with pytest.raises(UploadError) as error:
+        uploads.finish(upload_id)
+    assert error.value.status == 404
+
+
+def test_failed_segment_fails_the_upload():
+    def transcribe(filename, data, mimetype, engine):
+        if data == b'bad':
+            raise SegmentFailed('backend busy', retry_after=3)
+        return data.decode()
+
+    uploads = IncrementalUploads(transcribe)
+    upload_id = uploads.start('dev', filename='recording.opus')['upload_id']
+    uploads.add_chunk(upload_id, 0, b'good')
+    uploads.add_chunk(upload_id, 1, b'bad')
+    with pytest.raises(SegmentFailed) as error:
+        uploads.finish(upload_id, 2)
+    assert error.value.retry_after == 3
+
+
+def test_engine_is_passed_to_every_segment():
+    engines = []
+    uploads = IncrementalUploads(lambda filename, data, mimetype, engine: engines.append(engine) or 'x')
+    upload_id = uploads.start('dev', filename='recording.opus', engine='fake')['upload_id']
+    uploads.add_chunk(upload_id, 0, b'a')
+    uploads.add_chunk(upload_id, 1, b'b')
+    uploads.finish(upload_id, 2)
+    assert engines == ['fake', 'fake']
+
+
+def test_discard_drops_waiting_chunks(uploads):
+    upload_id = uploads.start('dev', filename='recording.opus')['upload_id']
+    uploads.add_chunk(upload_id, 1, b'two')
+    assert uploads.discard(upload_id)
+    assert uploads.get(upload_id) is None
+    assert uploads.store.get_record('upload-chunk', f'{upload_id}:1') is None
+    assert not uploads.discard(upload_id)
+
+
+def test_chunks_can_arrive_at_different_workers(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    first = IncrementalUploads(echo, store=SQLiteSessionStore(path), segment_seconds=1.0)
+    second = IncrementalUploads(echo, store=SQLiteSessionStore(path), segment_seconds=1.0)
+    upload_id = first.start('dev', filename='recording.pcm', mimetype=PCM)['upload_id']
+    second.add_chunk(upload_id, 1, tone(1.0))
+    first.add_chunk(upload_id, 0, tone(1.0))
+    assert second.get(upload_id)['next_seq'] == 2
+    text, info = second.finish(upload_id, 2)
+    assert info['segments'] >= 2
+    assert text.split()[0] == 'recording-0.wav'
+
+
+def test_expired_uploads_are_forgotten():
+    uploads = IncrementalUploads(echo, store=MemorySessionStore(), ttl=-1)
+    upload_id = uploads.start('dev')['upload_id']
+    assert uploads.get(upload_id) is None
+    assert uploads.stats()['expired'] == 1
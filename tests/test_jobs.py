@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+from jobs import JobQueue, QueueFull
+from session_store import SQLiteSessionStore
+
+
+def pipeline(text, on_stage):
+    for stage in ('transcribing', 'thinking', 'speaking'):
+        on_stage(stage)
+    return {'text': text}
+
+
+def wait_until_final(jobs, job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    job = jobs.get(job_id)
+    while job['state'] not in ('done', 'error') and time.monotonic() < deadline:
+        job = jobs.wait(job_id, job['version'], 1)
+    return job
+
+
+def test_job_runs_through_every_stage():
+    jobs = JobQueue(workers=1)
+    job = jobs.submit('dev', pipeline, 'hi')
+    assert job['state'] == 'queued' and job['device_id'] == 'dev'
+    done = wait_until_final(jobs, job['id'])
+    assert done['state'] == 'done'
+    assert done['result'] == {'text': 'hi'}
+    assert list(done['stages']) == ['queued', 'transcribing', 'thinking', 'speaking', 'done']
+    assert done['version'] == 4
+
+
+def test_failed_job_records_the_error():
+    class StageError(Exception):
+        message = 'خطأ في TTS'
+
+    def fail(on_stage):
+        on_stage('speaking')
+        raise StageError('details')
+
+    jobs = JobQueue(workers=1)
+    job = wait_until_final(jobs, jobs.submit('dev', fail)['id'])
+    assert (job['state'], job['error']) == ('error', 'خطأ في TTS')
+    assert 'speaking' in job['stages']
+
+
+def test_full_queue_is_refused():
+    release = threading.Event()
+    jobs = JobQueue(workers=1, max_depth=1)
+    running = jobs.submit('dev', lambda on_stage: release.wait(5))
+    while jobs.get(running['id'])['state'] == 'queued' and jobs.depth():
+        time.sleep(0.01)
+    try:
+        jobs.submit('dev', pipeline, 'waiting')
+        with pytest.raises(QueueFull) as error:
+            jobs.submit('dev', pipeline, 'refused')
+        assert error.value.retry_after >= 1
+        assert jobs.depth() == 1
+    finally:
+        release.set()
+
+
+def test_wait_returns_at_the_timeout_without_a_change():
+    release = threading.Event()
+    jobs = JobQueue(workers=1)
+    job = jobs.submit('dev', lambda on_stage: release.wait(5))
+    started = time.monotonic()
+    try:
+        assert jobs.wait(job['id'], job['version'], 0.1)['version'] == job['version']
+        assert time.monotonic() - started >= 0.1
+    finally:
+        release.set()
+
+
+def test_wait_wakes_when_the_job_changes():
+    release = threading.Event()
+
+    def slow(on_stage):
+        release.wait(5)
+        on_stage('thinking')
+        return None
+
+    jobs = JobQueue(workers=1, poll_interval=10)
+    job = jobs.submit('dev', slow)
+    threading.Timer(0.05, release.set).start()
+    started = time.monotonic()
+    changed = jobs.wait(job['id'], job['version'], 5)
+    assert changed['version'] > job['version']
+    assert time.monotonic() - started < 2
+
+
+def test_finished_jobs_expire():
+    jobs = JobQueue(workers=1, ttl=0.05)
+    job_id = jobs.submit('dev', pipeline, 'hi')['id']
+    assert wait_until_final(jobs, job_id)['state'] == 'done'
+    time.sleep(0.1)
+    assert jobs.get(job_id) is None
+    assert jobs.get('unknown') is None
+
+
+def test_other_worker_sees_the_job_through_a_shared_store(tmp_path):
+    path = str(tmp_path / 'sessions.db')
+    runner = JobQueue(workers=1, store=SQLiteSessionStore(path))
+    reader = JobQueue(workers=1, store=SQLiteSessionStore(path), poll_interval=0.01)
+    job_id = runner.submit('dev', pipeline, 'hi')['id']
+    job = wait_until_final(reader, job_id)
+    assert job['state'] == 'done'
+    assert job['result'] == {'text': 'hi'}
@@ -0,0 +1,63 @@
+import pytest
+
+from metrics import BUCKETS, Metrics, StageStats, process_memory
+
+
+def test_histogram_buckets_and_quantiles():
+    stats = StageStats()
+    for seconds in (0.001, 0.02, 0.3, 100.0):
+        stats.observe(seconds)
+    assert stats.buckets[0] == 1
+    assert stats.buckets[BUCKETS.index(0.025)] == 1
+    assert stats.buckets[BUCKETS.index(0.5)] == 1
+    assert sum(stats.buckets) == 3  # 100 s is only in +Inf
+    assert stats.count == 4
+    assert stats.quantiles() == {0.5: 0.3, 0.9: 100.0, 0.99: 100.0}
+    assert StageStats().quantiles() == {0.5: 0.0, 0.9: 0.0, 0.99: 0.0}
+
+
+def test_timer_records_duration_size_and_timings():
+    metrics = Metrics()
+    timings = {}
+    with metrics.timer('tts', timings) as span:
+        span.size = 1234
+    snapshot = metrics.snapshot()['tts']
+    assert snapshot['count'] == 1 and snapshot['errors'] == 0
+    assert snapshot['payload_bytes'] == 1234
+    assert 'tts' in timings and timings['tts'] >= 0
+
+
+def test_timer_counts_errors_and_reraises():
+    metrics = Metrics()
+    with pytest.raises(RuntimeError):
+        with metrics.timer('llm'):
+            raise RuntimeError('down')
+    assert metrics.snapshot()['llm']['errors'] == 1
+
+
+def test_prometheus_text():
+    metrics = Metrics(prefix='voice')
+    metrics.observe('stt', 0.02, size=10)
+    metrics.observe('stt', 0.2, error=True)
+    metrics.register_gauge('queue_depth', 'Jobs waiting', lambda: {None: 3, (('kind', 'batch'),): 1})
+    metrics.register_gauge('broken', 'Raises', lambda: 1 / 0)
+    lines = metrics.render_prometheus().splitlines()
+    assert '# TYPE voice_stage_duration_seconds histogram' in lines
+    assert 'voice_stage_duration_seconds_bucket{stage="stt",le="0.025"} 1' in lines
+    assert 'voice_stage_duration_seconds_bucket{stage="stt",le="0.25"} 2' in lines
+    assert 'voice_stage_duration_seconds_bucket{stage="stt",le="+Inf"} 2' in lines
+    assert 'voice_stage_duration_seconds_count{stage="stt"} 2' in lines
+    assert 'voice_stage_errors_total{stage="stt"} 1' in lines
+    assert 'voice_stage_payload_bytes_sum{stage="stt"} 10' in lines
+    assert 'voice_stage_payload_bytes_count{stage="stt"} 1' in lines
+    assert 'voice_queue_depth 3' in lines
+    assert 'voice_queue_depth{kind="batch"} 1' in lines
+    assert '# TYPE voice_broken gauge' in lines
+    assert not any(line.startswith('voice_broken ') for line in lines)
+
+
+def test_process_memory():
+    memory = process_memory()
+    assert memory['rss_bytes'] >= 0
+    assert memory['peak_rss_bytes'] >= memory['rss_bytes']
+    assert memory['peak_rss_bytes'] > 0
@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+import phrase_bank
+from phrase_bank import ALIGN, DEFAULT_PHRASES, PhraseBank, build, load_phrases
+from tts_cache import make_key
+
+
+def fake_synthesize(calls):
+    def synthesize(text):
+        calls.append(text)
+        return f'mp3:{text}'.encode('utf-8')
+    return synthesize
+
+
+@pytest.fixture
+def bank_path(tmp_path):
+    return str(tmp_path / 'phrases.bank')
+
+
+def test_error_phrases_match_the_server_texts():
+    server_source = open(os.path.join(os.path.dirname(phrase_bank.__file__), 'server.py'), encoding='utf-8').read()
+    for phrase_id, text in DEFAULT_PHRASES.items():
+        if phrase_id.endswith('_error'):
+            assert text in server_source, phrase_id
+
+
+def test_load_phrases_merges_a_json_file(tmp_path):
+    extra = tmp_path / 'extra.json'
+    extra.write_text(json.dumps({'hello': 'مرحبا', 'ready': None}), encoding='utf-8')
+    phrases = load_phrases(str(extra))
+    assert phrases['hello'] == 'مرحبا'
+    assert 'ready' not in phrases
+    assert phrases['busy'] == DEFAULT_PHRASES['busy']
+
+
+def test_build_and_read_back(bank_path):
+    calls = []
+    stats = build(bank_path, {'a': 'one', 'b': 'two'}, fake_synthesize(calls), 'ar', 'gtts')
+    assert stats['synthesized'] == 2 and stats['reused'] == 0
+    bank = PhraseBank.open(bank_path)
+    try:
+        assert (bank.lang, bank.voice, len(bank)) == ('ar', 'gtts', 2)
+        assert 'a' in bank and 'c' not in bank
+        view, key, text = bank.get('b')
+        assert bytes(view) == b'mp3:two'
+        assert key == make_key('two', 'ar', 'gtts')
+        assert text == 'two'
+        assert bank.get('c') is None
+        assert all(bank._entries[phrase_id][0] % ALIGN == 0 for phrase_id in bank.ids())
+        assert bank.stats()['phrases'] == 2
+    finally:
+        view.release()
+        bank.close()
+
+
+def test_rebuild_only_synthesizes_changed_phrases(bank_path):
+    build(bank_path, {'a': 'one', 'b': 'two'}, fake_synthesize([]), 'ar', 'gtts')
+    calls = []
+    stats = build(bank_path, {'a': 'one', 'b': 'deux', 'c': 'three'}, fake_synthesize(calls), 'ar', 'gtts')
+    assert calls == ['deux', 'three']
+    assert stats['reused'] == 1
+    bank = PhraseBank.open(bank_path)
+    assert bytes(bank.get('a')[0]) == b'mp3:one'
+    assert bytes(bank.get('b')[0]) == b'mp3:deux'
+    bank.close()
+
+
+def test_stale_follows_text_lang_and_voice(bank_path):
+    build(bank_path, {'a': 'one', 'b': 'two'}, fake_synthesize([]), 'ar', 'gtts')
+    bank = PhraseBank.open(bank_path)
+    try:
+        assert bank.stale({'a': 'one', 'b': 'two'}, 'ar', 'gtts') == []
+        assert bank.stale({'a': 'one', 'b': 'deux', 'c': 'x'}, 'ar', 'gtts') == ['b', 'c']
+        assert bank.stale({'a': 'one'}, 'ar', 'fake') == ['a']
+        assert bank.stale({'a': 'one'}, 'en', 'gtts') == ['a']
+    finally:
+        bank.close()
+
+
+def test_open_missing_or_foreign_file(bank_path, tmp_path):
+    assert PhraseBank.open(bank_path) is None
+    other = tmp_path / 'other.bin'
+    other.write_bytes(b'not a phrase bank at all')
+    assert PhraseBank.open(str(other)) is None
+
+
+def test_views_outlive_close(bank_path):
+    build(bank_path, {'a': 'one'}, fake_synthesize([]), 'ar', 'gtts')
+    bank = PhraseBank.open(bank_path)
+    view = bank.get('a')[0]
+    bank.close()
+    assert bytes(view) == b'mp3:one'
+    view.release()
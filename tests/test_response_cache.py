@@ -0,0 +1,73 @@
+import time
+
+from response_cache import ResponseCache, char_ngrams, normalize_arabic
+
+
+def test_normalize_arabic():
+    assert normalize_arabic('  مَا  هِيَ   عاصمة مصر؟ ') == 'ما هي عاصمه مصر'
+    assert normalize_arabic('أين إلى آخر') == normalize_arabic('اين الي اخر')
+    assert normalize_arabic('Hello, World!') == 'hello world'
+    assert normalize_arabic(None) == ''
+
+
+def test_char_ngrams():
+    assert char_ngrams('ab') == {' ab', 'ab '}
+    assert char_ngrams('', n=3) == {'  '}
+
+
+def test_exact_hit_ignores_diacritics_and_punctuation():
+    cache = ResponseCache()
+    cache.put('ما هي عاصمة مصر؟', 'القاهرة', b'mp3')
+    assert cache.get('مَا هِيَ عاصمه مصر') == ('القاهرة', b'mp3')
+    assert cache.stats()['exact_hits'] == 1
+
+
+def test_similar_question_hits_above_the_threshold():
+    cache = ResponseCache(similarity=0.7)
+    cache.put('what is the capital of egypt', 'Cairo', b'mp3')
+    assert cache.get('what is the capital of egypt please') == ('Cairo', b'mp3')
+    assert cache.get('how tall is the eiffel tower') is None
+    stats = cache.stats()
+    assert (stats['similar_hits'], stats['misses']) == (1, 1)
+    assert stats['hit_ratio'] == 0.5
+
+
+def test_similarity_can_be_turned_off():
+    cache = ResponseCache(similarity=0)
+    cache.put('what is the capital of egypt', 'Cairo', b'mp3')
+    assert cache.get('what is the capital of egypt please') is None
+
+
+def test_empty_questions_are_ignored():
+    cache = ResponseCache()
+    cache.put('؟!', 'nothing', b'')
+    assert cache.get('؟!') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_entries_expire():
+    cache = ResponseCache(ttl=0.05)
+    cache.put('question one here', 'answer', b'mp3')
+    time.sleep(0.1)
+    assert cache.get('question one here') is None
+    assert cache.get('question one here!') is None
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=2, similarity=0)
+    cache.put('first question', '1', b'')
+    cache.put('second question', '2', b'')
+    cache.get('first question')
+    cache.put('third question', '3', b'')
+    assert cache.get('second question') is None
+    assert cache.get('first question') == ('1', b'')
+    assert cache.stats()['evictions'] == 1
+
+
+def test_replacing_an_entry_cleans_its_index():
+    cache = ResponseCache()
+    cache.put('same question', 'old', b'')
+    cache.put('same question', 'new', b'')
+    assert cache.get('same question') == ('new', b'')
+    assert all(keys == {'same question'} for keys in cache._index.values())
+    assert cache.stats()['entries'] == 1
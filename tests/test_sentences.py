@@ -0,0 +1,49 @@
+from sentences import SentenceSplitter, split_sentences
+
+
+def test_split_complete_text():
+    text = 'This is the first sentence. And here is the second one! Is this the third?'
+    assert split_sentences(text) == [
+        'This is the first sentence.',
+        'And here is the second one!',
+        'Is this the third?'
+    ]
+
+
+def test_arabic_punctuation():
+    text = 'مرحبا بك في المساعد الذكي. كيف يمكنني مساعدتك اليوم؟ أنا هنا دائماً'
+    assert split_sentences(text, min_chars=5) == [
+        'مرحبا بك في المساعد الذكي.',
+        'كيف يمكنني مساعدتك اليوم؟',
+        'أنا هنا دائماً'
+    ]
+
+
+def test_short_sentences_are_merged_forward():
+    assert split_sentences('Hi. Yes. This one is long enough to stand alone.') == [
+        'Hi. Yes. This one is long enough to stand alone.'
+    ]
+    assert split_sentences('Hi. Yes.', min_chars=1) == ['Hi.', 'Yes.']
+
+
+def test_newlines_end_sentences():
+    assert split_sentences('first line\nsecond line', min_chars=1) == ['first line', 'second line']
+
+
+def test_streamed_deltas_give_the_same_sentences():
+    text = 'The weather is sunny today... Tomorrow it will rain, they say. Bring an umbrella!'
+    splitter = SentenceSplitter()
+    streamed = []
+    for start in range(0, len(text), 3):
+        streamed.extend(splitter.feed(text[start:start + 3]))
+    streamed.extend(splitter.flush())
+    assert streamed == split_sentences(text)
+    assert streamed[0] == 'The weather is sunny today...'
+
+
+def test_trailing_punctuation_waits_for_the_next_delta():
+    splitter = SentenceSplitter(min_chars=1)
+    assert splitter.feed('Wait for it.') == []
+    assert splitter.feed('.. done') == ['Wait for it...']
+    assert splitter.flush() == ['done']
+    assert splitter.flush() == []
@@ -0,0 +1,119 @@
+"""Bulkhead accounting through the Flask app, with the fake engines"""
+
+import io
+import os
+import wave
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def server(tmp_path_factory):
+    env = {
+        'STT_ENGINE': 'fake', 'LLM_ENGINE': 'fake', 'TTS_ENGINE': 'fake',
+        'PHRASE_BANK': str(tmp_path_factory.mktemp('bank') / 'phrases.bank'),
+        'PHRASE_BANK_BUILD': '0',
+        'RESPONSE_CACHE': '0'
+    }
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        import server
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    return server
+
+
+@pytest.fixture
+def client(server):
+    yield server.app.test_client()
+    assert server.admission.bulkhead.stats()['in_use'] == 0
+    assert server.admission.waiters.stats()['in_use'] == 0
+
+
+def wav(seconds=0.5, rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(bytes(int(seconds * rate) * 2))
+    return buffer.getvalue()
+
+
+def test_tts_releases_its_slot(client):
+    with client.post('/tts', json={'text': 'مرحبا'}) as response:
+        assert response.status_code == 200
+        assert response.data
+    with client.post('/tts', data='not json') as response:
+        assert response.status_code == 400
+
+
+def test_upload_releases_its_slot(client):
+    data = {'audio': (io.BytesIO(wav()), 'question.wav', 'audio/wav')}
+    with client.post('/upload?device_id=test-upload', data=data, content_type='multipart/form-data') as response:
+        assert response.status_code == 200
+        assert response.get_json()['status'] == 'ok'
+
+
+def test_streamed_batch_holds_its_slot_until_sent(client, server):
+    data = {'audio': [(io.BytesIO(wav()), f'{i}.wav', 'audio/wav') for i in range(2)]}
+    response = client.post('/batch?device_id=test-batch', data=data, content_type='multipart/form-data',
+                           buffered=False)
+    assert server.admission.bulkhead.stats()['in_use'] == 1
+    with response:
+        lines = response.get_data(as_text=True).strip().splitlines()
+    assert len(lines) == 3
+
+
+def test_full_bulkhead_sheds_pipeline_requests(client, server):
+    bulkhead = server.admission.bulkhead
+    taken = 0
+    while bulkhead.try_acquire():
+        taken += 1
+    try:
+        with client.post('/tts', json={'text': 'مرحبا'}) as response:
+            assert response.status_code == 503
+            assert response.headers['Retry-After']
+        with client.get('/status?device_id=test-shed') as response:
+            assert response.status_code == 200
+    finally:
+        for _ in range(taken):
+            bulkhead.release()
+
+
+def test_long_poll_holds_a_waiter_slot(client, server):
+    with client.get('/wait?device_id=test-wait&timeout=0') as response:
+        assert response.status_code == 204
+    with client.get('/device/frame?device_id=test-wait') as response:
+        assert response.status_code == 200
+    assert server.admission.waiters.stats()['rejected'] == 0
+
+
+def test_sse_holds_its_slot_until_closed(client, server):
+    response = client.get('/events?device_id=test-sse', buffered=False)
+    assert next(response.response).startswith(b'event: status')
+    assert server.admission.waiters.stats()['in_use'] == 1
+    response.close()
+
+
+def test_full_waiter_cap_sheds_long_polls_but_not_status(client, server):
+    waiters = server.admission.waiters
+    taken = 0
+    while waiters.try_acquire():
+        taken += 1
+    try:
+        with client.get('/wait?device_id=test-shed&timeout=1') as response:
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == str(server.WAITING_RETRY_AFTER)
+        with client.get('/device/frame?device_id=test-shed') as response:
+            assert response.status_code == 200  # no ?wait=, nothing to hold
+        with client.get('/status?device_id=test-shed') as response:
+            assert response.status_code == 200
+    finally:
+        for _ in range(taken):
+            waiters.release()
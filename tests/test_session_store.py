@@ -0,0 +1,188 @@
+import threading
+import time
+
+import pytest
+
+from session_store import (
+    DEFAULT_SESSION, MemorySessionStore, SQLiteSessionStore, _KeyLocks, clean_device_id, next_audio_seq
+)
+
+MP3 = b'\xff\xf3' + bytes(200)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_store(request, tmp_path):
+    def make(ttl=3600):
+        if request.param == 'sqlite':
+            return SQLiteSessionStore(str(tmp_path / 'sessions.db'), ttl=ttl)
+        return MemorySessionStore(ttl=ttl)
+    return make
+
+
+@pytest.fixture
+def store(make_store):
+    return make_store()
+
+
+def test_clean_device_id():
+    assert clean_device_id('  kitchen ') == 'kitchen'
+    assert clean_device_id('') == 'default'
+    assert clean_device_id(None) == 'default'
+    assert len(clean_device_id('x' * 100)) == 64
+
+
+def test_unknown_device_gets_defaults(store):
+    assert store.get('nobody') == DEFAULT_SESSION
+
+
+def test_update_merges_and_sets_audio_fields(store):
+    store.update('dev', status='processing', text='hello')
+    session = store.update('dev', audio_data=MP3, has_audio=True)
+    assert session['text'] == 'hello'
+    assert session['audio_size'] == len(MP3)
+    assert session['audio_etag']
+
+    session = store.get('dev')
+    assert session['status'] == 'processing'
+    assert bytes(session['audio_data']) == MP3
+    assert store.get('dev', include_audio=False)['audio_size'] == len(MP3)
+    assert bytes(store.audio_view('dev', 2, 10)) == MP3[2:10]
+    assert store.get('other')['text'] == ''
+
+
+def test_each_answer_gets_a_new_seq(store):
+    first = store.update('dev', audio_data=MP3)['audio_seq']
+    assert first != 0
+    assert store.update('dev', status='sending_to_esp32')['audio_seq'] == first
+    assert store.update('dev', audio_data=MP3)['audio_seq'] == first + 1
+
+
+def test_a_streamed_answer_keeps_its_seq(store):
+    streaming = store.update('dev', stream_state='streaming')['audio_seq']
+    done = store.update('dev', audio_data=MP3, stream_state='done')['audio_seq']
+    assert done == streaming
+
+
+def test_cleared_session_does_not_reuse_seqs(store, monkeypatch):
+    monkeypatch.setattr(time, 'time', lambda: 1000.0)
+    first = store.update('dev', audio_data=MP3)['audio_seq']
+    store.clear('dev')
+    monkeypatch.setattr(time, 'time', lambda: 1001.0)
+    assert store.update('dev', audio_data=MP3)['audio_seq'] != first
+
+
+def test_next_audio_seq_wraps_past_zero():
+    assert next_audio_seq(0xFFFFFFFF) == 1
+    assert next_audio_seq(41) == 42
+    assert next_audio_seq(0) != 0
+
+
+def test_clear_resets_session_and_chunks(store):
+    store.update('dev', audio_data=MP3, text='hi')
+    store.append_audio_chunk('dev', b'a')
+    store.clear('dev')
+    assert store.get('dev') == DEFAULT_SESSION
+    assert store.get_audio_chunks('dev') == []
+    assert store.audio_view('dev') is None
+
+
+def test_audio_chunks(store):
+    store.update('dev', stream_state='streaming')
+    assert [store.append_audio_chunk('dev', chunk) for chunk in (b'a', b'b', b'c')] == [0, 1, 2]
+    assert [bytes(c) for c in store.get_audio_chunks('dev', 1)] == [b'b', b'c']
+    store.reset_audio_chunks('dev')
+    assert store.get_audio_chunks('dev') == []
+
+
+def test_listeners_see_updates_and_clears(store):
+    seen = []
+    store.add_listener(lambda device_id, fields: seen.append((device_id, fields)))
+    store.add_listener(lambda device_id, fields: 1 / 0)  # a broken listener doesn't stop the others
+    store.update('dev', status='processing')
+    store.clear('dev')
+    assert seen == [('dev', {'status': 'processing'}), ('dev', None)]
+
+
+def test_records(store):
+    assert store.get_record('job', 'a') is None
+    store.put_record('job', 'a', {'state': 'queued', 'n': [1, 2]}, blob=b'tail')
+    record = store.get_record('job', 'a')
+    assert record == {'state': 'queued', 'n': [1, 2]}
+    record['state'] = 'changed'  # a copy, not the stored record
+    assert store.get_record('job', 'a')['state'] == 'queued'
+
+    store.put_record('job', 'a', {'state': 'done'})
+    assert bytes(store.get_blob('job', 'a')) == b'tail'  # blob=None keeps the blob
+    store.put_record('job', 'a', {'state': 'done'}, blob=b'new')
+    assert bytes(store.get_blob('job', 'a')) == b'new'
+    assert store.get_record('upload', 'a') is None
+
+    assert store.delete_record('job', 'a') is True
+    assert store.delete_record('job', 'a') is False
+    assert store.get_blob('job', 'a') is None
+
+
+def test_expired_sessions_and_records_are_evicted(make_store):
+    store = make_store(ttl=0.05)
+    store.update('dev', audio_data=MP3)
+    store.put_record('job', 'a', {'state': 'done'})
+    time.sleep(0.1)
+    assert store.evict_expired() == 1
+    assert store.devices() == []
+    assert store.get_record('job', 'a') is None
+    assert store.get('dev') == DEFAULT_SESSION
+
+
+def test_expired_sqlite_audio_is_not_revived(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / 'sessions.db'), ttl=0.05)
+    store.update('dev', audio_data=MP3, has_audio=True)
+    time.sleep(0.1)
+    store.update('dev', status='processing')
+    assert store.audio_view('dev') is None
+
+
+def test_devices_lists_live_sessions(store):
+    store.update('a', status='processing')
+    store.update('b', status='processing')
+    assert sorted(store.devices()) == ['a', 'b']
+
+
+def test_lock_serializes_read_modify_write(store):
+    def bump():
+        for _ in range(50):
+            with store.lock('counter'):
+                count = store.get('counter')['audio_size']
+                store.update('counter', audio_size=count + 1)
+
+    threads = [threading.Thread(target=bump) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.get('counter')['audio_size'] == 200
+
+
+def test_lock_is_reentrant(store):
+    with store.lock('dev'):
+        with store.lock('dev'):
+            store.update('dev', status='processing')
+    assert store.get('dev')['status'] == 'processing'
+
+
+def test_key_locks_are_dropped_once_unused():
+    locks = _KeyLocks()
+    entered = threading.Event()
+    release = threading.Event()
+
+    def holder():
+        with locks.hold('a'):
+            entered.set()
+            release.wait()
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    entered.wait()
+    assert len(locks) == 1
+    release.set()
+    thread.join()
+    assert len(locks) == 0
@@ -0,0 +1,146 @@
+import fcntl
+import multiprocessing
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+import instance_dir
+import singleflight
+from singleflight import SingleFlight, create_single_flight
+
+
+def slow(result, calls, delay=0.2):
+    def fn():
+        calls.append(1)
+        time.sleep(delay)
+        return result
+    return fn
+
+
+def run_together(flight, key, fn, count):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do(key, fn))) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+    assert run_together(flight, 'k', slow('answer', calls), 5) == ['answer'] * 5
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert (stats['leaders'], stats['coalesced'], stats['in_flight']) == (1, 4, 0)
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    flight = SingleFlight()
+
+    def fail():
+        time.sleep(0.1)
+        raise ValueError('boom')
+
+    errors = []
+
+    def call():
+        try:
+            flight.do('k', fail)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 3
+    assert flight.do('k', lambda: 'ok') == 'ok'
+
+
+def test_lone_leader_leaves_no_result_file(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path))
+    assert flight.do('k', lambda: b'audio') == b'audio'
+    assert [name for name in os.listdir(tmp_path) if not name.endswith('.lock')] == []
+
+
+def test_lock_dir_is_private(tmp_path):
+    lock_dir = tmp_path / 'locks'
+    SingleFlight(lock_dir=str(lock_dir)).do('k', lambda: 'x')
+    assert stat.S_IMODE(lock_dir.stat().st_mode) == 0o700
+
+
+def leader(lock_dir, ready):
+    flight = SingleFlight(lock_dir=lock_dir)
+
+    def fn():
+        ready.set()
+        time.sleep(0.5)
+        return 'from the leader'
+
+    flight.do('k', fn)
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_other_worker_reads_the_leaders_result(tmp_path):
+    context = multiprocessing.get_context('fork')
+    ready = context.Event()
+    worker = context.Process(target=leader, args=(str(tmp_path), ready))
+    worker.start()
+    try:
+        assert ready.wait(5)
+        flight = SingleFlight(lock_dir=str(tmp_path))
+        assert flight.do('k', lambda: 'recomputed') == 'from the leader'
+        assert flight.stats()['remote_hits'] == 1
+    finally:
+        worker.join(5)
+    assert not any(name.endswith('.waiting') for name in os.listdir(tmp_path))
+
+
+def test_waiting_flag_controls_the_result_file(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path))
+    path = flight._path('k')
+    flight._flag_waiting(path)
+    flight.do('k', lambda: 'shared')
+    assert os.path.exists(f'{path}.result')
+    assert not os.path.exists(f'{path}.waiting')
+    assert flight._read_result(path, time.time() - 1) == 'shared'
+
+
+def test_wait_times_out_and_runs_locally(tmp_path, monkeypatch):
+    monkeypatch.setattr(singleflight, 'POLL_INTERVAL', 0.01)
+    flight = SingleFlight(lock_dir=str(tmp_path), timeout=0.1)
+    fd = os.open(f"{flight._path('k')}.lock", os.O_CREAT | os.O_RDWR)
+    try:
+        # Another open file description holds the flock, like a stuck worker
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        assert flight.do('k', lambda: 'local') == 'local'
+        assert flight.stats()['remote_waits'] == 1
+    finally:
+        os.close(fd)
+
+
+def test_default_lock_dir_is_under_the_instance_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(instance_dir, 'INSTANCE_DIR', str(tmp_path))
+    monkeypatch.delenv('SINGLEFLIGHT_DIR', raising=False)
+    flight = create_single_flight()
+    assert flight.lock_dir == str(tmp_path / 'singleflight')
+    assert stat.S_IMODE(os.stat(flight.lock_dir).st_mode) == 0o700
+
+
+def test_empty_dir_means_in_process_only(monkeypatch):
+    monkeypatch.setenv('SINGLEFLIGHT_DIR', '')
+    assert create_single_flight().lock_dir is None
+
+
+def test_unusable_instance_dir_falls_back_to_in_process(tmp_path, monkeypatch):
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+    monkeypatch.setattr(instance_dir, 'INSTANCE_DIR', str(blocker))
+    monkeypatch.delenv('SINGLEFLIGHT_DIR', raising=False)
+    assert create_single_flight().lock_dir is None
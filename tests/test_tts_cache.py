@@ -0,0 +1,89 @@
+import os
+import stat
+
+import instance_dir
+from tts_cache import TTSCache, create_tts_cache, make_key
+
+
+def test_key_depends_on_text_lang_and_voice():
+    assert make_key(' hello ', 'en', 'a') == make_key('hello', 'en', 'a')
+    keys = {make_key('hello', 'en', 'a'), make_key('hello', 'ar', 'a'), make_key('hello', 'en', 'b')}
+    assert len(keys) == 3
+
+
+def test_memory_tier_is_a_bounded_lru():
+    cache = TTSCache(memory_max_bytes=10)
+    cache.put('a', b'1234')
+    cache.put('b', b'1234')
+    assert cache.get('a') == b'1234'  # a is now the most recent
+    cache.put('c', b'1234')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1234'
+    stats = cache.stats()
+    assert stats['memory_evictions'] == 1
+    assert stats['memory_bytes'] == 8
+    assert (stats['memory_hits'], stats['misses']) == (2, 1)
+
+
+def test_items_larger_than_memory_are_not_kept_in_memory():
+    cache = TTSCache(memory_max_bytes=3)
+    cache.put('a', b'1234')
+    assert cache.stats()['memory_items'] == 0
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    TTSCache(disk_dir=str(tmp_path)).put('a', b'audio')
+    cache = TTSCache(disk_dir=str(tmp_path))
+    assert cache.stats()['disk_bytes'] == 5
+    assert cache.get('a') == b'audio'
+    assert cache.get('a') == b'audio'
+    stats = cache.stats()
+    assert (stats['disk_hits'], stats['memory_hits']) == (1, 1)
+
+
+def test_disk_tier_evicts_oldest_files(tmp_path):
+    cache = TTSCache(memory_max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=10)
+    cache.put('a', b'1234')
+    os.utime(tmp_path / 'a.mp3', (1, 1))
+    cache.put('b', b'1234')
+    cache.put('c', b'1234')
+    assert cache.get('a') is None
+    assert cache.get('c') == b'1234'
+    assert cache.stats()['disk_evictions'] == 1
+    assert cache.stats()['disk_bytes'] == 8
+
+
+def test_overwrite_does_not_grow_the_disk_tier(tmp_path):
+    cache = TTSCache(disk_dir=str(tmp_path))
+    cache.put('a', b'1234')
+    cache.put('a', b'123456')
+    assert cache.stats()['disk_bytes'] == 6
+
+
+def test_get_or_synthesize_calls_the_engine_once():
+    cache = TTSCache()
+    calls = []
+
+    def synthesize(text, lang):
+        calls.append((text, lang))
+        return b'mp3'
+
+    assert cache.get_or_synthesize('hi', 'ar', 'gtts', synthesize) == b'mp3'
+    assert cache.get_or_synthesize('hi', 'ar', 'gtts', synthesize) == b'mp3'
+    assert calls == [('hi', 'ar')]
+
+
+def test_default_disk_dir_is_private(tmp_path, monkeypatch):
+    monkeypatch.setattr(instance_dir, 'INSTANCE_DIR', str(tmp_path))
+    monkeypatch.delenv('TTS_CACHE_DIR', raising=False)
+    cache = create_tts_cache()
+    assert cache.disk_dir == str(tmp_path / 'tts_cache')
+    assert stat.S_IMODE(os.stat(cache.disk_dir).st_mode) == 0o700
+
+
+def test_empty_dir_means_memory_only(monkeypatch):
+    monkeypatch.setenv('TTS_CACHE_DIR', '')
+    cache = create_tts_cache()
+    cache.put('a', b'audio')
+    assert cache.disk_dir is None
+    assert cache.get('a') == b'audio'
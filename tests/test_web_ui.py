@@ -0,0 +1,106 @@
+import gzip
+
+import pytest
+
+import web_ui
+from web_ui import ASSET_PREFIX, WebUI, choose_encoding, etag_matches, parse_accept_encoding
+
+HTML = '<html><head><style>body { color: red; }</style></head><body><script>let x = 1;</script></body></html>'
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding('gzip, br;q=0.5, identity;q=0') == {'gzip': 1.0, 'br': 0.5, 'identity': 0.0}
+    assert parse_accept_encoding('GZIP;q=bad') == {'gzip': 0.0}
+    assert parse_accept_encoding(None) == {}
+
+
+def test_choose_encoding():
+    available = {'identity', 'gzip', 'br'}
+    assert choose_encoding('gzip, br', available) == 'br'
+    assert choose_encoding('gzip, br;q=0.5', available) == 'gzip'
+    assert choose_encoding('br', {'identity', 'gzip'}) == 'identity'
+    assert choose_encoding(None, available) == 'identity'
+    assert choose_encoding('*', available) == 'br'
+    assert choose_encoding('identity;q=0', {'identity'}) is None
+    assert choose_encoding('*;q=0', {'identity', 'gzip'}) is None
+
+
+def test_etag_matches():
+    assert etag_matches('"a", W/"b"', ['"b"'])
+    assert etag_matches('*', ['"b"'])
+    assert not etag_matches('"a"', ['"b"'])
+    assert not etag_matches(None, ['"b"'])
+
+
+def test_page_is_served_gzipped_with_a_strong_etag():
+    ui = WebUI(HTML)
+    status, body, headers = ui.respond('index.html', 'gzip')
+    assert status == 200
+    assert gzip.decompress(body).decode('utf-8') == HTML
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert headers['Cache-Control'] == 'no-cache'
+    assert headers['ETag'].endswith('-gzip"')
+
+    status, body, plain = ui.respond('index.html')
+    assert body == HTML.encode('utf-8')
+    assert 'Content-Encoding' not in plain
+    assert plain['ETag'] != headers['ETag']
+
+
+def test_brotli_variant_when_available():
+    brotli = pytest.importorskip('brotli')
+    status, body, headers = WebUI(HTML).respond('index.html', 'gzip, br')
+    assert headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(body).decode('utf-8') == HTML
+
+
+def test_gzip_only_without_brotli(monkeypatch):
+    monkeypatch.setattr(web_ui, 'brotli', None)
+    ui = WebUI(HTML)
+    assert set(ui.assets['index.html'].variants) == {'identity', 'gzip'}
+    assert ui.respond('index.html', 'br, gzip;q=0.5')[2]['Content-Encoding'] == 'gzip'
+
+
+def test_matching_etag_gets_304_without_a_body():
+    ui = WebUI(HTML)
+    etag = ui.respond('index.html', 'gzip')[2]['ETag']
+    status, body, headers = ui.respond('index.html', 'gzip', etag)
+    assert (status, body) == (304, b'')
+    assert headers['ETag'] == etag
+    assert 'Content-Type' not in headers
+    assert ui.respond('index.html', 'gzip', '"stale"')[0] == 200
+
+
+def test_refused_identity_gets_406():
+    status, body, _ = WebUI(HTML).respond('index.html', 'identity;q=0, *;q=0')
+    assert (status, body) == (406, b'')
+
+
+def test_unknown_file():
+    assert WebUI(HTML).respond('missing.js') is None
+
+
+def test_split_assets_are_versioned_and_cached_for_long():
+    ui = WebUI(HTML, split_assets=True)
+    assert len(ui.assets) == 3
+    css, = (name for name in ui.assets if name.endswith('.css'))
+    js, = (name for name in ui.assets if name.endswith('.js'))
+    assert css.startswith('app.') and js.startswith('app.')
+
+    page = ui.respond('index.html')[1].decode('utf-8')
+    assert '<style>' not in page and 'let x' not in page
+    assert f'<link rel="stylesheet" href="{ASSET_PREFIX}{css}">' in page
+    assert f'<script src="{ASSET_PREFIX}{js}"></script>' in page
+
+    status, body, headers = ui.respond(js)
+    assert body == b'let x = 1;'
+    assert headers['Content-Type'].startswith('text/javascript')
+    assert 'immutable' in headers['Cache-Control']
+
+
+def test_asset_names_follow_their_content():
+    first = WebUI(HTML, split_assets=True).assets
+    second = WebUI(HTML.replace('red', 'blue'), split_assets=True).assets
+    assert {n for n in first if n.endswith('.js')} == {n for n in second if n.endswith('.js')}
+    assert {n for n in first if n.endswith('.css')} != {n for n in second if n.endswith('.css')}
@@ -0,0 +1,199 @@
+"""
+Content-addressed TTS cache
+Two tiers keyed by a hash of (text, lang, voice):
+    memory - bounded LRU of mp3 bytes
+    disk   - directory of <key>.mp3 files with size-based eviction (oldest first);
+             instance/tts_cache by default, private to the app's user
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from instance_dir import private_dir
+
+logger = logging.getLogger(__name__)
+
+
+def make_key(text, lang='ar', voice=''):
+    """Hash (text, lang, voice) into a cache key"""
+    raw = '\x00'.join((text.strip(), lang, voice))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    """Memory LRU + on-disk audio cache with hit/miss counters"""
+
+    def __init__(self, memory_max_bytes=32 * 1024 * 1024, disk_dir=None,
+                 disk_max_bytes=256 * 1024 * 1024, suffix='.mp3'):
+        self.memory_max_bytes = memory_max_bytes
+        self.suffix = suffix
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0
+        }
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, mode=0o700, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def get(self, key):
+        """Return cached mp3 bytes or None"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return data
+
+        data = self._disk_read(key)
+        if data is not None:
+            with self._lock:
+                self._counters['disk_hits'] += 1
+                self._memory_put(key, data)
+            return data
+
+        with self._lock:
+            self._counters['misses'] += 1
+        return None
+
+    def put(self, key, data):
+        """Store mp3 bytes in both tiers"""
+        with self._lock:
+            self._counters['stores'] += 1
+            self._memory_put(key, data)
+        self._disk_write(key, data)
+
+    def get_or_synthesize(self, text, lang, voice, synthesize):
+        """Return cached audio for text, calling synthesize(text, lang) on a miss"""
+        key = make_key(text, lang, voice)
+        data = self.get(key)
+        if data is None:
+            data = synthesize(text, lang)
+            self.put(key, data)
+        return data
+
+    def stats(self):
+        """Return hit/miss counters and tier sizes"""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_items'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_ratio'] = round(
+            (stats['memory_hits'] + stats['disk_hits']) / lookups, 4
+        ) if lookups else 0.0
+        stats['disk_bytes'] = self._disk_bytes
+        return stats
+
+    # Memory tier (caller holds self._lock)
+
+    def _memory_put(self, key, data):
+        if len(data) > self.memory_max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._counters['memory_evictions'] += 1
+
+    # Disk tier
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f'{key}{self.suffix}')
+
+    def _disk_files(self):
+        """Yield (path, size, mtime) for every cached file"""
+        with os.scandir(self.disk_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(self.suffix):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield entry.path, st.st_size, st.st_mtime
+
+    def _disk_read(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # Keep recently used files away from eviction
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"TTS cache read failed: {str(e)}")
+            return None
+
+    def _disk_write(self, key, data):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            try:
+                replaced = os.stat(path).st_size  # overwriting an entry doesn't grow the tier
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"TTS cache write failed: {str(e)}")
+            return
+        with self._lock:
+            self._disk_bytes += len(data) - replaced
+            over = self._disk_bytes > self.disk_max_bytes
+        if over:
+            self._disk_evict()
+
+    def _disk_evict(self):
+        """Delete the least recently used files until the tier is at 90% of its limit"""
+        files = sorted(self._disk_files(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in files)
+        target = self.disk_max_bytes * 0.9
+        evicted = 0
+        for path, size, _ in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self._counters['disk_evictions'] += evicted
+        if evicted:
+            logger.info(f"TTS cache evicted {evicted} files from disk")
+
+
+def create_tts_cache():
+    """Build the TTS cache configured by TTS_CACHE_MEMORY_MB / TTS_CACHE_DIR / TTS_CACHE_DISK_MB"""
+    disk_dir = os.getenv('TTS_CACHE_DIR')
+    if disk_dir is None:
+        disk_dir = private_dir('tts_cache')
+    return TTSCache(
+        memory_max_bytes=int(float(os.getenv('TTS_CACHE_MEMORY_MB', 32)) * 1024 * 1024),
+        disk_dir=disk_dir or None,
+        disk_max_bytes=int(float(os.getenv('TTS_CACHE_DISK_MB', 256)) * 1024 * 1024)
+    )
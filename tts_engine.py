@@ -0,0 +1,218 @@
+"""
+Parallel chunked TTS
+gTTS sends one HTTP request per ~100 characters, one after another, so long
+answers take time proportional to their length. ParallelTTS splits the text
+at Arabic/Latin sentence and clause boundaries into request-sized chunks,
+synthesizes them concurrently on a bounded thread pool and concatenates the
+MPEG frames in order (no re-encoding).
+
+PooledGTTS is a gTTS subclass that sends its requests through one shared
+keep-alive requests.Session instead of opening a new one per request. It is
+defined on first use (pooled_gtts() / import_gtts()) so importing this
+module doesn't import gtts and requests.
+
+gTTS has no public way to pass a session, so PooledGTTS.stream() reuses its
+private _prepare_requests() and parses the batchexecute reply (the jQ1olc
+line) like gTTS.stream() does; requirements.txt pins gtts to the minor
+version this was checked against. A gTTS without _prepare_requests() gets
+plain gTTS back (a new connection per request) rather than a broken subclass.
+"""
+
+import re
+import base64
+import logging
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from sentences import split_sentences
+
+logger = logging.getLogger(__name__)
+
+# gTTS's own per-request text limit
+MAX_CHUNK_CHARS = 100
+
+CLAUSE_END = re.compile(r'(?<=[،؛,;:])\s*')
+_AUDIO_LINE = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
+
+
+def _split_long(piece, max_chars):
+    """Split a piece longer than max_chars at clause boundaries, then at spaces"""
+    if len(piece) <= max_chars:
+        return [piece]
+    parts = []
+    for clause in filter(None, CLAUSE_END.split(piece)):
+        if len(clause) <= max_chars:
+            parts.append(clause)
+            continue
+        current = ''
+        for word in clause.split():
+            while len(word) > max_chars:
+                if current:
+                    parts.append(current)
+                    current = ''
+                parts.append(word[:max_chars])
+                word = word[max_chars:]
+            if current and len(current) + 1 + len(word) > max_chars:
+                parts.append(current)
+                current = word
+            else:
+                current = f'{current} {word}' if current else word
+        if current:
+            parts.append(current)
+    return parts
+
+
+def split_for_tts(text, max_chars=MAX_CHUNK_CHARS):
+    """Cut text into chunks of at most max_chars, preferring sentence then clause boundaries"""
+    pieces = []
+    for sentence in split_sentences(text, min_chars=0):
+        pieces.extend(_split_long(sentence.strip(), max_chars))
+
+    # Pack neighbouring short pieces together so we don't make extra requests
+    chunks = []
+    for piece in filter(None, (p.strip() for p in pieces)):
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] = f'{chunks[-1]} {piece}'
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+def strip_id3(data, keep_header=False):
+    """Drop ID3v2 header (unless keep_header) and ID3v1 trailer so MP3 chunks concatenate cleanly"""
+    if not keep_header and data[:3] == b'ID3' and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        data = data[10 + size + footer:]
+    if len(data) >= 128 and data[-128:-125] == b'TAG':
+        data = data[:-128]
+    return data
+
+
+class ParallelTTS:
+    """Synthesize long text as parallel chunks and join the MP3 frames in order"""
+
+    def __init__(self, synthesize, max_workers=4, max_chars=MAX_CHUNK_CHARS):
+        """synthesize(text, lang) -> mp3 bytes, called once per chunk"""
+        self.synthesize_chunk = synthesize
+        self.max_chars = max_chars
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tts-chunk')
+
+    def synthesize(self, text, lang, **kwargs):
+        """Extra keyword arguments are passed on to every synthesize(chunk, lang) call"""
+        chunks = split_for_tts(text, self.max_chars)
+        if len(chunks) <= 1:
+            return self.synthesize_chunk(chunks[0] if chunks else text, lang, **kwargs)
+        logger.info(f"Synthesizing {len(chunks)} TTS chunks in parallel")
+        futures = [self.executor.submit(self.synthesize_chunk, chunk, lang, **kwargs) for chunk in chunks]
+        try:
+            parts = [future.result() for future in futures]
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        return b''.join(
+            strip_id3(part, keep_header=(i == 0)) for i, part in enumerate(parts)
+        )
+
+
+_session = None
+_session_lock = threading.Lock()
+_pooled_gtts = None
+
+
+def shared_session(pool_size=16):
+    """Process-wide keep-alive session for Google TTS requests"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def reset_session():
+    """Forget a session (and its open connections) inherited from a parent process"""
+    global _session
+    with _session_lock:
+        _session = None
+
+
+def _define_pooled_gtts():
+    # gtts and requests are imported here, on first use, not with the server
+    import requests
+    from gtts import gTTS, gTTSError
+
+    if not callable(getattr(gTTS, '_prepare_requests', None)):
+        logger.warning("Unsupported gTTS version: Google TTS requests won't share connections")
+        return gTTS
+
+    class PooledGTTS(gTTS):
+        """gTTS that reuses one keep-alive HTTP session across requests and threads"""
+
+        def stream(self):
+            session = shared_session()
+            for prepared in self._prepare_requests():
+                try:
+                    response = session.send(
+                        prepared,
+                        proxies=urllib.request.getproxies(),
+                        timeout=self.timeout
+                    )
+                    response.raise_for_status()
+                except requests.exceptions.HTTPError:
+                    raise gTTSError(tts=self, response=response)
+                except requests.exceptions.RequestException:
+                    raise gTTSError(tts=self)
+
+                found = False
+                for line in response.iter_lines(chunk_size=1024):
+                    decoded = line.decode('utf-8')
+                    if 'jQ1olc' in decoded:
+                        match = _AUDIO_LINE.search(decoded)
+                        if not match:
+                            raise gTTSError(tts=self, response=response)
+                        found = True
+                        yield base64.b64decode(match.group(1).encode('ascii'))
+                if not found:
+                    # A changed reply format must not turn into silent, empty audio
+                    raise gTTSError(tts=self, response=response)
+
+    return PooledGTTS
+
+
+def import_gtts():
+    """The PooledGTTS class, defined (and gtts imported) on first use"""
+    global _pooled_gtts
+    with _session_lock:
+        if _pooled_gtts is None:
+            _pooled_gtts = _define_pooled_gtts()
+        return _pooled_gtts
+
+
+def pooled_gtts(text, lang='ar', **kwargs):
+    """PooledGTTS(text=text, lang=lang, ...) without importing gtts before the first call"""
+    return import_gtts()(text=text, lang=lang, **kwargs)
+
+
+def warm(connect=False):
+    """Import gtts now; connect=True also opens a keep-alive connection to Google TTS"""
+    import_gtts()
+    if connect:
+        try:
+            shared_session().head('https://translate.google.com', timeout=5)
+        except Exception as e:
+            logger.warning(f"Google TTS warmup request failed: {str(e)}")
+
+
+def __getattr__(name):
+    # `from tts_engine import PooledGTTS` still works, at the cost of importing gtts
+    if name == 'PooledGTTS':
+        return import_gtts()
+    raise AttributeError(name)
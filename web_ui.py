@@ -0,0 +1,153 @@
+"""
+Precompiled web UI
+The embedded HTML page is built once at startup instead of being rendered
+on every request. Every file is stored as identity, gzip and (when the
+optional brotli package is installed) brotli bytes, each with a strong ETag,
+so a request only costs an Accept-Encoding pick and an If-None-Match check.
+
+With split_assets the inline <style> and <script> become separate files
+named after their content hash (/assets/app.<hash>.css): they are cached
+for a year, and only the small HTML page is revalidated on each visit.
+
+    ui = WebUI(HTML_PAGE, split_assets=True)
+    status, body, headers = ui.respond('index.html', accept_encoding, if_none_match)
+"""
+
+import re
+import gzip
+import hashlib
+import logging
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ASSET_PREFIX = '/assets/'
+# Preferred first when the client accepts several
+ENCODINGS = ('br', 'gzip', 'identity')
+PAGE_CACHE_CONTROL = 'no-cache'
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_STYLE = re.compile(r'<style>(.*?)</style>', re.S)
+_SCRIPT = re.compile(r'<script>(.*?)</script>', re.S)
+
+
+class Asset:
+    """One file of the UI, precompressed in every supported encoding"""
+
+    def __init__(self, body, mimetype, cache_control):
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.version = digest[:10]
+        self.variants = {'identity': body}
+        self.variants['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+        # Strong validators differ per encoding, since the bytes differ
+        self.etags = {
+            encoding: f'"{digest}"' if encoding == 'identity' else f'"{digest}-{encoding}"'
+            for encoding in self.variants
+        }
+
+    def stats(self):
+        return {encoding: len(body) for encoding, body in self.variants.items()}
+
+
+def parse_accept_encoding(header):
+    """{coding: q} from an Accept-Encoding header"""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(header, available):
+    """Best encoding in available for an Accept-Encoding header (identity unless refused)"""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get('*')
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        q = accepted.get(encoding, wildcard)
+        if q is None:
+            q = 0.001 if encoding == 'identity' else 0.0  # identity is acceptable unless excluded
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def etag_matches(if_none_match, etags):
+    """True if an If-None-Match header matches one of the representation's ETags"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return any(etag in tags for etag in etags)
+
+
+class WebUI:
+    """Precompressed UI files served by name ('index.html' or an asset file name)"""
+
+    def __init__(self, html, split_assets=False):
+        self.split_assets = split_assets
+        self.assets = {}
+        if split_assets:
+            html = self._split(html)
+        self.assets['index.html'] = Asset(html.encode('utf-8'), 'text/html; charset=utf-8', PAGE_CACHE_CONTROL)
+        logger.info(f"Web UI built: {self.stats()}")
+
+    def _split(self, html):
+        def extract(pattern, extension, mimetype, tag):
+            nonlocal html
+            match = pattern.search(html)
+            if match is None:
+                return
+            asset = Asset(match.group(1).strip().encode('utf-8'), mimetype, ASSET_CACHE_CONTROL)
+            name = f'app.{asset.version}.{extension}'
+            self.assets[name] = asset
+            html = html[:match.start()] + tag.format(url=ASSET_PREFIX + name) + html[match.end():]
+
+        extract(_STYLE, 'css', 'text/css; charset=utf-8', '<link rel="stylesheet" href="{url}">')
+        extract(_SCRIPT, 'js', 'text/javascript; charset=utf-8', '<script src="{url}"></script>')
+        return html
+
+    def respond(self, name, accept_encoding=None, if_none_match=None):
+        """(status, body, headers) for a GET of the named file; None if there is no such file"""
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+        encoding = choose_encoding(accept_encoding, asset.variants)
+        if encoding is None:
+            return 406, b'', {'Vary': 'Accept-Encoding'}
+        headers = {
+            'ETag': asset.etags[encoding],
+            'Cache-Control': asset.cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+        if etag_matches(if_none_match, asset.etags.values()):
+            return 304, b'', headers
+        headers['Content-Type'] = asset.mimetype
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return 200, asset.variants[encoding], headers
+
+    def stats(self):
+        return {name: asset.stats() for name, asset in self.assets.items()}